@@ -0,0 +1,59 @@
+#!/usr/bin/env bash
+# X-filter: A black hole for Internet advertisements
+# (c) 2018 X-filter, LLC (https://x-filter.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Write the metadata shown by the Block Page, so that it is not recomputed for each blocked request
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+
+# Every path is within XFILTER_ROOT, which is set in the environment or in /etc/xfilter/setupVars.conf
+: "${XFILTER_ROOT=$(sed -n 's/^XFILTER_ROOT=//p' /etc/xfilter/setupVars.conf 2> /dev/null)}"
+xfilterDir="${XFILTER_ROOT}/etc/xfilter"
+setupVars="${xfilterDir}/setupVars.conf"
+manifest="${xfilterDir}/blockpage.json"
+coreRepo="${XFILTER_ROOT}/etc/.xfilter"
+
+# The adlists file is left empty if there is none, which the Block Page reports
+if [[ -f "${xfilterDir}/adlists.list" ]]; then
+  adLists="${xfilterDir}/adlists.list"
+elif [[ -f "${xfilterDir}/adlists.default" ]]; then
+  adLists="${xfilterDir}/adlists.default"
+else
+  adLists=""
+fi
+
+version=$(cd "${coreRepo}" 2> /dev/null && git describe --long --tags 2> /dev/null)
+email=$(sed -n 's/^ADMIN_EMAIL=//p' "${setupVars}" 2> /dev/null | tail -n 1)
+password=$(sed -n 's/^WEBPASSWORD=//p' "${setupVars}" 2> /dev/null | tail -n 1)
+
+listsGenerated=false
+for list in "${xfilterDir}"/list.0.*.domains; do
+  [[ -e "${list}" ]] && listsGenerated=true
+done
+
+# The adlist IDs shown by the Block Page are the positions of the URLs starting with "http" or "www"
+awk -v version="${version}" -v email="${email}" -v password="${password:+true}" \
+  -v generated="${listsGenerated}" -v adLists="${adLists}" '
+  function json(s,   parts, n, i, escaped) {
+    # Backslashes are escaped without gsub, whose handling of them in replacements differs between awks
+    n = split(s, parts, "\\")
+    escaped = parts[1]
+    for(i = 2; i <= n; i++) { escaped = escaped "\\\\" parts[i] }
+    s = escaped
+    gsub(/"/, "\\\"", s)
+    gsub(/\t/, "\\t", s)
+    return "\"" s "\""
+  }
+  { sub(/\r$/, "") }
+  tolower($0) ~ /^(http|www)/ { url[n++] = $0 }
+  END {
+    printf "{\n  \"version\": %s,\n  \"admin_email\": %s,\n  \"web_password\": %s,\n", json(version), json(email), password ? "true" : "false"
+    printf "  \"lists_generated\": %s,\n  \"adlists_file\": %s,\n  \"list_count\": %d,\n  \"adlists\": [", generated, json(adLists), n + 3
+    for(i = 0; i < n; i++) { printf "%s\n    %s", (i ? "," : ""), json(url[i]) }
+    printf "%s]\n}\n", (n ? "\n  " : "")
+  }' "${adLists:-/dev/null}" > "${manifest}.tmp"
+
+mv "${manifest}.tmp" "${manifest}"
+chmod 644 "${manifest}"
@@ -11,32 +11,58 @@
 LC_ALL=C
 LC_NUMERIC=C
 
+# Every path is within XFILTER_ROOT, which is set in the environment or in /etc/xfilter/setupVars.conf
+: "${XFILTER_ROOT=$(sed -n 's/^XFILTER_ROOT=//p' /etc/xfilter/setupVars.conf 2> /dev/null)}"
+
+# Open a connection to FTL, which is kept open for every following request
+ftl_connect() {
+    local ftl_port
+
+    [[ -n "${ftl_fd:-}" ]] && return 0
+
+    ftl_port=$(cat "${XFILTER_ROOT}/var/run/xfilter-FTL.port" 2> /dev/null)
+    if [[ -z "$ftl_port" ]] || ! { exec {ftl_fd}<>"/dev/tcp/127.0.0.1/$ftl_port"; } 2> /dev/null; then
+        ftl_fd=""
+        return 1
+    fi
+}
+
+# Close the connection to FTL
+ftl_disconnect() {
+    if [[ -n "${ftl_fd:-}" ]]; then
+        echo ">quit" 1>&"${ftl_fd}" 2> /dev/null
+        exec {ftl_fd}>&-
+        ftl_fd=""
+    fi
+}
+
 # Retrieve stats from FTL engine
+# Each argument is sent as a command within a single write, and each reply is read into ftl_reply
+# A lost connection (e.g. FTL restarted) is re-established once
 xfilter-FTL() {
-    ftl_port=$(cat /var/run/xfilter-FTL.port 2> /dev/null)
-    if [[ -n "$ftl_port" ]]; then
-        # Open connection to FTL
-        exec 3<>"/dev/tcp/127.0.0.1/$ftl_port"
-
-        # Test if connection is open
-        if { "true" >&3; } 2> /dev/null; then
-            # Send command to FTL
-            echo -e ">$1" >&3
-
-            # Read input
-            read -r -t 1 LINE <&3
-            until [[ ! $? ]] || [[ "$LINE" == *"EOM"* ]]; do
-                echo "$LINE" >&1
-                read -r -t 1 LINE <&3
+    local line i
+
+    for _ in 1 2; do
+        ftl_reply=()
+        ftl_connect || return 1
+
+        if printf ">%s\\n" "$@" 1>&"${ftl_fd}" 2> /dev/null; then
+            for (( i = 0; i < $#; i++ )); do
+                ftl_reply[i]=""
+                while read -r -t 1 line <&"${ftl_fd}"; do
+                    [[ "$line" == *"EOM"* ]] && continue 2
+                    [[ -n "$line" ]] && ftl_reply[i]+="${line}"$'\n'
+                done
+                # FTL did not finish its reply
+                break
             done
-
-            # Close connection
-            exec 3>&-
-            exec 3<&-
+            [[ "$i" -eq "$#" ]] && return 0
         fi
-    else
-        echo "0"
-    fi
+
+        ftl_disconnect
+    done
+
+    return 1
 }
 
 # Print spaces to align right-side additional text
@@ -132,9 +158,9 @@ get_init_stats() {
     }
 
     # Set Colour Codes
-    coltable="/opt/xfilter/COL_TABLE"
+    coltable="${XFILTER_ROOT}/opt/xfilter/COL_TABLE"
     if [[ -f "${coltable}" ]]; then
-        source ${coltable}
+        source "${coltable}"
     else
         COL_NC="[0m"
         COL_DARK_GRAY="[1;30m"
@@ -208,8 +234,8 @@ get_init_stats() {
     fi
 
     # Test existence of setupVars config
-    if [[ -f "/etc/xfilter/setupVars.conf" ]]; then
-        setupVars="/etc/xfilter/setupVars.conf"
+    if [[ -f "${XFILTER_ROOT}/etc/xfilter/setupVars.conf" ]]; then
+        setupVars="${XFILTER_ROOT}/etc/xfilter/setupVars.conf"
     fi
 }
 
@@ -361,45 +387,52 @@ get_sys_stats() {
         ph_dhcp_range=$(seq -s "|" -f "${DHCP_START%.*}.%g" "${DHCP_START##*.}" "${DHCP_END##*.}")
 
         # Count dynamic leases from available range, and not static leases
-        ph_dhcp_num=$(grep -cE "$ph_dhcp_range" "/etc/xfilter/dhcp.leases")
+        ph_dhcp_num=$(grep -cE "$ph_dhcp_range" "${XFILTER_ROOT}/etc/xfilter/dhcp.leases")
         ph_dhcp_percent=$(( ph_dhcp_num * 100 / ph_dhcp_max ))
     fi
 }
 
 get_ftl_stats() {
-    local stats_raw
-
-    mapfile -t stats_raw < <(xfilter-FTL "stats")
-    domains_being_blocked_raw="${stats_raw[0]#* }"
-    dns_queries_today_raw="${stats_raw[1]#* }"
-    ads_blocked_today_raw="${stats_raw[2]#* }"
-    ads_percentage_today_raw="${stats_raw[3]#* }"
-    queries_forwarded_raw="${stats_raw[5]#* }"
-    queries_cached_raw="${stats_raw[6]#* }"
-
-    # Only retrieve these stats when not called from jsonFunc
-    if [[ -z "$1" ]]; then
-        local top_ad_raw
-        local top_domain_raw
-        local top_client_raw
-
-        domains_being_blocked=$(printf "%.0f\\n" "${domains_being_blocked_raw}" 2> /dev/null)
-        dns_queries_today=$(printf "%.0f\\n" "${dns_queries_today_raw}")
-        ads_blocked_today=$(printf "%.0f\\n" "${ads_blocked_today_raw}")
-        ads_percentage_today=$(printf "%'.0f\\n" "${ads_percentage_today_raw}")
-        queries_cached_percentage=$(printf "%.0f\\n" "$(calcFunc "$queries_cached_raw * 100 / ( $queries_forwarded_raw + $queries_cached_raw )")")
-        recent_blocked=$(xfilter-FTL recentBlocked)
-        read -r -a top_ad_raw <<< "$(xfilter-FTL "top-ads (1)")"
-        read -r -a top_domain_raw <<< "$(xfilter-FTL "top-domains (1)")"
-        read -r -a top_client_raw <<< "$(xfilter-FTL "top-clients (1)")"
-
-        top_ad="${top_ad_raw[2]}"
-        top_domain="${top_domain_raw[2]}"
-        if [[ "${top_client_raw[3]}" ]]; then
-            top_client="${top_client_raw[3]}"
-        else
-            top_client="${top_client_raw[2]}"
-        fi
+    local key value
+    local -A stats
+
+    # Retrieve every stat with a single request
+    xfilter-FTL "stats" "recentBlocked" "top-ads (1)" "top-domains (1)" "top-clients (1)"
+
+    while read -r key value; do
+        [[ -n "$key" ]] && stats["$key"]="$value"
+    done <<< "${ftl_reply[0]}"
+
+    domains_being_blocked_raw="${stats[domains_being_blocked]:-0}"
+    dns_queries_today_raw="${stats[dns_queries_today]:-0}"
+    ads_blocked_today_raw="${stats[ads_blocked_today]:-0}"
+    ads_percentage_today_raw="${stats[ads_percentage_today]:-0}"
+    queries_forwarded_raw="${stats[queries_forwarded]:-0}"
+    queries_cached_raw="${stats[queries_cached]:-0}"
+
+    local top_ad_raw
+    local top_domain_raw
+    local top_client_raw
+
+    domains_being_blocked=$(printf "%.0f\\n" "${domains_being_blocked_raw}" 2> /dev/null)
+    dns_queries_today=$(printf "%.0f\\n" "${dns_queries_today_raw}")
+    ads_blocked_today=$(printf "%.0f\\n" "${ads_blocked_today_raw}")
+    ads_percentage_today=$(printf "%'.0f\\n" "${ads_percentage_today_raw}")
+    queries_cached_percentage=$(printf "%.0f\\n" "$(calcFunc "$queries_cached_raw * 100 / ( $queries_forwarded_raw + $queries_cached_raw )")")
+    recent_blocked="${ftl_reply[1]%$'\n'}"
+    read -r -a top_ad_raw <<< "${ftl_reply[2]}"
+    read -r -a top_domain_raw <<< "${ftl_reply[3]}"
+    read -r -a top_client_raw <<< "${ftl_reply[4]}"
+
+    # FTL is offline
+    [[ -z "${ftl_reply[*]}" ]] && recent_blocked="0"
+
+    top_ad="${top_ad_raw[2]}"
+    top_domain="${top_domain_raw[2]}"
+    if [[ "${top_client_raw[3]}" ]]; then
+        top_client="${top_client_raw[3]}"
+    else
+        top_client="${top_client_raw[2]}"
     fi
 }
 
@@ -534,9 +567,142 @@ chronoFunc() {
     done
 }
 
+# Determine which collectors are needed for the requested JSON fields
+# This is done once, so each sample only runs the collectors which were asked for
+json_setup() {
+    local field command
+    local -A requested
+
+    IFS="," read -r -a json_fields <<< "${json_fields_arg:-domains_being_blocked,dns_queries_today,ads_blocked_today,ads_percentage_today}"
+
+    json_ftl_commands=()
+    json_sys_collectors=""
+    for field in "${json_fields[@]}"; do
+        case "$field" in
+            domains_being_blocked|dns_queries_today|ads_blocked_today|ads_percentage_today|unique_domains|queries_forwarded|queries_cached)
+                command="stats";;
+            recent_blocked) command="recentBlocked";;
+            top_ad        ) command="top-ads (1)";;
+            top_domain    ) command="top-domains (1)";;
+            top_client    ) command="top-clients (1)";;
+            uptime|load|memory_percent|temperature|status) command="";;
+            *             ) echo "Unknown field: $field" >&2; exit 1;;
+        esac
+        if [[ -n "$command" ]]; then
+            [[ -z "${requested[$command]}" ]] && json_ftl_commands+=("$command")
+            requested["$command"]=true
+        else
+            json_sys_collectors+=" $field"
+        fi
+    done
+
+    # Detect the temperature file and setupVars once, as get_init_stats would
+    if [[ "$json_sys_collectors" == *"temperature"* ]]; then
+        if [[ -f "/sys/class/thermal/thermal_zone0/temp" ]]; then
+            temp_file="/sys/class/thermal/thermal_zone0/temp"
+        elif [[ -f "/sys/class/hwmon/hwmon0/temp1_input" ]]; then
+            temp_file="/sys/class/hwmon/hwmon0/temp1_input"
+        fi
+    fi
+    [[ -f "${XFILTER_ROOT}/etc/xfilter/setupVars.conf" ]] && setupVars="${XFILTER_ROOT}/etc/xfilter/setupVars.conf"
+}
+
+# Collect the requested fields into json_values, using only shell builtins and the FTL connection
+json_collect() {
+    local i key value line rest
+    local -a top
+    json_values=()
+
+    if [[ "${#json_ftl_commands[@]}" -gt 0 ]] && xfilter-FTL "${json_ftl_commands[@]}"; then
+        for (( i = 0; i < ${#json_ftl_commands[@]}; i++ )); do
+            case "${json_ftl_commands[i]}" in
+                "stats")
+                    while read -r key value; do
+                        [[ -n "$key" ]] && json_values["$key"]="$value"
+                    done <<< "${ftl_reply[i]}";;
+                "recentBlocked")
+                    json_values["recent_blocked"]="\"${ftl_reply[i]%$'\n'}\"";;
+                "top-"*)
+                    read -r -a top <<< "${ftl_reply[i]}"
+                    key="${json_ftl_commands[i]%%s (*}"
+                    [[ -n "${top[2]}" ]] && json_values["${key/-/_}"]="\"${top[-1]}\"";;
+            esac
+        done
+    fi
+
+    for key in $json_sys_collectors; do
+        case "$key" in
+            "uptime")
+                read -r value rest < /proc/uptime
+                json_values["uptime"]="${value%.*}";;
+            "load")
+                read -r value line rest < /proc/loadavg
+                json_values["load"]="[${value},${line},${rest%% *}]";;
+            "memory_percent")
+                local total=0 free=0 buffers=0 cached=0
+                while read -r key value rest; do
+                    case "$key" in
+                        "MemTotal:") total="$value";;
+                        "MemFree:" ) free="$value";;
+                        "Buffers:" ) buffers="$value";;
+                        "Cached:"  ) cached="$value"; break;;
+                    esac
+                done < /proc/meminfo
+                [[ "$total" -gt 0 ]] && json_values["memory_percent"]="$(( (total - free - buffers - cached) * 100 / total ))";;
+            "temperature")
+                if [[ -n "$temp_file" ]] && read -r value < "$temp_file"; then
+                    json_values["temperature"]="$(( value / 1000 )).$(( value % 1000 / 100 ))"
+                fi;;
+            "status")
+                value="unknown"
+                if [[ -n "$setupVars" ]]; then
+                    while IFS="=" read -r key line; do
+                        [[ "$key" == "BLOCKING_ENABLED" ]] && value="$line"
+                    done < "$setupVars"
+                fi
+                case "$value" in
+                    "true" ) value="enabled";;
+                    "false") value="disabled";;
+                esac
+                json_values["status"]="\"$value\"";;
+        esac
+    done
+}
+
+# Print the collected fields as a single line JSON object, with unavailable fields as null
+json_print() {
+    local field out="" now
+
+    if [[ -n "$json_interval" ]]; then
+        printf -v now '%(%s)T' -1
+        out="\"timestamp\":${now},"
+    fi
+    for field in "${json_fields[@]}"; do
+        out+="\"${field}\":${json_values[$field]:-null},"
+    done
+    echo "{${out%,}}"
+}
+
 jsonFunc() {
-    get_ftl_stats "json"
-    echo "{\"domains_being_blocked\":${domains_being_blocked_raw},\"dns_queries_today\":${dns_queries_today_raw},\"ads_blocked_today\":${ads_blocked_today_raw},\"ads_percentage_today\":${ads_percentage_today_raw}}"
+    local -A json_values
+    local sleep_fd
+
+    json_setup
+
+    if [[ -z "$json_interval" ]]; then
+        json_collect
+        json_print
+        ftl_disconnect
+        exit 0
+    fi
+
+    # Stream one object per interval, waiting with read on a pipe which never receives input, instead of forking sleep
+    exec {sleep_fd}<> <(:)
+    for (( ; ; )); do
+        json_collect
+        json_print
+        read -r -t "$json_interval" -u "$sleep_fd"
+    done
 }
 
 helpFunc() {
@@ -549,9 +715,16 @@ Calculates stats and displays to an LCD
 
 Options:
   -j, --json          Output stats as JSON formatted string
+  -i, --interval      With --json, output stats every # seconds as newline-delimited JSON
+  -f, --fields        With --json, comma separated fields to output
   -r, --refresh       Set update frequency (in seconds)
   -e, --exit          Output stats and exit witout refreshing
-  -h, --help          Display this help text"
+  -h, --help          Display this help text
+
+JSON fields:
+  domains_being_blocked, dns_queries_today, ads_blocked_today, ads_percentage_today (default)
+  unique_domains, queries_forwarded, queries_cached, recent_blocked, top_ad, top_domain,
+  top_client, uptime, load, memory_percent, temperature, status"
   fi
 
   exit 0
@@ -561,12 +734,23 @@ if [[ $# = 0 ]]; then
     chronoFunc
 fi
 
-for var in "$@"; do
-    case "$var" in
-        "-j" | "--json"    ) jsonFunc;;
-        "-h" | "--help"    ) helpFunc;;
-        "-r" | "--refresh" ) chronoFunc "$@";;
-        "-e" | "--exit"    ) chronoFunc "$@";;
-        *                  ) helpFunc "?";;
+while [[ $# -gt 0 ]]; do
+    case "$1" in
+        "-j" | "--json"     ) json=true;;
+        "-i" | "--interval" ) json_interval="$2"; shift;;
+        "-f" | "--fields"   ) json_fields_arg="$2"; shift;;
+        "-h" | "--help"     ) helpFunc;;
+        "-r" | "--refresh"  ) chronoFunc "$@";;
+        "-e" | "--exit"     ) chronoFunc "$@";;
+        *                   ) helpFunc "?";;
     esac
+    shift
 done
+
+if [[ -n "$json_interval" ]] && [[ ! "$json_interval" =~ ^[0-9]*\.?[0-9]+$ ]]; then
+    helpFunc "?"
+fi
+
+if [[ -n "$json" ]]; then
+    jsonFunc
+fi
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# X-filter: A black hole for Internet advertisements
+# (c) 2018 X-filter, LLC (https://x-filter.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Client for the FTL API, which keeps a single connection open
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+"""Query FTL over its telnet API, sending several commands per round-trip.
+
+Usage as a module:
+
+    with FTLClient() as ftl:
+        stats, top_ads = ftl.query("stats", "top-ads (1)")
+
+Usage from the command line prints each reply as JSON:
+
+    ftlapi.py stats "top-clients (5)"
+"""
+
+from __future__ import print_function
+
+import json
+import socket
+import sys
+
+from xfilterRoot import ROOT
+
+PORT_FILE = ROOT + "/var/run/xfilter-FTL.port"
+EOM = "---EOM---"
+
+
+class FTLError(Exception):
+    """FTL is not running, or the connection to it was lost."""
+
+
+class FTLClient(object):
+    """A connection to FTL, which is reused by every request."""
+
+    def __init__(self, port_file=PORT_FILE, host="127.0.0.1", timeout=2.0):
+        self.port_file = port_file
+        self.host = host
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+
+    def connect(self):
+        if self._sock is not None:
+            return
+        try:
+            with open(self.port_file) as f:
+                port = int(f.read().strip())
+            self._sock = socket.create_connection((self.host, port),
+                                                  self.timeout)
+        except (IOError, OSError, ValueError) as e:
+            raise FTLError("Unable to connect to FTL: %s" % e)
+        self._reader = self._sock.makefile("rb")
+
+    def close(self):
+        if self._sock is None:
+            return
+        try:
+            self._sock.sendall(b">quit\n")
+        except (IOError, OSError):
+            pass
+        self._reader.close()
+        self._sock.close()
+        self._sock = None
+        self._reader = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, *commands):
+        """Send each command within a single write.
+
+        The lines of each reply are returned in order. The connection is
+        re-established once if FTL has closed it, e.g. after a restart.
+        """
+        for attempt in (1, 2):
+            self.connect()
+            try:
+                return self._request(commands)
+            except (IOError, OSError, FTLError):
+                self.close()
+                if attempt == 2:
+                    raise FTLError("Lost connection to FTL")
+
+    def _request(self, commands):
+        message = "".join(">%s\n" % command for command in commands)
+        self._sock.sendall(message.encode("utf-8"))
+
+        replies = []
+        for _ in commands:
+            lines = []
+            while True:
+                line = self._reader.readline()
+                if not line:
+                    raise FTLError("Connection closed by FTL")
+                line = line.decode("utf-8", "replace").rstrip("\r\n")
+                if EOM in line:
+                    break
+                if line:
+                    lines.append(line)
+            replies.append(lines)
+        return replies
+
+    def query(self, *commands):
+        """Send each command, returning each reply parsed by parse_reply."""
+        replies = self.request(*commands)
+        return [parse_reply(c, r) for c, r in zip(commands, replies)]
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def parse_stats(lines):
+    """Parse "key value" lines into a dict, e.g. {"unique_clients": 12}."""
+    stats = {}
+    for line in lines:
+        key, _, value = line.partition(" ")
+        stats[key] = _number(value.strip())
+    return stats
+
+
+def parse_top(lines):
+    """Parse "rank count name..." lines into a list of {"count", "name"} dicts.
+
+    Top clients may include a hostname after their IP address, which is
+    preferred as the name.
+    """
+    top = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        top.append({"count": _number(fields[1]), "name": fields[-1]})
+    return top
+
+
+def parse_reply(command, lines):
+    name = command.split()[0] if command else ""
+    if name == "stats":
+        return parse_stats(lines)
+    if name.startswith("top-"):
+        return parse_top(lines)
+    if name == "recentBlocked":
+        return lines[0] if lines else ""
+    return lines
+
+
+def main(argv):
+    commands = argv[1:] or ["stats"]
+    try:
+        with FTLClient() as ftl:
+            replies = ftl.query(*commands)
+    except FTLError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(dict(zip(commands, replies)), sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
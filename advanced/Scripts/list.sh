@@ -9,23 +9,30 @@
 # Please see LICENSE file for your rights under this license.
 
 # Globals
+# Every path is within XFILTER_ROOT, which is set in the environment or in /etc/xfilter/setupVars.conf
+: "${XFILTER_ROOT=$(sed -n 's/^XFILTER_ROOT=//p' /etc/xfilter/setupVars.conf 2> /dev/null)}"
+export XFILTER_ROOT
+
 basename=xfilter
-xfilterDir=/etc/"${basename}"
+xfilterDir="${XFILTER_ROOT}"/etc/"${basename}"
 whitelist="${xfilterDir}"/whitelist.txt
 blacklist="${xfilterDir}"/blacklist.txt
 
-readonly regexlist="/etc/xfilter/regex.list"
+readonly regexlist="${xfilterDir}/regex.list"
 reload=false
+noreload=false
 addmode=true
 verbose=true
 wildcard=false
+fromFile=""
 
+argList=()
 domList=()
 
 listMain=""
 listAlt=""
 
-colfile="/opt/xfilter/COL_TABLE"
+colfile="${XFILTER_ROOT}/opt/xfilter/COL_TABLE"
 source ${colfile}
 
 
@@ -54,41 +61,94 @@ Options:
   -q, --quiet         Make output less verbose
   -h, --help          Show this help dialog
   -l, --list          Display all your ${type}listed domains
-  --nuke              Removes all entries in a list"
+  --nuke              Removes all entries in a list
+  --from-file <file>  Read domains from a file (one per line), or from stdin if <file> is -"
 
   exit 0
 }
 
-EscapeRegexp() {
-    # This way we may safely insert an arbitrary
-    # string in our regular expressions
-    # This sed is intentionally executed in three steps to ease maintainability
-    # The first sed removes any amount of leading dots
-    echo $* | sed 's/^\.*//' | sed "s/[]\.|$(){}?+*^]/\\\\&/g" | sed "s/\\//\\\\\//g"
+HandleOther() {
+    # Convert to lowercase, arguments are validated all at once by ValidateDomains
+    argList+=("${1,,}")
 }
 
-HandleOther() {
-    # Convert to lowercase
-    domain="${1,,}"
+ReadDomainFile() {
+    local file="${1}"
+
+    if [[ "${file}" != "-" ]] && [[ ! -r "${file}" ]]; then
+        echo -e "  ${CROSS} Unable to read ${file}"
+        exit 1
+    fi
+
+    # Read one domain per line, ignoring comments, blank lines and surrounding whitespace
+    mapfile -t -O "${#argList[@]}" argList < <(awk '{sub(/\r$/, ""); gsub(/^[ \t]+|[ \t]+$/, "")} $0 != "" && !/^#/ {print tolower($0)}' "${file}")
+}
+
+ValidateDomains() {
+    local domain
+    local -A validDomains
+
+    # Don't check validity of regex entries
+    if [[ "${listMain}" == "${regexlist}" && "${wildcard}" == false ]]; then
+        for domain in "${argList[@]}"; do
+            [[ -n "${domain}" ]] && domList+=("${domain}")
+        done
+        return
+    fi
+
+    # Check the total length, the length of each label and for valid chars of every domain with a single grep
+    while IFS= read -r domain; do
+        validDomains["${domain}"]=true
+    done < <(printf "%s\\n" "${argList[@]}" | grep -P "^(?=.{1,253}$)(?=[^\\.]{1,63}(\\.[^\\.]{1,63})*$)((-|_)*[a-z\\d]((-|_)*[a-z\\d])*(-|_)*)(\\.(-|_)*([a-z\\d]((-|_)*[a-z\\d])*))*$")
 
-    # Check validity of domain (don't check for regex entries)
-    if [[ "${#domain}" -le 253 ]]; then
-        if [[ "${listMain}" == "${regexlist}" && "${wildcard}" == false ]]; then
-            validDomain="${domain}"
+    for domain in "${argList[@]}"; do
+        if [[ -n "${domain}" ]] && [[ -n "${validDomains[${domain}]:-}" ]]; then
+            domList+=("${domain}")
         else
-            validDomain=$(grep -P "^((-|_)*[a-z\\d]((-|_)*[a-z\\d])*(-|_)*)(\\.(-|_)*([a-z\\d]((-|_)*[a-z\\d])*))*$" <<< "${domain}") # Valid chars check
-            validDomain=$(grep -P "^[^\\.]{1,63}(\\.[^\\.]{1,63})*$" <<< "${validDomain}") # Length of each label
+            echo -e "  ${CROSS} ${domain} is not a valid argument or domain name!"
         fi
-    fi
+    done
+}
+
+# Print the entries of a list, in the form they are compared against
+# Whitelist and blacklist entries are compared case-insensitively, regex entries are compared exactly
+ListEntries() {
+    local list="${1}"
 
-    if [[ -n "${validDomain}" ]]; then
-        domList=("${domList[@]}" ${validDomain})
+    [[ -f "${list}" ]] || return 0
+    if [[ "${list}" == "${regexlist}" ]]; then
+        awk '$0 != ""' "${list}"
     else
-        echo -e "  ${CROSS} ${domain} is not a valid argument or domain name!"
+        awk '$0 != "" {print tolower($0)}' "${list}"
+    fi
+}
+
+# Atomically rewrite a list, dropping the entries read from stdin and appending any further arguments
+WriteList() {
+    local list="${1}"
+    shift
+
+    [[ -f "${list}" ]] || touch "${list}"
+    awk -v exact="$([[ "${list}" == "${regexlist}" ]] && echo 1)" '
+        FILENAME == "-" { remove[$0]; next }
+        { key = exact ? $0 : tolower($0) }
+        !(key in remove)
+    ' - "${list}" > "${list}.tmp" || return 1
+    if [[ "$#" -gt 0 ]]; then
+        printf "%s\\n" "$@" >> "${list}.tmp"
     fi
+
+    # Keep the ownership and permissions of the original list
+    chown --reference="${list}" "${list}.tmp" 2> /dev/null
+    chmod --reference="${list}" "${list}.tmp" 2> /dev/null
+    mv "${list}.tmp" "${list}"
 }
 
 PoplistFile() {
+    local dom listname altname
+    local -a additions mainRemovals altRemovals
+    local -A mainEntries altEntries
+
     # Check whitelist file exists, and if not, create it
     if [[ ! -f "${whitelist}" ]]; then
         touch "${whitelist}"
@@ -99,113 +159,68 @@ PoplistFile() {
         touch "${blacklist}"
     fi
 
-    for dom in "${domList[@]}"; do
-        # Logic: If addmode then add to desired list and remove from the other; if delmode then remove from desired list but do not add to the other
-        if ${addmode}; then
-            AddDomain "${dom}" "${listMain}"
-            RemoveDomain "${dom}" "${listAlt}"
-        else
-            RemoveDomain "${dom}" "${listMain}"
-        fi
-  done
-}
-
-AddDomain() {
-    list="$2"
-    domain=$(EscapeRegexp "$1")
+    case "${listMain}" in
+        "${whitelist}" ) listname="whitelist"; altname="blacklist"; type="--whitelist-only";;
+        "${blacklist}" ) listname="blacklist"; altname="whitelist"; type="--blacklist-only";;
+        *              ) listname="regex list"; type="--wildcard-only";;
+    esac
 
-    [[ "${list}" == "${whitelist}" ]] && listname="whitelist"
-    [[ "${list}" == "${blacklist}" ]] && listname="blacklist"
+    # Load each list once, so that every domain is looked up in memory
+    while IFS= read -r dom; do
+        mainEntries["${dom}"]=true
+    done < <(ListEntries "${listMain}")
+    if [[ -n "${listAlt}" ]]; then
+        while IFS= read -r dom; do
+            altEntries["${dom}"]=true
+        done < <(ListEntries "${listAlt}")
+    fi
 
-    if [[ "${list}" == "${whitelist}" || "${list}" == "${blacklist}" ]]; then
-        [[ "${list}" == "${whitelist}" && -z "${type}" ]] && type="--whitelist-only"
-        [[ "${list}" == "${blacklist}" && -z "${type}" ]] && type="--blacklist-only"
-        bool=true
-        # Is the domain in the list we want to add it to?
-        grep -Ex -q "${domain}" "${list}" > /dev/null 2>&1 || bool=false
+    for dom in "${domList[@]}"; do
+        [[ "${wildcard}" == true ]] && dom="(^|\\.)${dom//\./\\.}$"
 
-        if [[ "${bool}" == false ]]; then
-            # Domain not found in the whitelist file, add it!
-            if [[ "${verbose}" == true ]]; then
-                echo -e "  ${INFO} Adding ${1} to ${listname}..."
+        # Logic: If addmode then add to desired list and remove from the other; if delmode then remove from desired list but do not add to the other
+        if ${addmode}; then
+            if [[ -z "${mainEntries[${dom}]:-}" ]]; then
+                [[ "${verbose}" == true && -z "${fromFile}" ]] && echo -e "  ${INFO} Adding ${dom} to ${listname}..."
+                mainEntries["${dom}"]=true
+                additions+=("${dom}")
+            else
+                [[ "${verbose}" == true && -z "${fromFile}" ]] && echo -e "  ${INFO} ${dom} already exists in ${listname}, no need to add!"
             fi
-            reload=true
-            # Add it to the list we want to add it to
-            echo "$1" >> "${list}"
-        else
-            if [[ "${verbose}" == true ]]; then
-                echo -e "  ${INFO} ${1} already exists in ${listname}, no need to add!"
+            if [[ -n "${listAlt}" ]] && [[ -n "${altEntries[${dom}]:-}" ]]; then
+                [[ -z "${fromFile}" ]] && echo -e "  ${INFO} Removing ${dom} from ${altname}..."
+                unset "altEntries[${dom}]"
+                altRemovals+=("${dom}")
             fi
-        fi
-    elif [[ "${list}" == "${regexlist}" ]]; then
-        [[ -z "${type}" ]] && type="--wildcard-only"
-        bool=true
-        domain="${1}"
-
-        [[ "${wildcard}" == true ]] && domain="(^|\\.)${domain//\./\\.}$"
-
-        # Is the domain in the list?
-        # Search only for exactly matching lines
-        grep -Fx "${domain}" "${regexlist}" > /dev/null 2>&1 || bool=false
-
-        if [[ "${bool}" == false ]]; then
-            if [[ "${verbose}" == true ]]; then
-                echo -e "  ${INFO} Adding ${domain} to regex list..."
-            fi
-            reload="restart"
-            echo "$domain" >> "${regexlist}"
         else
-            if [[ "${verbose}" == true ]]; then
-                echo -e "  ${INFO} ${domain} already exists in regex list, no need to add!"
+            if [[ -n "${mainEntries[${dom}]:-}" ]]; then
+                [[ -z "${fromFile}" ]] && echo -e "  ${INFO} Removing ${dom} from ${listname}..."
+                unset "mainEntries[${dom}]"
+                mainRemovals+=("${dom}")
+            else
+                [[ "${verbose}" == true && -z "${fromFile}" ]] && echo -e "  ${INFO} ${dom} does not exist in ${listname}, no need to remove!"
             fi
         fi
+    done
+
+    # Write each list once
+    if [[ "${#additions[@]}" -gt 0 ]] || [[ "${#mainRemovals[@]}" -gt 0 ]]; then
+        if [[ "${#mainRemovals[@]}" -gt 0 ]]; then
+            printf "%s\\n" "${mainRemovals[@]}"
+        fi | WriteList "${listMain}" "${additions[@]}"
+        reload=true
+    fi
+    if [[ "${#altRemovals[@]}" -gt 0 ]]; then
+        printf "%s\\n" "${altRemovals[@]}" | WriteList "${listAlt}"
+        reload=true
     fi
-}
 
-RemoveDomain() {
-    list="$2"
-    domain=$(EscapeRegexp "$1")
-
-    [[ "${list}" == "${whitelist}" ]] && listname="whitelist"
-    [[ "${list}" == "${blacklist}" ]] && listname="blacklist"
-
-    if [[ "${list}" == "${whitelist}" || "${list}" == "${blacklist}" ]]; then
-        bool=true
-        [[ "${list}" == "${whitelist}" && -z "${type}" ]] && type="--whitelist-only"
-        [[ "${list}" == "${blacklist}" && -z "${type}" ]] && type="--blacklist-only"
-        # Is it in the list? Logic follows that if its whitelisted it should not be blacklisted and vice versa
-        grep -Ex -q "${domain}" "${list}" > /dev/null 2>&1 || bool=false
-        if [[ "${bool}" == true ]]; then
-            # Remove it from the other one
-            echo -e "  ${INFO} Removing $1 from ${listname}..."
-            # /I flag: search case-insensitive
-            sed -i "/${domain}/Id" "${list}"
-            reload=true
-        else
-            if [[ "${verbose}" == true ]]; then
-                echo -e "  ${INFO} ${1} does not exist in ${listname}, no need to remove!"
-            fi
-        fi
-    elif [[ "${list}" == "${regexlist}" ]]; then
-        [[ -z "${type}" ]] && type="--wildcard-only"
-        domain="${1}"
-
-        [[ "${wildcard}" == true ]] && domain="(^|\\.)${domain//\./\\.}$"
-
-        bool=true
-        # Is it in the list?
-        grep -Fx "${domain}" "${regexlist}" > /dev/null 2>&1 || bool=false
-        if [[ "${bool}" == true ]]; then
-            # Remove it from the other one
-            echo -e "  ${INFO} Removing $domain from regex list..."
-            local lineNumber
-            lineNumber=$(grep -Fnx "$domain" "${list}" | cut -f1 -d:)
-            sed -i "${lineNumber}d" "${list}"
-            reload=true
+    if [[ -n "${fromFile}" ]]; then
+        if ${addmode}; then
+            echo -e "  ${TICK} Added ${#additions[@]} of ${#domList[@]} domains to ${listname}"
+            [[ -n "${listAlt}" ]] && echo -e "  ${TICK} Removed ${#altRemovals[@]} domains from ${altname}"
         else
-            if [[ "${verbose}" == true ]]; then
-                echo -e "  ${INFO} ${domain} does not exist in regex list, no need to remove!"
-            fi
+            echo -e "  ${TICK} Removed ${#mainRemovals[@]} of ${#domList[@]} domains from ${listname}"
         fi
     fi
 }
@@ -213,7 +228,7 @@ RemoveDomain() {
 # Update Gravity
 Reload() {
     echo ""
-    xfilter -g --skip-download "${type:-}"
+    "${XFILTER_ROOT}"/usr/local/bin/xfilter -g --skip-download "${type:-}"
 }
 
 Displaylist() {
@@ -245,31 +260,34 @@ NukeList() {
     fi
 }
 
-for var in "$@"; do
+argCount="$#"
+
+while [[ "$#" -gt 0 ]]; do
+    var="${1}"
+    shift
     case "${var}" in
         "-w" | "whitelist"   ) listMain="${whitelist}"; listAlt="${blacklist}";;
         "-b" | "blacklist"   ) listMain="${blacklist}"; listAlt="${whitelist}";;
         "--wild" | "wildcard" ) listMain="${regexlist}"; wildcard=true;;
         "--regex" | "regex"   ) listMain="${regexlist}";;
-        "-nr"| "--noreload"  ) reload=false;;
+        "-nr"| "--noreload"  ) noreload=true;;
         "-d" | "--delmode"   ) addmode=false;;
         "-q" | "--quiet"     ) verbose=false;;
         "-h" | "--help"      ) helpFunc;;
         "-l" | "--list"      ) Displaylist;;
         "--nuke"             ) NukeList;;
+        "--from-file"        ) fromFile="${1:--}"; shift; ReadDomainFile "${fromFile}";;
         *                    ) HandleOther "${var}";;
     esac
 done
 
-shift
-
-if [[ $# = 0 ]]; then
+if [[ "${argCount}" -le 1 ]]; then
     helpFunc
 fi
 
+ValidateDomains
 PoplistFile
 
-if [[ "${reload}" != false ]]; then
-    # Ensure that "restart" is used for Wildcard updates
-    Reload "${reload}"
+if [[ "${reload}" != false ]] && [[ "${noreload}" == false ]]; then
+    Reload
 fi
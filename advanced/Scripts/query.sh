@@ -10,9 +10,16 @@
 # Please see LICENSE file for your rights under this license.
 
 # Globals
-xfilterDir="/etc/xfilter"
+# Every path is within XFILTER_ROOT, which is set in the environment or in /etc/xfilter/setupVars.conf
+: "${XFILTER_ROOT=$(sed -n 's/^XFILTER_ROOT=//p' /etc/xfilter/setupVars.conf 2> /dev/null)}"
+xfilterDir="${XFILTER_ROOT}/etc/xfilter"
 adListsList="$xfilterDir/adlists.list"
-wildcardlist="/etc/dnsmasq.d/03-xfilter-wildcard.conf"
+listManifest="$xfilterDir/list.manifest"
+queryIndex="$xfilterDir/list.index"
+wildcardlist="${XFILTER_ROOT}/etc/dnsmasq.d/03-xfilter-wildcard.conf"
+regexlist="$xfilterDir/regex.list"
+regexSuffixList="$regexlist.suffixes"
+regexCompiledList="$regexlist.compiled"
 options="$*"
 adlist=""
 all=""
@@ -20,7 +27,7 @@ exact=""
 blockpage=""
 matchType="match"
 
-colfile="/opt/xfilter/COL_TABLE"
+colfile="${XFILTER_ROOT}/opt/xfilter/COL_TABLE"
 source "${colfile}"
 
 # Print each subdomain
@@ -40,10 +47,21 @@ processWildcards() {
     done
 }
 
+# Print how a cached blocklist was compressed by gravity, if it was
+listCompression() {
+    local magic
+
+    magic=$(head -c 4 "${1}" 2> /dev/null | od -An -tx1 | tr -d ' \n')
+    case "${magic}" in
+        "1f8b"*) echo "gzip";;
+        "28b52ffd") echo "zstd";;
+    esac
+}
+
 # Scan an array of files for matching strings
 scanList(){
     # Escape full stops
-    local domain="${1//./\\.}" lists="${2}" type="${3:-}"
+    local domain="${1//./\\.}" lists="${2}" type="${3:-}" list compression plain="" compressed=()
 
     # Prevent grep from printing file path
     cd "$xfilterDir" || exit 1
@@ -51,13 +69,117 @@ scanList(){
     # Prevent grep -i matching slowly: http://bit.ly/2xFXtUX
     export LC_CTYPE=C
 
+    # Compressed blocklists are decompressed as they are scanned, labelling matches with their filename
+    for list in ${lists}; do
+        [[ "${type}" != "wc" ]] && compression=$(listCompression "${list}")
+        if [[ -n "${compression}" ]]; then
+            compressed+=("${compression}:${list}")
+        else
+            plain+="${list} "
+        fi
+    done
+
     # /dev/null forces filename to be printed when only one list has been generated
     # shellcheck disable=SC2086
     case "${type}" in
-        "exact" ) grep -i -E -l "(^|\\s)${domain}($|\\s|#)" ${lists} /dev/null 2>/dev/null;;
-        "wc"    ) grep -i -o -m 1 "/${domain}/" ${lists} 2>/dev/null;;
-        *       ) grep -i "${domain}" ${lists} /dev/null 2>/dev/null;;
+        "exact" ) grep -i -E -l "(^|\\s)${domain}($|\\s|#)" ${plain} /dev/null 2>/dev/null;;
+        "wc"    ) grep -i -o -m 1 "/${domain}/" ${plain} 2>/dev/null;;
+        *       ) grep -i "${domain}" ${plain} /dev/null 2>/dev/null;;
     esac
+
+    for list in "${compressed[@]}"; do
+        compression="${list%%:*}"
+        list="${list#*:}"
+        case "${type}" in
+            "exact" ) "${compression}" -dc "${list}" | grep -i -E -l --label="${list}" "(^|\\s)${domain}($|\\s|#)";;
+            *       ) "${compression}" -dc "${list}" | grep -i -H --label="${list}" "${domain}";;
+        esac
+    done
+}
+
+# Determine if the query index built by gravity can be used instead of scanning each blocklist
+# The index is stale when it was not built from the blocklists in the current manifest
+useQueryIndex() {
+    local header signature
+
+    if ! command -v look &> /dev/null; then
+        return 1
+    fi
+    if [[ ! -r "${queryIndex}" ]] || [[ ! -r "${listManifest}" ]]; then
+        return 1
+    fi
+
+    read -r header < "${queryIndex}"
+    signature=$(sha1sum < "${listManifest}")
+    [[ "${header}" == "#${signature%% *}" ]]
+}
+
+# Print the blocklist numbers held within a query index bitset
+# Each hexadecimal digit holds four blocklists, starting with blocklists 0-3
+bitsetToLists() {
+    local bitset="${1}" i j bits
+
+    for (( i=0; i<${#bitset}; i++ )); do
+        bits=$(( 16#${bitset:$i:1} ))
+        for (( j=0; j<4; j++ )); do
+            (( bits & (1 << j) )) && echo "$(( i * 4 + j ))"
+        done
+    done
+}
+
+# Reverse the labels of a domain
+# e.g: foo.bar.com = "com.bar.foo"
+reverseLabels() {
+    local i reversed=""
+
+    IFS="." read -r -a labels <<< "${1}"
+    for (( i=${#labels[@]}-1; i>=0; i-- )); do
+        reversed+="${labels[$i]}."
+    done
+    echo "${reversed%.}"
+}
+
+# Determine if the regex filters compiled by gravity are up to date with regex.list
+useRegexIndex() {
+    command -v look &> /dev/null && \
+    [[ -r "${regexSuffixList}" ]] && [[ -r "${regexCompiledList}" ]] && \
+    [[ ! "${regexlist}" -nt "${regexCompiledList}" ]]
+}
+
+# Print each suffix of a domain which is blocked by a regex suffix filter (e.g. a converted wildcard)
+# One binary search is needed per label, e.g: foo.bar.com looks up "com", "com.bar" and "com.bar.foo"
+scanRegexSuffixes() {
+    local key="" label
+    local -a suffixLabels
+
+    IFS="." read -r -a suffixLabels <<< "$(reverseLabels "${1,,}")"
+    for label in "${suffixLabels[@]}"; do
+        key="${key:+${key}.}${label}"
+        if look "${key}"$'\t' "${regexSuffixList}" &> /dev/null; then
+            reverseLabels "${key}"
+        fi
+    done
+}
+
+# Scan the query index for an exact domain, printing each matching filename in the same format as scanList
+scanIndex(){
+    local domain="${1,,}" line num
+    local -a fileNames matches
+
+    # Determine the filename of each blocklist number
+    cd "$xfilterDir" || exit 1
+    for line in list.*.domains; do
+        num="${line#list.}"
+        fileNames[${num%%.*}]="${line}"
+    done
+
+    mapfile -t matches < <(look "${domain}"$'\t' "${queryIndex}")
+    for line in "${matches[@]}"; do
+        [[ -z "${line}" ]] && continue
+        for num in $(bitsetToLists "${line#*$'\t'}"); do
+            printf "%s\n" "${fileNames[$num]}"
+        done
+    done
 }
 
 if [[ "${options}" == "-h" ]] || [[ "${options}" == "--help" ]]; then
@@ -151,11 +273,65 @@ if [[ -e "${wildcardlist}" ]]; then
     done
 fi
 
-# Get version sorted *.domains filenames (without dir path)
-lists=("$(cd "$xfilterDir" || exit 0; printf "%s\\n" -- *.domains | sort -V)")
+# Scan regex filters
+if [[ -r "${regexlist}" ]]; then
+    # Match suffix filters using the suffix index, and only evaluate other filters if their literal prefilter matches
+    if useRegexIndex; then
+        mapfile -t wildcards < <(scanRegexSuffixes "${domainQuery}")
+        patterns=("cat" "${regexCompiledList}")
+    else
+        wildcards=()
+        # The awk program is single-quoted, so that awk expands $0 rather than the shell
+        # shellcheck disable=SC2016
+        patterns=("awk" '!/^#/ && NF { print "always\t-\t" $0 }' "${regexlist}")
+    fi
+
+    for match in "${wildcards[@]}"; do
+        if [[ -z "${wcMatch:-}" ]] && [[ -z "${blockpage}" ]]; then
+            wcMatch=true
+            echo " ${matchType^} found in ${COL_BOLD}Wildcards${COL_NC}:"
+        fi
+        case "${blockpage}" in
+            true ) echo "π ${regexlist##*/}"; exit 0;;
+            *    ) echo "   *.${match}";;
+        esac
+    done
+
+    regexDomain="${domainQuery,,}"
+    while IFS=$'\t' read -r kind literal pattern; do
+        case "${kind}" in
+            "group"    ) [[ "${regexDomain}" =~ ${pattern} ]] && groupMatch=true || groupMatch=false; continue;;
+            "member"   ) [[ "${groupMatch}" == true ]] || continue;;
+            "prefix"   ) [[ "${regexDomain}" == "${literal}"* ]] || continue;;
+            "suffix"   ) [[ "${regexDomain}" == *"${literal}" ]] || continue;;
+            "contains" ) [[ "${regexDomain}" == *"${literal}"* ]] || continue;;
+            "always"   ) ;;
+            *          ) continue;;
+        esac
+        if [[ "${regexDomain}" =~ ${pattern} ]]; then
+            if [[ -z "${rxMatch:-}" ]] && [[ -z "${blockpage}" ]]; then
+                rxMatch=true
+                wcMatch=true
+                echo " ${matchType^} found in ${COL_BOLD}Regex filters${COL_NC}:"
+            fi
+            case "${blockpage}" in
+                true ) echo "π ${regexlist##*/}"; exit 0;;
+                *    ) echo "   ${pattern}";;
+            esac
+        fi
+    done < <("${patterns[@]}")
+fi
 
 # Query blocklists for occurences of domain
-mapfile -t results <<< "$(scanList "${domainQuery}" "${lists[*]}" "${exact}")"
+# Use the query index for exact matches, while other queries scan each blocklist for the domain as a substring
+if [[ -n "${exact}" ]] && useQueryIndex; then
+    mapfile -t results <<< "$(scanIndex "${domainQuery}")"
+else
+    # Get version sorted *.domains filenames (without dir path)
+    lists=("$(cd "$xfilterDir" || exit 0; printf "%s\\n" -- *.domains | sort -V)")
+
+    mapfile -t results <<< "$(scanList "${domainQuery}" "${lists[*]}" "${exact}")"
+fi
 
 # Handle notices
 if [[ -z "${wbMatch:-}" ]] && [[ -z "${wcMatch:-}" ]] && [[ -z "${results[*]}" ]]; then
@@ -0,0 +1,145 @@
+#!/usr/bin/env bash
+# X-filter: A black hole for Internet advertisements
+# (c) 2018 X-filter, LLC (https://x-filter.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Time each regex filter against a file of domains, so slow filters can be found
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+
+# Globals
+# Every path is within XFILTER_ROOT, which is set in the environment or in /etc/xfilter/setupVars.conf
+: "${XFILTER_ROOT=$(sed -n 's/^XFILTER_ROOT=//p' /etc/xfilter/setupVars.conf 2> /dev/null)}"
+
+xfilterDir="${XFILTER_ROOT}/etc/xfilter"
+regexlist="${xfilterDir}/regex.list"
+regexCompiledList="${regexlist}.compiled"
+runs=3
+limit=""
+domainsFile=""
+
+colfile="${XFILTER_ROOT}/opt/xfilter/COL_TABLE"
+source "${colfile}"
+
+helpFunc() {
+    echo "Usage: xfilter --regex-bench [options] <domains-file>
+Example: 'xfilter --regex-bench domains.txt'
+Time each regex filter against a file of domains (one per line), slowest first
+
+Options:
+  -n <count>          Only show the <count> slowest filters
+  -h, --help          Show this help dialog
+
+Columns:
+  ms                  Time taken to evaluate the filter against every domain, in milliseconds
+  evaluated           Domains for which 'xfilter -q' evaluates the filter, after its literal prefilter
+  matches             Domains which the filter matches"
+    exit 0
+}
+
+# Print the current time in microseconds
+benchNow() {
+    date +%s%6N
+}
+
+# Print the fastest of several runs of a command, in microseconds, so that caching and scheduling add little noise
+benchTime() {
+    local i start elapsed best=""
+
+    for (( i=0; i<runs; i++ )); do
+        start=$(benchNow)
+        "$@" > /dev/null 2>&1
+        elapsed=$(( $(benchNow) - start ))
+        if [[ -z "${best}" ]] || [[ "${elapsed}" -lt "${best}" ]]; then
+            best="${elapsed}"
+        fi
+    done
+    echo "${best}"
+}
+
+# Print the number of domains which pass the literal prefilter of a compiled filter
+countPrefiltered() {
+    awk -v kind="${1}" -v literal="${2}" '
+        kind == "prefix" && index($0, literal) == 1 { n++ }
+        kind == "suffix" && length($0) >= length(literal) && substr($0, length($0) - length(literal) + 1) == literal { n++ }
+        kind == "contains" && index($0, literal) { n++ }
+        END { print n + 0 }' "${domains}"
+}
+
+while (( "$#" )); do
+    case "${1}" in
+        "-h" | "--help" ) helpFunc;;
+        "-n"            ) limit="${2}"; shift;;
+        *               ) domainsFile="${1}";;
+    esac
+    shift
+done
+
+if [[ -z "${domainsFile}" ]]; then
+    helpFunc
+fi
+if [[ ! -r "${domainsFile}" ]]; then
+    echo -e "  ${CROSS} Unable to read ${domainsFile}"
+    exit 1
+fi
+if [[ -n "${limit}" ]] && [[ ! "${limit}" =~ ^[0-9]+$ ]]; then
+    echo -e "  ${CROSS} The number of filters to show must be a number"
+    exit 1
+fi
+if [[ ! -s "${regexlist}" ]]; then
+    echo -e "  ${INFO} There are no regex filters"
+    exit 0
+fi
+
+# Filters are taken as compiled by gravity, or otherwise as each would be evaluated for every domain
+if [[ -r "${regexCompiledList}" ]] && [[ ! "${regexlist}" -nt "${regexCompiledList}" ]]; then
+    mapfile -t filters < <(grep -v '^#' "${regexCompiledList}")
+else
+    echo -e "  ${INFO} The regex filters have not been compiled, run 'xfilter -g' to use their literal prefilters"
+    mapfile -t filters < <(awk '!/^#/ && NF { print "always\t-\t" $0 }' "${regexlist}")
+fi
+
+# Domains are matched in lowercase, as by 'xfilter -q'
+domains=$(mktemp)
+results=$(mktemp)
+trap 'rm -f "${domains}" "${results}"' EXIT
+awk '!/^#/ && NF { print tolower($1) }' "${domainsFile}" > "${domains}"
+total=$(wc -l < "${domains}")
+
+echo -e "  ${INFO} Timing ${#filters[@]} regex filters against $(printf "%'.0f" "${total}") domains"
+
+# The time taken to scan the domains for a filter which never matches is not counted against any filter
+overhead=$(benchTime grep -E -c -e '^$' "${domains}")
+
+for (( i=0; i<${#filters[@]}; i++ )); do
+    IFS=$'\t' read -r kind literal pattern <<< "${filters[$i]}"
+    elapsed=$(benchTime grep -E -c -e "${pattern}" "${domains}")
+    matches=$(grep -E -c -e "${pattern}" "${domains}" 2> /dev/null)
+    if [[ "$?" -eq 2 ]]; then
+        echo -e "  ${CROSS} Invalid regex filter: ${pattern}"
+        continue
+    fi
+
+    case "${kind}" in
+        "group"                     ) evaluated="${total}"; groupMatches="${matches}";;
+        "member"                    ) evaluated="${groupMatches}";;
+        "prefix"|"suffix"|"contains") evaluated=$(countPrefiltered "${kind}" "${literal}");;
+        *                           ) evaluated="${total}";;
+    esac
+    # A group is shown as the number of filters it merges, which are each listed after it
+    if [[ "${kind}" == "group" ]]; then
+        for (( members=0; i+members+1<${#filters[@]}; members++ )); do
+            [[ "${filters[$((i+members+1))]}" == "member"$'\t'* ]] || break
+        done
+        pattern="(alternation of ${members} filters)"
+    fi
+    printf "%s\\t%s\\t%s\\t%s\\n" "$(( elapsed > overhead ? elapsed - overhead : 0 ))" "${evaluated}" "${matches}" "${pattern}" >> "${results}"
+done
+
+echo ""
+sort -t $'\t' -k1,1nr "${results}" | head -n "${limit:-${#filters[@]}}" | awk -F '\t' -v total="${total}" '
+    BEGIN { printf "  %9s  %9s  %9s  %s\n", "ms", "evaluated", "matches", "filter" }
+    { printf "  %9.1f  %8.1f%%  %9d  %s\n", $1 / 1000, total ? $2 * 100 / total : 0, $3, $4 }'
+echo ""
+echo -e "  ${INFO} Slow filters can be removed with 'xfilter --regex -d <filter>'"
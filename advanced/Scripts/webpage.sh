@@ -10,16 +10,17 @@
 # This file is copyright under the latest version of the EUPL.
 # Please see LICENSE file for your rights under this license.
 
-readonly setupVars="/etc/xfilter/setupVars.conf"
-readonly dnsmasqconfig="/etc/dnsmasq.d/01-xfilter.conf"
-readonly dhcpconfig="/etc/dnsmasq.d/02-xfilter-dhcp.conf"
-readonly FTLconf="/etc/xfilter/xfilter-FTL.conf"
+# XFILTER_ROOT is set by xfilter, which sources this file
+readonly setupVars="${XFILTER_ROOT}/etc/xfilter/setupVars.conf"
+readonly dnsmasqconfig="${XFILTER_ROOT}/etc/dnsmasq.d/01-xfilter.conf"
+readonly dhcpconfig="${XFILTER_ROOT}/etc/dnsmasq.d/02-xfilter-dhcp.conf"
+readonly FTLconf="${XFILTER_ROOT}/etc/xfilter/xfilter-FTL.conf"
 # 03 -> wildcards
-readonly dhcpstaticconfig="/etc/dnsmasq.d/04-xfilter-static-dhcp.conf"
+readonly dhcpstaticconfig="${XFILTER_ROOT}/etc/dnsmasq.d/04-xfilter-static-dhcp.conf"
 
-coltable="/opt/xfilter/COL_TABLE"
+coltable="${XFILTER_ROOT}/opt/xfilter/COL_TABLE"
 if [[ -f ${coltable} ]]; then
-    source ${coltable}
+    source "${coltable}"
 fi
 
 helpFunc() {
@@ -51,6 +52,11 @@ delete_setting() {
 change_setting() {
     delete_setting "${1}"
     add_setting "${1}" "${2}"
+
+    # The Block Page shows the admin contact, and whether a password is set
+    case "${1}" in
+        "ADMIN_EMAIL"|"WEBPASSWORD") "${XFILTER_ROOT}/opt/xfilter/blockpage.sh";;
+    esac
 }
 
 addFTLsetting() {
@@ -274,7 +280,7 @@ Reboot() {
 }
 
 RestartDNS() {
-    /usr/local/bin/xfilter restartdns
+    "${XFILTER_ROOT}"/usr/local/bin/xfilter restartdns
 }
 
 SetQueryLogOptions() {
@@ -378,7 +384,7 @@ SetWebUILayout() {
 }
 
 CustomizeAdLists() {
-    list="/etc/xfilter/adlists.list"
+    list="${XFILTER_ROOT}/etc/xfilter/adlists.list"
 
     if [[ "${args[2]}" == "enable" ]]; then
         sed -i "\\@${args[3]}@s/^#http/http/g" "${list}"
@@ -386,7 +392,7 @@ CustomizeAdLists() {
         sed -i "\\@${args[3]}@s/^http/#http/g" "${list}"
     elif [[ "${args[2]}" == "add" ]]; then
         if [[ $(grep -c "^${args[3]}$" "${list}") -eq 0 ]] ; then
-            echo "${args[3]}" >> ${list}
+            echo "${args[3]}" >> "${list}"
         fi
     elif [[ "${args[2]}" == "del" ]]; then
         var=$(echo "${args[3]}" | sed 's/\//\\\//g')
@@ -395,6 +401,9 @@ CustomizeAdLists() {
         echo "Not permitted"
         return 1
     fi
+
+    # The Block Page lists the adlists
+    "${XFILTER_ROOT}/opt/xfilter/blockpage.sh"
 }
 
 SetPrivacyMode() {
@@ -532,13 +541,13 @@ addAudit()
     shift # skip "audit"
     for var in "$@"
     do
-        echo "${var}" >> /etc/xfilter/auditlog.list
+        echo "${var}" >> "${XFILTER_ROOT}"/etc/xfilter/auditlog.list
     done
 }
 
 clearAudit()
 {
-    echo -n "" > /etc/xfilter/auditlog.list
+    echo -n "" > "${XFILTER_ROOT}"/etc/xfilter/auditlog.list
 }
 
 SetPrivacyLevel() {
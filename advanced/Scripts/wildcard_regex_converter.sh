@@ -8,9 +8,9 @@
 # This file is copyright under the latest version of the EUPL.
 # Please see LICENSE file for your rights under this license.
 
-# regexFile set in gravity.sh
+# regexFile and XFILTER_ROOT set in gravity.sh
 
-wildcardFile="/etc/dnsmasq.d/03-xfilter-wildcard.conf"
+wildcardFile="${XFILTER_ROOT}/etc/dnsmasq.d/03-xfilter-wildcard.conf"
 
 convert_wildcard_to_regex() {
     if [ ! -f "${wildcardFile}" ]; then
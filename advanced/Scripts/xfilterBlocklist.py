@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# X-filter: A black hole for Internet advertisements
+# (c) 2018 X-filter, LLC (https://x-filter.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Builds, loads and validates gravity.bin
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+"""Build, load and validate gravity.bin.
+
+gravity.bin is the binary form of gravity.list and black.list, which remain
+the source of truth. It holds the same domains so that they can be loaded by
+memory-mapping one file and validating its header, rather than by parsing
+millions of lines of text. Its layout, in little-endian byte order, is:
+
+    header    magic "XFBLOCK\\0", version, header size, generation, domain
+              count, hash buckets, size of the domain table, CRC-32 of
+              everything after the header, and the size and modification
+              time (in nanoseconds) of gravity.list and black.list it was
+              built from
+    sources   the paths of those two lists, each ended by "\\0", padded to 8
+              bytes. While blocking is disabled gravity builds from the
+              backups of the lists, so their paths are not always the same
+    domains   the sorted, unique domains, each ended by "\\n", padded to 8
+              bytes
+    flags     one byte per domain: 1 if it is in gravity.list, 2 if in
+              black.list, 3 if in both, padded to 8 bytes
+    offsets   a 32-bit offset into the domain table for each domain, and one
+              for its end
+    index     a power of two of 32-bit buckets, holding a domain's position
+              plus one (0 is empty), found by the CRC-32 of the domain with
+              linear probing
+
+Usage from the command line:
+
+    xfilterBlocklist.py build --gravity gravity.list --blacklist black.list
+                              <domains> <gravity.bin>
+    xfilterBlocklist.py verify [gravity.bin]
+    xfilterBlocklist.py lookup <domain> [<domain> ...]
+"""
+
+from __future__ import print_function
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from xfilterRoot import ROOT
+
+BINARY_LIST = ROOT + "/etc/xfilter/gravity.bin"
+GRAVITY_LIST = ROOT + "/etc/xfilter/gravity.list"
+BLACK_LIST = ROOT + "/etc/xfilter/black.list"
+
+MAGIC = b"XFBLOCK\0"
+VERSION = 2
+HEADER = struct.Struct("<8sIIQQQQIIQQQQ")
+GRAVITY, BLACKLIST = 1, 2
+# The checksum is computed over this many bytes at a time, rather than copying
+# the whole file
+CHUNK = 1 << 20
+
+
+class BlocklistError(Exception):
+    """gravity.bin is missing, invalid or was built from other lists."""
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+def _source(path):
+    """The size and modification time of a list.
+
+    The time is in nanoseconds, so that it changes however quickly the list
+    is rewritten.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0, 0
+    mtime = getattr(st, "st_mtime_ns", None) or int(st.st_mtime * 1e9)
+    return st.st_size, mtime
+
+
+def _encoded(path):
+    """A path as the bytes recorded in the header."""
+    if isinstance(path, bytes):
+        return path
+    if hasattr(os, "fsencode"):
+        return os.fsencode(path)
+    return path.encode(sys.getfilesystemencoding())
+
+
+def _locations(path):
+    """A list's path and the path of its backup, in either order."""
+    if path.endswith(b".bck"):
+        return path, path[:-len(b".bck")]
+    return path, path + b".bck"
+
+
+def _unchanged(saved, current):
+    # Python 2 only has the modification time as a float, so it is compared
+    # to within a microsecond
+    return saved[0] == current[0] and abs(saved[1] - current[1]) < 1000
+
+
+def _little_endian(table):
+    """The bytes of an array of 32-bit integers, in little-endian order."""
+    if sys.byteorder == "big":
+        table = array(table.typecode, table)
+        table.byteswap()
+    if hasattr(table, "tobytes"):
+        return table.tobytes()
+    return table.tostring()
+
+
+def build(domains, output, gravity_list=GRAVITY_LIST, black_list=BLACK_LIST):
+    """Write gravity.bin from sorted, unique lines of "domain<TAB>flags"."""
+    with open(domains, "rb") as f:
+        count = sum(1 for _ in f)
+    buckets = 1
+    while buckets < count * 2:
+        buckets *= 2
+
+    try:
+        with open(output, "rb") as f:
+            generation = HEADER.unpack(f.read(HEADER.size))[3] + 1
+    except (IOError, struct.error):
+        generation = 1
+
+    # array("I") is 32 bits wide on every platform X-filter supports
+    flags = bytearray()
+    offsets = array("I")
+    index = array("I", [0]) * buckets
+    checksum = 0
+    size = 0
+    paths = b"".join(_encoded(path) + b"\0"
+                     for path in (gravity_list, black_list))
+    paths += b"\0" * (_padded(len(paths)) - len(paths))
+    header_size = HEADER.size + len(paths)
+    tmp = output + ".tmp"
+    try:
+        with open(domains, "rb") as source, open(tmp, "wb") as out:
+            out.write(b"\0" * HEADER.size + paths)
+            for line in source:
+                domain, _, flag = line.rstrip(b"\n").partition(b"\t")
+                position = len(offsets)
+                offsets.append(size)
+                flags.append(int(flag or GRAVITY))
+                bucket = zlib.crc32(domain) & (buckets - 1)
+                while index[bucket]:
+                    bucket = (bucket + 1) & (buckets - 1)
+                index[bucket] = position + 1
+                entry = domain + b"\n"
+                out.write(entry)
+                checksum = zlib.crc32(entry, checksum)
+                size += len(entry)
+            offsets.append(size)
+
+            padding = b"\0" * (_padded(size) - size)
+            flags.extend(b"\0" * (_padded(len(flags)) - len(flags)))
+            sections = (padding, bytes(flags), _little_endian(offsets),
+                        _little_endian(index))
+            for section in sections:
+                out.write(section)
+                checksum = zlib.crc32(section, checksum)
+
+            out.seek(0)
+            sources = _source(gravity_list) + _source(black_list)
+            out.write(HEADER.pack(MAGIC, VERSION, header_size, generation,
+                                  count, buckets, size, checksum & 0xffffffff,
+                                  0, *sources))
+    except BaseException:
+        # A partly written gravity.bin is never left behind
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.rename(tmp, output)
+    return generation, count
+
+
+class Blocklist(object):
+    """A memory-mapped gravity.bin, which is validated as it is loaded."""
+
+    def __init__(self, path=BINARY_LIST):
+        try:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError) as e:
+            raise BlocklistError("Unable to map %s: %s" % (path, e))
+        try:
+            self._validate()
+        except BlocklistError:
+            self.close()
+            raise
+
+    def _validate(self):
+        if len(self._map) < HEADER.size:
+            raise BlocklistError("gravity.bin is truncated")
+        (magic, version, header_size, self.generation, self.count,
+         self.buckets, self._size, checksum, _, gravity_size, gravity_mtime,
+         black_size, black_mtime) = HEADER.unpack(self._map[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise BlocklistError(
+                "gravity.bin is not a version %d binary blocklist" % VERSION)
+        paths = self._map[HEADER.size:header_size].split(b"\0")
+        if header_size % 8 or len(paths) < 3:
+            raise BlocklistError("gravity.bin is truncated or corrupt")
+        self._header_size = header_size
+        self.sources = {paths[0]: (gravity_size, gravity_mtime),
+                        paths[1]: (black_size, black_mtime)}
+
+        self._flags = header_size + _padded(self._size)
+        self._offsets = self._flags + _padded(self.count)
+        self._index = self._offsets + 4 * (self.count + 1)
+        if self.buckets & (self.buckets - 1) or \
+                self._index + 4 * self.buckets != len(self._map):
+            raise BlocklistError("gravity.bin is truncated or corrupt")
+        crc = 0
+        for start in range(header_size, len(self._map), CHUNK):
+            crc = zlib.crc32(self._map[start:start + CHUNK], crc)
+        if crc & 0xffffffff != checksum:
+            raise BlocklistError("gravity.bin does not match its checksum")
+
+    def stale(self):
+        """Whether the lists have changed since gravity.bin was built.
+
+        Switching blocking on or off moves each list to or from its backup,
+        which keeps its size and modification time, so either may now hold
+        the list gravity.bin was built from.
+        """
+        return not all(any(_unchanged(source, _source(location))
+                           for location in _locations(path))
+                       for path, source in self.sources.items())
+
+    def _uint32(self, offset):
+        return struct.unpack_from("<I", self._map, offset)[0]
+
+    def domain(self, position):
+        start = self._uint32(self._offsets + 4 * position)
+        end = self._uint32(self._offsets + 4 * (position + 1))
+        return self._map[self._header_size + start:
+                         self._header_size + end - 1]
+
+    def flags(self, domain):
+        """The lists a domain is in (GRAVITY and/or BLACKLIST), or 0."""
+        if not self.count:
+            return 0
+        bucket = zlib.crc32(domain) & (self.buckets - 1)
+        while True:
+            position = self._uint32(self._index + 4 * bucket)
+            if not position:
+                return 0
+            if self.domain(position - 1) == domain:
+                flag = self._flags + position - 1
+                return bytearray(self._map[flag:flag + 1])[0]
+            bucket = (bucket + 1) & (self.buckets - 1)
+
+    def __contains__(self, domain):
+        return self.flags(domain) != 0
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Build, load and validate gravity.bin")
+    commands = parser.add_subparsers(dest="command")
+    builder = commands.add_parser(
+        "build",
+        help="build gravity.bin from sorted, unique "
+             "\"domain<TAB>flags\" lines")
+    builder.add_argument("--gravity", default=GRAVITY_LIST)
+    builder.add_argument("--blacklist", default=BLACK_LIST)
+    builder.add_argument("domains")
+    builder.add_argument("output", nargs="?", default=BINARY_LIST)
+    verifier = commands.add_parser(
+        "verify", help="validate gravity.bin, and whether it is up to date")
+    verifier.add_argument("path", nargs="?", default=BINARY_LIST)
+    finder = commands.add_parser("lookup",
+                                 help="print the lists each domain is in")
+    finder.add_argument("domains", nargs="+")
+    args = parser.parse_args(argv[1:])
+
+    if args.command == "build":
+        generation, count = build(args.domains, args.output, args.gravity,
+                                  args.blacklist)
+        print("Generation %d: %d domains" % (generation, count))
+        return 0
+
+    try:
+        path = args.path if args.command == "verify" else BINARY_LIST
+        blocklist = Blocklist(path)
+    except BlocklistError as e:
+        print(e)
+        return 1
+    with blocklist:
+        if args.command == "verify":
+            print("Generation %d: %d domains, %d buckets" %
+                  (blocklist.generation, blocklist.count, blocklist.buckets))
+            if blocklist.stale():
+                print("gravity.bin is out of date with gravity.list or "
+                      "black.list")
+                return 1
+            return 0
+        for domain in args.domains:
+            flags = blocklist.flags(domain.lower().encode("latin-1"))
+            lists = [name for flag, name in ((GRAVITY, "gravity.list"),
+                                             (BLACKLIST, "black.list"))
+                     if flags & flag]
+            print("%s: %s" % (domain, ", ".join(lists) or "not blocked"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
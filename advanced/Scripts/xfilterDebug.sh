@@ -57,6 +57,10 @@ FAQ_BAD_ADDRESS="${COL_CYAN}https://discourse.x-filter.net/t/why-do-i-see-bad-ad
 FORUMS_URL="${COL_CYAN}https://discourse.x-filter.net${COL_NC}"
 TRICORDER_CONTEST="${COL_CYAN}https://x-filter.net/2016/11/07/crack-our-medical-tricorder-win-a-raspberry-pi-3/${COL_NC}"
 
+# Diagnostics are run concurrently by this many workers, and stopped if they take longer than this many seconds
+DIAGNOSTIC_WORKERS=8
+DIAGNOSTIC_TIMEOUT=60
+
 # Port numbers used for uploading the debug log
 TRICORDER_NC_PORT_NUMBER=9999
 TRICORDER_SSL_PORT_NUMBER=9998
@@ -202,7 +206,8 @@ make_temporary_log() {
 
 log_write() {
     # echo arguments to both the log and the console
-    echo -e "${@}" | tee -a /proc/$$/fd/3
+    # The handle of the current (sub)shell is used, as each diagnostic writes its part of the log on its own
+    echo -e "${@}" | tee -a /proc/${BASHPID}/fd/3
 }
 
 copy_to_debug_log() {
@@ -225,6 +230,84 @@ initialize_debug() {
     log_write "${INFO} $(date "+%Y-%m-%d:%H:%M:%S") debug log has been initialized."
 }
 
+# Stop a diagnostic which has timed out, with every process it started
+stop_diagnostic() {
+    local child
+    for child in $(pgrep -P "${1}"); do
+        stop_diagnostic "${child}"
+    done
+    kill "${1}" 2> /dev/null
+}
+
+# Run diagnostics concurrently, each in a subshell with its own console output and part of the log
+# These are shown in the order the diagnostics were given as soon as each has finished, so the log
+# reads as if they had run one after another, followed by how long each diagnostic took
+run_diagnostics() {
+    local diagnostics=("$@") directory now i next=0 shown=0 running file
+    local -a starts durations
+    directory=$(mktemp -d /tmp/xfilter_diagnostics.XXXXXX)
+
+    while [[ "${shown}" -lt "${#diagnostics[@]}" ]]; do
+        now=$(date +%s%3N)
+        running=0
+        for (( i=shown; i<next; i++ )); do
+            if [[ -z "${durations[$i]}" ]]; then
+                if [[ -f "${directory}/${i}.done" ]]; then
+                    durations[$i]=$(( $(< "${directory}/${i}.done") - starts[i] ))
+                elif [[ $(( now - starts[i] )) -gt $(( DIAGNOSTIC_TIMEOUT * 1000 )) ]]; then
+                    stop_diagnostic "$(< "${directory}/${i}.pid")"
+                    durations[$i]="timeout"
+                else
+                    running=$(( running + 1 ))
+                fi
+            fi
+        done
+
+        while [[ "${next}" -lt "${#diagnostics[@]}" ]] && [[ "${running}" -lt "${DIAGNOSTIC_WORKERS}" ]]; do
+            starts[$next]=$(date +%s%3N)
+            (
+                echo "${BASHPID}" > "${directory}/${next}.pid"
+                exec 3> "${directory}/${next}.log"
+                ${diagnostics[$next]}
+                date +%s%3N > "${directory}/${next}.done"
+            ) > "${directory}/${next}.out" 2>&1 &
+            next=$(( next + 1 ))
+            running=$(( running + 1 ))
+        done
+
+        while [[ "${shown}" -lt "${next}" ]] && [[ -n "${durations[$shown]}" ]]; do
+            if [[ "${durations[$shown]}" == "timeout" ]]; then
+                # The output is cut off where the diagnostic was stopped, so its section is marked as timed out,
+                # and its last line is ended before the timeout is reported
+                for file in "${directory}/${shown}.out" "${directory}/${shown}.log"; do
+                    sed -i "0,/\[ DIAGNOSING \]:/ s/\[ DIAGNOSING \]:.*/& (timed out after ${DIAGNOSTIC_TIMEOUT}s)/" "${file}"
+                    if [[ -s "${file}" ]] && [[ -n "$(tail -c 1 "${file}")" ]]; then
+                        echo >> "${file}"
+                    fi
+                done
+            fi
+            cat "${directory}/${shown}.out"
+            cat "${directory}/${shown}.log" >> /proc/$$/fd/3
+            if [[ "${durations[$shown]}" == "timeout" ]]; then
+                log_write "${CROSS} ${COL_RED}${diagnostics[$shown]} did not finish within ${DIAGNOSTIC_TIMEOUT} seconds${COL_NC}"
+            fi
+            shown=$(( shown + 1 ))
+        done
+        sleep 0.1
+    done
+    wait
+    rm -rf "${directory}"
+
+    echo_current_diagnostic "Diagnostic timings"
+    for i in "${!diagnostics[@]}"; do
+        if [[ "${durations[$i]}" == "timeout" ]]; then
+            log_write "${CROSS} ${diagnostics[$i]}: ${COL_RED}timed out after ${DIAGNOSTIC_TIMEOUT}s${COL_NC}"
+        else
+            log_write "${INFO} ${diagnostics[$i]}: ${durations[$i]} ms"
+        fi
+    done
+}
+
 # This is a function for visually displaying the curent test that is being run.
 # Accepts one variable: the name of what is being diagnosed
 # Colors do not show in the dasboard, but the icons do: [i], [✓], and [✗]
@@ -1077,6 +1160,30 @@ analyze_gravity_list() {
     IFS="$OLD_IFS"
 }
 
+analyze_cached_blocklists() {
+    echo_current_diagnostic "Cached blocklists"
+    local list
+    local magic
+    local compression
+    local lines
+    # Each blocklist may have been compressed by gravity, so is decompressed as it is counted
+    for list in ${XFILTER_DIRECTORY}/list.*.domains; do
+        [[ -f "${list}" ]] || continue
+        magic=$(head -c 4 "${list}" | od -An -tx1 | tr -d ' \n')
+        case "${magic}" in
+            1f8b*) compression="gzip";;
+            28b52ffd) compression="zstd";;
+            *) compression="";;
+        esac
+        if [[ -n "${compression}" ]]; then
+            lines=$("${compression}" -dc "${list}" 2> /dev/null | wc -l)
+        else
+            lines=$(wc -l < "${list}")
+        fi
+        log_write "   ${list##*/}: ${lines} lines, $(stat -c %s "${list}") bytes (${compression:-uncompressed})"
+    done
+}
+
 analyze_xfilter_log() {
     echo_current_diagnostic "X-filter log"
     local head_line
@@ -1208,24 +1315,30 @@ upload_to_tricorder() {
 }
 
 # Run through all the functions we made
-make_temporary_log
-initialize_debug
-# setupVars.conf needs to be sourced before the networking so the values are
-# available to the other functions
-source_setup_variables
-check_component_versions
-check_critical_program_versions
-diagnose_operating_system
-check_selinux
-processor_check
-check_networking
-check_name_resolution
-process_status
-parse_setup_vars
-check_x_headers
-analyze_gravity_list
-show_content_of_xfilter_files
-parse_locale
-analyze_xfilter_log
-copy_to_debug_log
-upload_to_tricorder
+# PH_TEST only defines the functions, so that the diagnostics runner can be tested
+if [[ "${PH_TEST}" != true ]] ; then
+    make_temporary_log
+    initialize_debug
+    # setupVars.conf needs to be sourced before the networking so the values are
+    # available to the other functions
+    source_setup_variables
+    # The diagnostics are independent of each other, so are run concurrently
+    run_diagnostics \
+        check_component_versions \
+        check_critical_program_versions \
+        diagnose_operating_system \
+        check_selinux \
+        processor_check \
+        check_networking \
+        check_name_resolution \
+        process_status \
+        parse_setup_vars \
+        check_x_headers \
+        analyze_gravity_list \
+        analyze_cached_blocklists \
+        show_content_of_xfilter_files \
+        parse_locale \
+        analyze_xfilter_log
+    copy_to_debug_log
+    upload_to_tricorder
+fi
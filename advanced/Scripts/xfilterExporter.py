@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# X-filter: A black hole for Internet advertisements
+# (c) 2018 X-filter, LLC (https://x-filter.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Serves FTL and gravity statistics for Prometheus
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+"""Serve FTL and gravity statistics at /metrics, in the Prometheus text format.
+
+A single connection to FTL is held open, and the metrics are cached for the
+interval, so that FTL is queried at most once per interval however often the
+endpoint is scraped.
+
+    xfilterExporter.py [--listen 127.0.0.1] [--port 9617] [--interval 5]
+                       [--top 10]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from ftlapi import ROOT, FTLClient, FTLError
+
+GRAVITY_LIST = ROOT + "/etc/xfilter/gravity.list"
+GRAVITY_HISTORY = ROOT + "/etc/xfilter/gravity.history"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# The FTL statistics which are exported, as
+# (stats key, metric name, type, help)
+STATS = [
+    ("dns_queries_today", "xfilter_dns_queries_total", "counter",
+     "DNS queries today"),
+    ("ads_blocked_today", "xfilter_ads_blocked_total", "counter",
+     "DNS queries blocked today"),
+    ("queries_forwarded", "xfilter_queries_forwarded_total", "counter",
+     "DNS queries forwarded upstream today"),
+    ("queries_cached", "xfilter_queries_cached_total", "counter",
+     "DNS queries answered from the cache today"),
+    ("ads_percentage_today", "xfilter_ads_percentage", "gauge",
+     "Percentage of DNS queries blocked today"),
+    ("domains_being_blocked", "xfilter_domains_being_blocked", "gauge",
+     "Domains on the blocklist loaded by FTL"),
+    ("unique_domains", "xfilter_unique_domains", "gauge",
+     "Unique domains queried today"),
+    ("unique_clients", "xfilter_unique_clients", "gauge",
+     "Unique clients seen today"),
+]
+
+# The top lists which are exported, as (FTL command, metric name, label, help)
+TOP = [
+    ("top-ads", "xfilter_top_ads", "domain",
+     "Queries for the most blocked domains today"),
+    ("top-domains", "xfilter_top_domains", "domain",
+     "Queries for the most permitted domains today"),
+    ("top-clients", "xfilter_top_clients", "client",
+     "Queries from the most active clients today"),
+]
+
+
+def _escape(value):
+    return (value.replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
+
+
+class Metrics(object):
+    """Collects the metrics, caching them for the interval."""
+
+    def __init__(self, interval=5.0, top=10, gravity_list=GRAVITY_LIST,
+                 gravity_history=GRAVITY_HISTORY):
+        self.interval = interval
+        self.top = top
+        self.gravity_list = gravity_list
+        self.gravity_history = gravity_history
+        self.ftl = FTLClient()
+        self._text = None
+        self._collected = 0
+        self._gravity_stat = None
+        self._gravity_domains = 0
+
+    def text(self):
+        now = time.time()
+        if self._text is None or now - self._collected >= self.interval:
+            self._text = self.collect(now)
+            self._collected = now
+        return self._text
+
+    def collect(self, now):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                lines.append("%s%s %s" % (name, labels, value))
+
+        commands = ["stats"] + ["%s (%d)" % (command, self.top)
+                                for command, _, _, _ in TOP]
+        try:
+            replies = self.ftl.query(*commands)
+        except FTLError:
+            replies = None
+
+        metric("xfilter_up", "gauge", "Whether FTL could be queried",
+               [("", 1 if replies else 0)])
+        if replies:
+            stats = replies[0]
+            for key, name, kind, help_text in STATS:
+                if isinstance(stats.get(key), (int, float)):
+                    metric(name, kind, help_text, [("", stats[key])])
+            enabled = stats.get("status") == "enabled"
+            metric("xfilter_blocking_enabled", "gauge",
+                   "Whether blocking is enabled", [("", 1 if enabled else 0)])
+            for (_, name, label, help_text), top in zip(TOP, replies[1:]):
+                metric(name, "gauge", help_text,
+                       [('{%s="%s"}' % (label, _escape(entry["name"])),
+                         entry["count"]) for entry in top])
+
+        self.collect_gravity(now, metric)
+        return "\n".join(lines) + "\n"
+
+    def collect_gravity(self, now, metric):
+        try:
+            st = os.stat(self.gravity_list)
+        except OSError:
+            return
+
+        # gravity.list is only counted again once it has changed, as it may
+        # hold millions of domains
+        if self._gravity_stat != (st.st_mtime, st.st_size):
+            domains = 0
+            with open(self.gravity_list, "rb") as f:
+                for line in f:
+                    if not line.startswith(b"#"):
+                        domains += 1
+            self._gravity_domains = domains
+            self._gravity_stat = (st.st_mtime, st.st_size)
+
+        metric("xfilter_gravity_domains", "gauge", "Domains in gravity.list",
+               [("", self._gravity_domains)])
+        metric("xfilter_gravity_age_seconds", "gauge",
+               "Seconds since gravity.list was last changed",
+               [("", int(now - st.st_mtime))])
+
+        # Each line of the gravity history is "run stage ms ...", where the
+        # run is its start time in milliseconds
+        last = None
+        try:
+            with open(self.gravity_history) as f:
+                for line in f:
+                    fields = line.split("\t")
+                    if len(fields) > 2 and fields[1] == "total":
+                        last = fields
+        except IOError:
+            pass
+        if last is not None:
+            metric("xfilter_gravity_last_run_timestamp_seconds", "gauge",
+                   "When the last gravity run started",
+                   [("", int(last[0]) // 1000)])
+            metric("xfilter_gravity_last_duration_seconds", "gauge",
+                   "How long the last gravity run took",
+                   [("", int(last[2]) / 1000.0)])
+
+
+class Handler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.metrics.text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Serve FTL and gravity statistics for Prometheus")
+    parser.add_argument("--listen", default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=9617,
+                        help="port to listen on (default: 9617)")
+    parser.add_argument("--interval", type=float, default=5.0,
+                        help="seconds to cache metrics for (default: 5)")
+    parser.add_argument("--top", type=int, default=10,
+                        help="entries of each top list to export "
+                             "(default: 10)")
+    args = parser.parse_args(argv[1:])
+
+    Handler.metrics = Metrics(args.interval, args.top)
+    server = HTTPServer((args.listen, args.port), Handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        Handler.metrics.ftl.close()
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
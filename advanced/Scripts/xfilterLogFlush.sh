@@ -8,61 +8,164 @@
 # This file is copyright under the latest version of the EUPL.
 # Please see LICENSE file for your rights under this license.
 
-colfile="/opt/xfilter/COL_TABLE"
+# Every path is within XFILTER_ROOT, which is set in the environment or in /etc/xfilter/setupVars.conf
+: "${XFILTER_ROOT=$(sed -n 's/^XFILTER_ROOT=//p' /etc/xfilter/setupVars.conf 2> /dev/null)}"
+export XFILTER_ROOT
+
+colfile="${XFILTER_ROOT}/opt/xfilter/COL_TABLE"
 source ${colfile}
 
+xfilterLog="${XFILTER_ROOT}/var/log/xfilter.log"
+logrotateConf="${XFILTER_ROOT}/etc/xfilter/logrotate"
+
+# The logrotate configuration names the logs by their paths within "/", so they are copied and emptied otherwise
+useLogrotate=false
+if [[ -z "${XFILTER_ROOT}" ]] && command -v /usr/sbin/logrotate >/dev/null; then
+    useLogrotate=true
+fi
+
 # Determine database location
 # Obtain DBFILE=... setting from xfilter-FTL.db
 # Constructed to return nothing when
 # a) the setting is not present in the config file, or
 # b) the setting is commented out (e.g. "#DBFILE=...")
-FTLconf="/etc/xfilter/xfilter-FTL.conf"
+FTLconf="${XFILTER_ROOT}/etc/xfilter/xfilter-FTL.conf"
 if [ -e "$FTLconf" ]; then
     DBFILE="$(sed -n -e 's/^\s*DBFILE\s*=\s*//p' ${FTLconf})"
 fi
 # Test for empty string. Use standard path in this case.
 if [ -z "$DBFILE" ]; then
-    DBFILE="/etc/xfilter/xfilter-FTL.db"
+    DBFILE="${XFILTER_ROOT}/etc/xfilter/xfilter-FTL.db"
 fi
 
+# Queries older than MAXDBDAYS are pruned nightly, in batches of DATABASE_PRUNE_BATCH rows (set in setupVars.conf)
+maxDBDays="$(sed -n -e 's/^\s*MAXDBDAYS\s*=\s*//p' "${FTLconf}" 2> /dev/null | tail -n 1)"
+[[ "${maxDBDays}" =~ ^[0-9]+$ ]] || maxDBDays=365
+pruneBatch="$(sed -n 's/^DATABASE_PRUNE_BATCH=//p' "${XFILTER_ROOT}/etc/xfilter/setupVars.conf" 2> /dev/null | tail -n 1)"
+[[ "${pruneBatch}" =~ ^[1-9][0-9]*$ ]] || pruneBatch=10000
+vacuumPages=1024
+deleted=0
+reclaimed=0
+reusable=0
+
+# Run SQL against FTL's database, waiting for up to 5s whenever FTL holds its lock
+database() {
+    sqlite3 -cmd ".timeout 5000" "${DBFILE}" "$@"
+}
+
+# Print the size of the database file in bytes, without its write-ahead log, which grows while it is vacuumed
+databaseBytes() {
+    stat -c %s "${DBFILE}" 2> /dev/null || echo 0
+}
+
+mebibytes() {
+    awk -v bytes="${1}" 'BEGIN { printf "%.1f", bytes / 1048576 }'
+}
+
+# Delete the queries matching a condition, in batches which are each committed on their own,
+# so that FTL is never locked out of the database for longer than one batch takes
+pruneQueries() {
+    local condition="${1}" batch
+
+    if [[ ! -f "${DBFILE}" ]] || [[ -z "$(database "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'queries';")" ]]; then
+        return 0
+    fi
+
+    # Each batch is found using the timestamp index, rather than by scanning the table
+    database "CREATE INDEX IF NOT EXISTS idx_queries_timestamps ON queries (timestamp);" || return 1
+    while true; do
+        batch=$(database "DELETE FROM queries WHERE id IN (SELECT id FROM queries WHERE ${condition} LIMIT ${pruneBatch}); SELECT changes();") || return 1
+        deleted=$(( deleted + batch ))
+        if [[ "${batch}" -lt "${pruneBatch}" ]]; then
+            break
+        fi
+    done
+}
+
+# Return the pages freed by pruning to the filesystem, when the database uses incremental vacuuming
+# Otherwise they are kept for reuse by FTL, unless $1 is "convert", which enables incremental vacuuming using one full VACUUM
+# That VACUUM rewrites the whole database while FTL is locked out of it, so is only run by "xfilter flush vacuum"
+reclaimSpace() {
+    local before after mode free lastFree="" pageSize
+
+    if [[ ! -f "${DBFILE}" ]]; then
+        return 0
+    fi
+
+    before=$(databaseBytes)
+    mode=$(database "PRAGMA auto_vacuum;") || mode=""
+    if [[ "${mode}" != "2" ]] && [[ "${1}" == "convert" ]]; then
+        database "PRAGMA auto_vacuum = INCREMENTAL; VACUUM;" && mode=2
+    fi
+    if [[ "${mode}" == "2" ]]; then
+        # The free pages are released a step at a time, each in its own transaction, until a step releases none
+        while free=$(database "PRAGMA freelist_count;") && [[ "${free}" =~ ^[0-9]+$ ]] && \
+              [[ "${free}" -gt 0 ]] && [[ "${free}" != "${lastFree}" ]]; do
+            lastFree="${free}"
+            database "PRAGMA incremental_vacuum(${vacuumPages});" > /dev/null || break
+        done
+    fi
+    # Checkpointing passively never waits for FTL, and does nothing unless the database uses write-ahead logging
+    database "PRAGMA wal_checkpoint(PASSIVE);" > /dev/null
+    after=$(databaseBytes)
+    reclaimed=$(( before > after ? before - after : 0 ))
+
+    free=$(database "PRAGMA freelist_count;") || free=0
+    pageSize=$(database "PRAGMA page_size;") || pageSize=0
+    [[ "${free}" =~ ^[0-9]+$ ]] || free=0
+    [[ "${pageSize}" =~ ^[0-9]+$ ]] || pageSize=0
+    reusable=$(( free * pageSize ))
+}
+
 if [[ "$@" != *"quiet"* ]]; then
-    echo -ne "  ${INFO} Flushing /var/log/xfilter.log ..."
+    echo -ne "  ${INFO} Flushing ${xfilterLog} ..."
 fi
 if [[ "$@" == *"once"* ]]; then
     # Nightly logrotation
-    if command -v /usr/sbin/logrotate >/dev/null; then
+    if [[ "${useLogrotate}" == true ]]; then
         # Logrotate once
-        /usr/sbin/logrotate --force /etc/xfilter/logrotate
+        /usr/sbin/logrotate --force "${logrotateConf}"
     else
         # Copy xfilter.log over to xfilter.log.1
         # and empty out xfilter.log
         # Note that moving the file is not an option, as
         # dnsmasq would happily continue writing into the
         # moved file (it will have the same file handler)
-        cp /var/log/xfilter.log /var/log/xfilter.log.1
-        echo " " > /var/log/xfilter.log
+        cp "${xfilterLog}" "${xfilterLog}.1"
+        echo " " > "${xfilterLog}"
+    fi
+    # Nightly pruning of queries older than MAXDBDAYS (0 disables the database)
+    if [[ "${maxDBDays}" -gt 0 ]]; then
+        pruneQueries "timestamp < strftime('%s','now') - ${maxDBDays} * 86400"
+        reclaimSpace
     fi
 else
     # Manual flushing
-    if command -v /usr/sbin/logrotate >/dev/null; then
+    if [[ "${useLogrotate}" == true ]]; then
         # Logrotate twice to move all data out of sight of FTL
-        /usr/sbin/logrotate --force /etc/xfilter/logrotate; sleep 3
-        /usr/sbin/logrotate --force /etc/xfilter/logrotate
+        /usr/sbin/logrotate --force "${logrotateConf}"; sleep 3
+        /usr/sbin/logrotate --force "${logrotateConf}"
     else
         # Flush both xfilter.log and xfilter.log.1 (if existing)
-        echo " " > /var/log/xfilter.log
-        if [ -f /var/log/xfilter.log.1 ]; then
-            echo " " > /var/log/xfilter.log.1
+        echo " " > "${xfilterLog}"
+        if [ -f "${xfilterLog}.1" ]; then
+            echo " " > "${xfilterLog}.1"
         fi
     fi
     # Delete most recent 24 hours from FTL's database, leave even older data intact (don't wipe out all history)
-    deleted=$(sqlite3 "${DBFILE}" "DELETE FROM queries WHERE timestamp >= strftime('%s','now')-86400; select changes() from queries limit 1")
+    pruneQueries "timestamp >= strftime('%s','now') - 86400"
+    if [[ "$@" == *"vacuum"* ]]; then
+        reclaimSpace convert
+    else
+        reclaimSpace
+    fi
 
     # Restart xfilter-FTL to force reloading history
-    sudo xfilter restartdns
+    sudo XFILTER_ROOT="${XFILTER_ROOT}" "${XFILTER_ROOT}"/usr/local/bin/xfilter restartdns
 fi
 
 if [[ "$@" != *"quiet"* ]]; then
-    echo -e "${OVER}  ${TICK} Flushed /var/log/xfilter.log"
+    echo -e "${OVER}  ${TICK} Flushed ${xfilterLog}"
     echo -e "  ${TICK} Deleted ${deleted} queries from database"
+    echo -e "  ${INFO} Reclaimed $(mebibytes "${reclaimed}") MiB of disk space, and $(mebibytes "${reusable}") MiB is free for reuse by FTL"
 fi
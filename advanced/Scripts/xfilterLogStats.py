@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# X-filter: A black hole for Internet advertisements
+# (c) 2018 X-filter, LLC (https://x-filter.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Summarises the query log in one pass
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+"""Summarise the queries in xfilter.log.1 and xfilter.log.
+
+Queries are counted by type, status, domain and client.
+
+The logs are memory-mapped and parsed in a single pass. The most queried
+domains, the most blocked domains and the most active clients are found using
+count-min sketches, so memory use does not grow with the size of the logs.
+Their counts are estimates, which may be too high but are never too low.
+
+The totals and sketches are saved with the offset reached in each log, so the
+next run only parses new lines, even once the logs have been rotated. Runs for
+one client, or for the last part of the logs, parse every matching line and do
+not change the saved totals.
+
+    xfilterLogStats.py [--top 10] [--client 192.168.1.5] [--since 1h]
+                       [--json] [--reset]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+import zlib
+from collections import OrderedDict
+
+from xfilterRoot import ROOT
+
+LOGS = [ROOT + "/var/log/xfilter.log.1", ROOT + "/var/log/xfilter.log"]
+CHECKPOINT = ROOT + "/etc/xfilter/log-stats.checkpoint"
+CHECKPOINT_VERSION = 1
+
+# Lists whose answers are blocked queries, and the answers given by "config"
+# lines for blocked domains
+BLOCKING_LISTS = (b"gravity.list", b"black.list", b"regex.list")
+BLOCKING_ANSWERS = (b"0.0.0.0", b"::", b"NXDOMAIN")
+# Queries waiting for their answer, which are forgotten once there are more
+# than this
+PENDING = 4096
+# The bytes at the start of a log which identify it once it has been rotated
+FINGERPRINT = 256
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _text(key):
+    return key.decode("latin-1")
+
+
+class CountMinSketch(object):
+    """Estimates how often each key has been added, in fixed counters."""
+
+    def __init__(self, width=4096, depth=4, rows=None):
+        self.width = width
+        self.rows = rows or [[0] * width for _ in range(depth)]
+
+    def add(self, key):
+        estimate = None
+        for seed, row in enumerate(self.rows):
+            i = (zlib.crc32(key, seed) & 0xffffffff) % self.width
+            row[i] += 1
+            if estimate is None or row[i] < estimate:
+                estimate = row[i]
+        return estimate
+
+
+class TopK(object):
+    """Tracks the keys with the highest estimates of a count-min sketch."""
+
+    def __init__(self, size, sketch=None, counts=None):
+        self.size = size
+        self.sketch = sketch or CountMinSketch()
+        self.counts = counts or {}
+        self.floor = 0
+        if len(self.counts) >= size:
+            self.floor = min(self.counts.values())
+
+    def add(self, key):
+        estimate = self.sketch.add(key)
+        if key in self.counts or len(self.counts) < self.size:
+            self.counts[key] = estimate
+        elif estimate > self.floor:
+            lowest = min(self.counts, key=self.counts.get)
+            if self.counts[lowest] < estimate:
+                del self.counts[lowest]
+                self.counts[key] = estimate
+            self.floor = min(self.counts.values())
+
+    def top(self, n):
+        ranked = sorted(self.counts.items(),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:n]
+
+    def save(self):
+        counts = dict((_text(k), v) for k, v in self.counts.items())
+        return {"rows": self.sketch.rows, "counts": counts}
+
+    @classmethod
+    def load(cls, size, saved):
+        counts = dict((k.encode("latin-1"), v)
+                      for k, v in saved["counts"].items())
+        sketch = CountMinSketch(len(saved["rows"][0]), rows=saved["rows"])
+        return cls(max(size, len(counts)), sketch, counts)
+
+
+class LogStats(object):
+    """The totals and sketches of the queries parsed so far."""
+
+    def __init__(self, track=100, client=None):
+        self.client = client
+        self.lines = 0
+        self.queries = 0
+        self.types = {}
+        self.status = {}
+        self.domains = TopK(track)
+        self.blocked = TopK(track)
+        self.clients = TopK(track)
+        self.pending = OrderedDict()
+
+    def parse(self, line):
+        self.lines += 1
+        fields = line.split()
+        if len(fields) < 6:
+            return
+        kind, domain = fields[4], fields[5]
+        if kind.startswith(b"query["):
+            if len(fields) < 8:
+                return
+            if self.client is not None and fields[7] != self.client:
+                return
+            self.queries += 1
+            qtype = _text(kind[6:-1])
+            self.types[qtype] = self.types.get(qtype, 0) + 1
+            self.domains.add(domain)
+            self.clients.add(fields[7])
+            self.pending[domain] = True
+            if len(self.pending) > PENDING:
+                self.pending.popitem(last=False)
+            return
+        if domain not in self.pending:
+            return
+
+        # The first line after a query which names its domain shows how the
+        # query was answered
+        if kind == b"forwarded":
+            status = "forwarded"
+        elif kind == b"cached":
+            status = "cached"
+        elif kind.endswith(BLOCKING_LISTS):
+            status = "blocked"
+        elif kind == b"config" and fields[-1] in BLOCKING_ANSWERS:
+            status = "blocked"
+        elif kind == b"config" or kind.startswith(b"/"):
+            status = "local"
+        else:
+            return
+        del self.pending[domain]
+        self.status[status] = self.status.get(status, 0) + 1
+        if status == "blocked":
+            self.blocked.add(domain)
+
+    def save(self):
+        return {
+            "lines": self.lines,
+            "queries": self.queries,
+            "types": self.types,
+            "status": self.status,
+            "domains": self.domains.save(),
+            "blocked": self.blocked.save(),
+            "clients": self.clients.save(),
+        }
+
+    @classmethod
+    def load(cls, track, saved):
+        stats = cls(track)
+        stats.lines = saved["lines"]
+        stats.queries = saved["queries"]
+        stats.types = saved["types"]
+        stats.status = saved["status"]
+        stats.domains = TopK.load(track, saved["domains"])
+        stats.blocked = TopK.load(track, saved["blocked"])
+        stats.clients = TopK.load(track, saved["clients"])
+        return stats
+
+
+def log_time(line, now):
+    """The time of a log line, whose syslog timestamp has no year."""
+    def stamp(year):
+        return time.mktime(time.strptime("%s %d" % (_text(line[:15]), year),
+                                         "%b %d %H:%M:%S %Y"))
+
+    year = time.localtime(now).tm_year
+    try:
+        result = stamp(year)
+    except ValueError:
+        return None
+    # Lines from December read in January are from the year before
+    if result > now + 86400:
+        result = stamp(year - 1)
+    return result
+
+
+def first_line_since(mm, start, end, since, now):
+    """Binary search for the first line at or after since.
+
+    This relies on each log being in time order.
+    """
+    low, high = start, end
+    while low < high:
+        middle = (low + high) // 2
+        line_start = mm.rfind(b"\n", start, middle) + 1 or start
+        line_end = mm.find(b"\n", line_start, end)
+        stamp = log_time(mm[line_start:line_end], now)
+        if stamp is not None and stamp < since:
+            low = line_end + 1
+        else:
+            high = line_start
+    return low
+
+
+def fingerprint(mm, length):
+    return zlib.crc32(mm[:length]) & 0xffffffff
+
+
+def parse_logs(stats, offsets, since=None):
+    """Parse the complete lines of each log from where the last run stopped.
+
+    Returns where this run stopped in each log.
+    """
+    now = time.time()
+    reached = []
+    for path in LOGS:
+        try:
+            f = open(path, "rb")
+        except IOError:
+            continue
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                continue
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # A rotated log is recognised by its first bytes, so is not
+                # parsed again
+                start = 0
+                for saved in offsets:
+                    length = saved["length"]
+                    if length <= size and \
+                            fingerprint(mm, length) == saved["fingerprint"]:
+                        start = min(saved["offset"], size)
+                        break
+                end = mm.rfind(b"\n", start, size) + 1
+                if since is not None and end > start:
+                    start = first_line_since(mm, start, end, since, now)
+                position = start
+                while position < end:
+                    line_end = mm.find(b"\n", position, end)
+                    stats.parse(mm[position:line_end])
+                    position = line_end + 1
+                length = min(FINGERPRINT, max(end, start))
+                reached.append({"length": length,
+                                "fingerprint": fingerprint(mm, length),
+                                "offset": max(end, start)})
+            finally:
+                mm.close()
+    return reached
+
+
+def parse_since(value):
+    unit = value[-1:].lower()
+    try:
+        if unit in UNITS:
+            return float(value[:-1]) * UNITS[unit]
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid duration: %s (e.g. 90s, 30m, 1h or 2d)" % value)
+
+
+def load_checkpoint(track):
+    try:
+        with open(CHECKPOINT) as f:
+            saved = json.load(f)
+        if saved.get("version") == CHECKPOINT_VERSION:
+            return LogStats.load(track, saved["stats"]), saved["offsets"]
+    except (IOError, ValueError, KeyError):
+        pass
+    return LogStats(track), []
+
+
+def save_checkpoint(stats, offsets):
+    with open(CHECKPOINT + ".tmp", "w") as f:
+        json.dump({"version": CHECKPOINT_VERSION, "offsets": offsets,
+                   "stats": stats.save()}, f)
+    os.rename(CHECKPOINT + ".tmp", CHECKPOINT)
+
+
+def _counted(counts):
+    """Counts as "key count" pairs, the highest first."""
+    return "  ".join("%s %d" % item for item in
+                     sorted(counts.items(), key=lambda item: -item[1]))
+
+
+def report(stats, top, parsed, checkpoint):
+    blocked = stats.status.get("blocked", 0)
+    if checkpoint:
+        print("  [i] Parsed %s new log lines, of %s in total" %
+              (format(parsed, ",d"), format(stats.lines, ",d")))
+    else:
+        print("  [i] Parsed %s log lines" % format(parsed, ",d"))
+    percentage = blocked * 100.0 / stats.queries if stats.queries else 0
+    print("  [i] Queries: %s, blocked: %s (%.1f%%)" %
+          (format(stats.queries, ",d"), format(blocked, ",d"), percentage))
+    print("")
+    print("  Query types:  " + _counted(stats.types))
+    print("  Answers:      " + _counted(stats.status))
+    for title, counts in (("Top domains", stats.domains),
+                          ("Top blocked domains", stats.blocked),
+                          ("Top clients", stats.clients)):
+        print("")
+        print("  %s (estimated):" % title)
+        for key, count in counts.top(top):
+            print("  %10d  %s" % (count, _text(key)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Summarise the queries in the X-filter log")
+    parser.add_argument("--top", type=int, default=10,
+                        help="entries of each top list to show (default: 10)")
+    parser.add_argument("--client",
+                        help="only count the queries of this client, "
+                             "without the checkpoint")
+    parser.add_argument("--since", type=parse_since,
+                        help="only count queries from this long ago, e.g. 1h, "
+                             "without the checkpoint")
+    parser.add_argument("--json", action="store_true",
+                        help="print the summary as JSON")
+    parser.add_argument("--reset", action="store_true",
+                        help="discard the checkpoint, and parse the logs "
+                             "again")
+    args = parser.parse_args(argv[1:])
+
+    track = max(100, args.top)
+    checkpoint = args.client is None and args.since is None
+    if checkpoint and not args.reset:
+        stats, offsets = load_checkpoint(track)
+    else:
+        client = args.client and args.client.encode("latin-1")
+        stats, offsets = LogStats(track, client), []
+
+    lines = stats.lines
+    since = args.since and time.time() - args.since
+    reached = parse_logs(stats, offsets, since)
+    if checkpoint:
+        save_checkpoint(stats, reached)
+
+    if args.json:
+        def top(counts):
+            return [[_text(k), v] for k, v in counts.top(args.top)]
+
+        print(json.dumps({
+            "lines": stats.lines,
+            "queries": stats.queries,
+            "types": stats.types,
+            "status": stats.status,
+            "top_domains": top(stats.domains),
+            "top_blocked": top(stats.blocked),
+            "top_clients": top(stats.clients),
+        }, indent=2, sort_keys=True))
+    else:
+        report(stats, args.top, stats.lines - lines, checkpoint)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# X-filter: A black hole for Internet advertisements
+# (c) 2018 X-filter, LLC (https://x-filter.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Locates XFILTER_ROOT for the Python scripts
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+"""The directory X-filter is installed within.
+
+Every path of the Python scripts is within it. As for the shell scripts,
+XFILTER_ROOT is taken from the environment, even when it is empty, or
+otherwise from the XFILTER_ROOT= setting of /etc/xfilter/setupVars.conf. It is
+empty for an install in "/".
+"""
+
+import os
+
+SETUP_VARS = "/etc/xfilter/setupVars.conf"
+
+
+def xfilter_root(environ=os.environ, setup_vars=SETUP_VARS):
+    if "XFILTER_ROOT" in environ:
+        return environ["XFILTER_ROOT"]
+    try:
+        with open(setup_vars) as f:
+            for line in f:
+                if line.startswith("XFILTER_ROOT="):
+                    return line[len("XFILTER_ROOT="):].rstrip("\n")
+    except IOError:
+        pass
+    return ""
+
+
+ROOT = xfilter_root()
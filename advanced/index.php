@@ -11,14 +11,68 @@ $serverName = htmlspecialchars($_SERVER["HTTP_HOST"]);
 // Remove external ipv6 brackets if any
 $serverName = preg_replace('/^\[(.*)\]$/', '${1}', $serverName);
 
-if (!is_file("/etc/xfilter/setupVars.conf"))
-  die("[ERROR] File not found: <code>/etc/xfilter/setupVars.conf</code>");
+// Compute the Block Page metadata, as written to blockpage.json by gravity
+function buildManifest() {
+    if (!is_file("/etc/xfilter/setupVars.conf"))
+      die("[ERROR] File not found: <code>/etc/xfilter/setupVars.conf</code>");
+
+    // Get values from setupVars.conf
+    $setupVars = parse_ini_file("/etc/xfilter/setupVars.conf");
+
+    // Set location of adlists file
+    if (is_file("/etc/xfilter/adlists.list")) {
+        $adLists = "/etc/xfilter/adlists.list";
+    } elseif (is_file("/etc/xfilter/adlists.default")) {
+        $adLists = "/etc/xfilter/adlists.default";
+    } else {
+        $adLists = "";
+    }
+
+    // Get all URLs starting with "http" or "www" from adlists and re-index array numerically
+    $adlistsUrls = !empty($adLists) ? array_values(preg_grep("/(^http)|(^www)/i", file($adLists, FILE_IGNORE_NEW_LINES))) : array();
+
+    return array(
+        "version" => exec("cd /etc/.xfilter/ && git describe --long --tags"),
+        "admin_email" => !empty($setupVars["ADMIN_EMAIL"]) ? $setupVars["ADMIN_EMAIL"] : "",
+        "web_password" => !empty($setupVars["WEBPASSWORD"]),
+        "lists_generated" => glob("/etc/xfilter/list.0.*.domains") !== array(),
+        "adlists_file" => $adLists,
+        // Including Whitelist, Blacklist & Wildcard lists
+        "list_count" => count($adlistsUrls) + 3,
+        "adlists" => $adlistsUrls
+    );
+}
+
+// Load the Block Page metadata, which is cached (in APCu, where available) until blockpage.json is replaced
+// It is computed again if adlists.list has been changed since blockpage.json was written, as by an edit made elsewhere
+function loadManifest($file = "/etc/xfilter/blockpage.json", $adLists = "/etc/xfilter/adlists.list") {
+    $stat = @stat($file);
+    if ($stat === false)
+        return buildManifest();
+    $adListsChanged = @filemtime($adLists);
+    if ($adListsChanged !== false && $adListsChanged > $stat["mtime"])
+        return buildManifest();
+
+    $key = "xfilter-blockpage";
+    $version = $stat["mtime"].":".$stat["ino"].":".$stat["size"];
+    $apcu = function_exists("apcu_fetch") && ini_get("apc.enabled");
+    if ($apcu) {
+        $cached = apcu_fetch($key);
+        if (is_array($cached) && $cached["version"] === $version)
+            return $cached["manifest"];
+    }
+
+    $manifest = json_decode(file_get_contents($file), true);
+    if (!is_array($manifest))
+        return buildManifest();
+    if ($apcu)
+        apcu_store($key, array("version" => $version, "manifest" => $manifest));
+    return $manifest;
+}
 
-// Get values from setupVars.conf
-$setupVars = parse_ini_file("/etc/xfilter/setupVars.conf");
-$svPasswd = !empty($setupVars["WEBPASSWORD"]);
-$svEmail = (!empty($setupVars["ADMIN_EMAIL"]) && filter_var($setupVars["ADMIN_EMAIL"], FILTER_VALIDATE_EMAIL)) ? $setupVars["ADMIN_EMAIL"] : "";
-unset($setupVars);
+$manifest = loadManifest();
+$svPasswd = $manifest["web_password"];
+$svEmail = (!empty($manifest["admin_email"]) && filter_var($manifest["admin_email"], FILTER_VALIDATE_EMAIL)) ? $manifest["admin_email"] : "";
 
 // Set landing page location, found within /var/www/html/
 $landPage = "../landing.php";
@@ -73,7 +127,7 @@ if ($serverName === "x.filter") {
     $renderPage = is_file(getcwd()."/$landPage") ? include $landPage : "$splashPage";
 
     // Unset variables so as to not be included in $landPage
-    unset($serverName, $svPasswd, $svEmail, $authorizedHosts, $validExtTypes, $currentUrlExt, $viewPort);
+    unset($serverName, $svPasswd, $svEmail, $manifest, $authorizedHosts, $validExtTypes, $currentUrlExt, $viewPort);
 
     // Render splash/landing page when directly browsing via IP or authorised hostname
     exit($renderPage);
@@ -104,28 +158,23 @@ if ($serverName === "x.filter") {
 $bpAskAdmin = !empty($svEmail) ? '<a href="mailto:'.$svEmail.'?subject=Site Blocked: '.$serverName.'"></a>' : "<span/>";
 
 // Determine if at least one block list has been generated
-$blocklistglob = glob("/etc/xfilter/list.0.*.domains");
-if ($blocklistglob === array()) {
+if (!$manifest["lists_generated"]) {
     die("[ERROR] There are no domain lists generated lists within <code>/etc/xfilter/</code>! Please update gravity by running <code>xfilter -g</code>, or repair X-filter using <code>xfilter -r</code>.");
 }
 
 // Set location of adlists file
-if (is_file("/etc/xfilter/adlists.list")) {
-    $adLists = "/etc/xfilter/adlists.list";
-} elseif (is_file("/etc/xfilter/adlists.default")) {
-    $adLists = "/etc/xfilter/adlists.default";
-} else {
+$adLists = $manifest["adlists_file"];
+if (empty($adLists))
     die("[ERROR] File not found: <code>/etc/xfilter/adlists.list</code>");
-}
 
-// Get all URLs starting with "http" or "www" from adlists and re-index array numerically
-$adlistsUrls = array_values(preg_grep("/(^http)|(^www)/i", file($adLists, FILE_IGNORE_NEW_LINES)));
+// Get all URLs starting with "http" or "www" from adlists
+$adlistsUrls = $manifest["adlists"];
 
 if (empty($adlistsUrls))
     die("[ERROR]: There are no adlist URL's found within <code>$adLists</code>");
 
 // Get total number of blocklists (Including Whitelist, Blacklist & Wildcard lists)
-$adlistsCount = count($adlistsUrls) + 3;
+$adlistsCount = $manifest["list_count"];
 
 // Set query timeout
 ini_set("default_socket_timeout", 3);
@@ -183,7 +232,7 @@ if (strpos($queryAds[0], "blacklist") !== FALSE) {
     $notableFlagClass = "noblock";
     $adlistsUrls = array("π" => substr($queryAds[0], 2));
     $wlInfo = "recentwl";
-} elseif (strpos($queryAds[0], "wildcard") !== FALSE) {
+} elseif (strpos($queryAds[0], "wildcard") !== FALSE || strpos($queryAds[0], "regex") !== FALSE) {
     $notableFlagClass = "wildcard";
     $adlistsUrls = array("π" => substr($queryAds[0], 2));
 } elseif ($queryAds[0] === "none") {
@@ -205,7 +254,7 @@ $wlOutputClass = (isset($wlInfo) && $wlInfo === "recentwl") ? $wlInfo : "hidden"
 $wlOutput = (isset($wlInfo) && $wlInfo !== "recentwl") ? "<a href='http://$wlInfo'>$wlInfo</a>" : "";
 
 // Get X-filter Core version
-$phVersion = exec("cd /etc/.xfilter/ && git describe --long --tags");
+$phVersion = $manifest["version"];
 
 // Print $execTime on development branches
 // Testing for - is marginally faster than "git rev-parse --abbrev-ref HEAD"
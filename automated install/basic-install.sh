@@ -1305,10 +1305,17 @@ installScripts() {
         # The rest are the scripts X-filter needs
         install -o "${USER}" -Dm755 -t "${X_FILTER_INSTALL_DIR}" gravity.sh
         install -o "${USER}" -Dm755 -t "${X_FILTER_INSTALL_DIR}" ./advanced/Scripts/*.sh
+        install -o "${USER}" -Dm755 -t "${X_FILTER_INSTALL_DIR}" ./advanced/Scripts/*.py
         install -o "${USER}" -Dm755 -t "${X_FILTER_INSTALL_DIR}" ./automated\ install/uninstall.sh
         install -o "${USER}" -Dm755 -t "${X_FILTER_INSTALL_DIR}" ./advanced/Scripts/COL_TABLE
         install -o "${USER}" -Dm755 -t /usr/local/bin/ xfilter
         install -Dm644 ./advanced/bash-completion/xfilter /etc/bash_completion.d/xfilter
+        # The exporter is installed as a service, which is not enabled unless requested
+        install -T -m 0755 ./advanced/Templates/xfilter-exporter.service /etc/init.d/xfilter-exporter
+        # Update the X-filter version shown by the Block Page, as updates and checkouts reinstall the scripts
+        if [[ -f "${setupVars}" ]]; then
+            "${X_FILTER_INSTALL_DIR}/blockpage.sh"
+        fi
         printf "%b  %b %s\\n" "${OVER}" "${TICK}" "${str}"
 
     # Otherwise,
@@ -158,6 +158,16 @@ removeNoPurge() {
         systemctl reload-or-restart systemd-resolved
     fi
 
+    # Remove the exporter
+    if [[ -f /etc/init.d/xfilter-exporter ]]; then
+        if [[ -x "$(command -v systemctl)" ]]; then
+            systemctl stop xfilter-exporter
+        else
+            service xfilter-exporter stop
+        fi
+        ${SUDO} rm -f /etc/init.d/xfilter-exporter
+    fi
+
     # Remove FTL
     if command -v xfilter-FTL &> /dev/null; then
         echo -ne "  ${INFO} Removing xfilter-FTL..."
@@ -13,15 +13,19 @@
 
 export LC_ALL=C
 
-coltable="/opt/xfilter/COL_TABLE"
+# Every path is within XFILTER_ROOT, which is set in the environment or in /etc/xfilter/setupVars.conf
+: "${XFILTER_ROOT=$(sed -n 's/^XFILTER_ROOT=//p' /etc/xfilter/setupVars.conf 2> /dev/null)}"
+export XFILTER_ROOT
+
+coltable="${XFILTER_ROOT}/opt/xfilter/COL_TABLE"
 source "${coltable}"
-regexconverter="/opt/xfilter/wildcard_regex_converter.sh"
+regexconverter="${XFILTER_ROOT}/opt/xfilter/wildcard_regex_converter.sh"
 source "${regexconverter}"
 
 basename="xfilter"
-XFILTER_COMMAND="/usr/local/bin/${basename}"
+XFILTER_COMMAND="${XFILTER_ROOT}/usr/local/bin/${basename}"
 
-xfilterDir="/etc/${basename}"
+xfilterDir="${XFILTER_ROOT}/etc/${basename}"
 
 adListFile="${xfilterDir}/adlists.list"
 adListDefault="${xfilterDir}/adlists.default"
@@ -29,23 +33,42 @@ adListDefault="${xfilterDir}/adlists.default"
 whitelistFile="${xfilterDir}/whitelist.txt"
 blacklistFile="${xfilterDir}/blacklist.txt"
 regexFile="${xfilterDir}/regex.list"
+regexSuffixFile="${regexFile}.suffixes"
+regexCompiledFile="${regexFile}.compiled"
 
 adList="${xfilterDir}/gravity.list"
 blackList="${xfilterDir}/black.list"
+binaryList="${xfilterDir}/gravity.bin"
 localList="${xfilterDir}/local.list"
-VPNList="/etc/openvpn/ipp.txt"
+VPNList="${XFILTER_ROOT}/etc/openvpn/ipp.txt"
 
 domainsExtension="domains"
+parsedExtension="parsed"
+metaExtension="meta"
+listManifest="${xfilterDir}/list.manifest"
+queryIndex="${xfilterDir}/list.index"
+appliedWhitelist="${xfilterDir}/list.whitelist"
 matterAndLight="${basename}.0.matterandlight.txt"
 parsedMatter="${basename}.1.parsedmatter.txt"
 whitelistMatter="${basename}.2.whitelistmatter.txt"
 accretionDisc="${basename}.3.accretionDisc.txt"
 preEventHorizon="list.preEventHorizon"
+downloadStatus="${basename}.download"
+gravityProfile="${xfilterDir}/gravity.profile"
+gravityProfileMemory="${xfilterDir}/gravity.profile.rss"
+gravityHistory="${xfilterDir}/gravity.history"
+gravityHistoryRuns=50
 
 skipDownload="false"
+debugStages="false"
+verifyGravity="false"
+reportRuns=""
 
 resolver="xfilter-FTL"
 
+# The upstream address of each blocked source domain, and the blocklist which blocks it
+declare -A sourceAddress sourceBlockedBy
+
 haveSourceUrls=true
 
 # Source setupVars from install script
@@ -78,29 +101,246 @@ if [[ -z "${BLOCKINGMODE}" ]] ; then
   BLOCKINGMODE="NULL"
 fi
 
+# Set download scheduler defaults if they are not (validly) specified within setupVars.conf
+if [[ ! "${GRAVITY_DOWNLOAD_WORKERS}" =~ ^[1-9][0-9]*$ ]]; then
+  GRAVITY_DOWNLOAD_WORKERS=4
+fi
+if [[ ! "${GRAVITY_DOWNLOAD_TIMEOUT}" =~ ^[1-9][0-9]*$ ]]; then
+  GRAVITY_DOWNLOAD_TIMEOUT=60
+fi
+if [[ ! "${GRAVITY_DOWNLOAD_RETRIES}" =~ ^[0-9]+$ ]]; then
+  GRAVITY_DOWNLOAD_RETRIES=2
+fi
+
+# Keep cached blocklists compressed if specified within setupVars.conf, using gzip where zstd is unavailable
+case "${GRAVITY_COMPRESS_LISTS}" in
+  "zstd") command -v zstd &> /dev/null || GRAVITY_COMPRESS_LISTS="gzip";;
+  "gzip") ;;
+  *) GRAVITY_COMPRESS_LISTS="none";;
+esac
+
+# Bound the memory used by sort if specified within setupVars.conf, spilling sorted runs to a chosen directory
+# sort merges its runs (and any inputs beyond its batch size) from that directory, instead of /tmp
+sortOptions=()
+if [[ "${GRAVITY_SORT_MEMORY}" =~ ^[1-9][0-9]*[%bKMGT]?$ ]]; then
+  sortOptions+=(-S "${GRAVITY_SORT_MEMORY}")
+fi
+if [[ -n "${GRAVITY_SORT_TMPDIR}" ]]; then
+  if [[ -d "${GRAVITY_SORT_TMPDIR}" ]] && [[ -w "${GRAVITY_SORT_TMPDIR}" ]]; then
+    sortOptions+=(-T "${GRAVITY_SORT_TMPDIR}")
+  else
+    echo -e "  ${CROSS} GRAVITY_SORT_TMPDIR ${GRAVITY_SORT_TMPDIR} is not a writable directory, using the default"
+  fi
+fi
+if [[ "${GRAVITY_SORT_PARALLEL}" =~ ^[1-9][0-9]*$ ]]; then
+  sortOptions+=(--parallel="${GRAVITY_SORT_PARALLEL}")
+fi
+
 # Determine if superseded xfilter.conf exists
 if [[ -r "${xfilterDir}/xfilter.conf" ]]; then
   echo -e "  ${COL_LIGHT_RED}Ignoring overrides specified within xfilter.conf! ${COL_NC}"
 fi
 
 # Determine if X-filter blocking is disabled
-# If this is the case, we want to update
+# If the lists were swapped out to disable blocking, we want to update
 #  gravity.list.bck and black.list.bck instead of
 #  gravity.list and black.list
 detect_xfilter_blocking_status() {
   if [[ "${BLOCKING_ENABLED}" == false ]]; then
     echo -e "  ${INFO} X-filter blocking is disabled"
-    adList="${adList}.bck"
-    blackList="${blackList}.bck"
+    if [[ -e "${adList}.bck" ]]; then
+      adList="${adList}.bck"
+    fi
+    if [[ -e "${blackList}.bck" ]]; then
+      blackList="${blackList}.bck"
+    fi
   else
     echo -e "  ${INFO} X-filter blocking is enabled"
   fi
 }
 
+# Print the current time in milliseconds
+gravity_ProfileNow() {
+  date +%s%3N
+}
+
+# Print the resident memory of a process and its descendants in KiB, leaving out the descendants of $2
+# Processes are related through the parent PIDs in /proc/<pid>/stat, which also holds each one's resident pages
+gravity_ProfileTreeMemory() {
+  cat /proc/[0-9]*/stat 2> /dev/null | awk -v root="${1}" -v skip="${2}" -v pagesize="$(getconf PAGESIZE)" '{
+    # The command name, in parentheses, may contain spaces, so fields are counted from after it
+    pid = $1
+    sub(/^.*\) /, "")
+    parent[pid] = $2
+    rss[pid] = $22
+  } END {
+    total = 0
+    for(pid in parent) {
+      for(p = pid; p in parent && p != root && p != skip && p > 1 && depth++ < 64; p = parent[p]) {}
+      depth = 0
+      if(p == root) { total += rss[pid] }
+    }
+    print int(total * pagesize / 1024)
+  }'
+}
+
+# Start profiling this gravity run
+# The resident memory of gravity and its child processes is sampled twice a second in the background
+gravity_ProfileStart() {
+  profileStart=$(gravity_ProfileNow)
+  : > "${gravityProfile}"
+  : > "${gravityProfileMemory}"
+
+  (
+    while kill -0 $$ 2> /dev/null; do
+      echo "$(gravity_ProfileNow) $(gravity_ProfileTreeMemory $$ "${BASHPID}")" >> "${gravityProfileMemory}"
+      sleep 0.5
+    done
+  ) &> /dev/null &
+  profileSampler=$!
+  # Do not count the sampler as a download worker, or wait for it
+  disown "${profileSampler}"
+}
+
+# Record a profile entry: stage, start and end time (ms), bytes in, bytes out, lines in, lines out
+# The peak memory is taken from the samples between the start and end time
+gravity_ProfileRecord() {
+  local stage="${1}" start="${2}" end="${3}" peak
+
+  peak=$(awk -v start="${start}" -v end="${end}" '$1 >= start && $1 <= end && $2 > peak { peak = $2 } END { print peak }' "${gravityProfileMemory}" 2> /dev/null)
+  printf "%s\\t%s\\t%s\\t%s\\t%s\\t%s\\t%s\\n" "${stage}" "$((end - start))" "${4:--}" "${5:--}" "${6:--}" "${7:--}" "${peak:--}" >> "${gravityProfile}"
+}
+
+# Run a gravity stage and record its profile, including the size of its output file ($2)
+# A stage may set profileBytesIn and profileLinesIn to record the size of its input
+gravity_ProfileStage() {
+  # These names are distinct, as stages may assign variables without declaring them local
+  local profileStage="${1}" profileOutput="${2}" profileStageStart profileStatus profileBytesOut="" profileLinesOut=""
+  shift 2
+
+  profileBytesIn=""
+  profileLinesIn=""
+  profileStageStart=$(gravity_ProfileNow)
+  "$@"
+  profileStatus="$?"
+  if [[ -n "${profileOutput}" ]] && [[ -f "${profileOutput}" ]]; then
+    profileBytesOut=$(stat -c %s "${profileOutput}")
+    profileLinesOut=$(wc -l < "${profileOutput}")
+  fi
+  gravity_ProfileRecord "${profileStage}" "${profileStageStart}" "$(gravity_ProfileNow)" \
+    "${profileBytesIn}" "${profileBytesOut}" "${profileLinesIn}" "${profileLinesOut}"
+  return "${profileStatus}"
+}
+
+# Append the profile of this run to the run history, keeping the last $gravityHistoryRuns runs
+gravity_ProfileFinish() {
+  local run oldest peak
+
+  kill "${profileSampler}" 2> /dev/null
+  gravity_ProfileRecord "total" "${profileStart}" "$(gravity_ProfileNow)"
+
+  # Report the peak memory of the run, so that it can be compared against the memory of a device
+  peak=$(awk '$2 > peak { peak = $2 } END { print peak + 0 }' "${gravityProfileMemory}" 2> /dev/null)
+  echo -e "  ${INFO} Peak memory use: $(( peak / 1024 )) MiB${sortOptions[*]:+ (sort ${sortOptions[*]})}"
+
+  run="${profileStart}"
+  awk -v run="${run}" '{ print run "\t" $0 }' "${gravityProfile}" >> "${gravityHistory}"
+  oldest=$(cut -f1 "${gravityHistory}" | uniq | tail -n "${gravityHistoryRuns}" | head -n 1)
+  awk -F '\t' -v oldest="${oldest}" '$1 >= oldest' "${gravityHistory}" > "${gravityHistory}.tmp"
+  mv "${gravityHistory}.tmp" "${gravityHistory}"
+
+  gravity_ProfileStop
+}
+
+# Stop the memory sampler and remove the profile of this run, which is also done when gravity is aborted
+gravity_ProfileStop() {
+  kill "${profileSampler:-}" 2> /dev/null
+  rm -f "${gravityProfile}" "${gravityProfileMemory}" 2> /dev/null
+}
+
+# Compare the last runs recorded in the run history, flagging stages which have become slower or use more memory
+# A stage regresses when it takes over 1.5x as long (and at least 1s longer), or uses over 1.5x as much memory
+# (and at least 10MB more), than the median of the earlier runs
+gravity_Report() {
+  local runs="${1}" run i=0
+
+  if [[ ! -s "${gravityHistory}" ]]; then
+    echo -e "  ${INFO} No gravity runs have been recorded yet"
+    return 0
+  fi
+
+  mapfile -t runIds < <(cut -f1 "${gravityHistory}" | uniq | tail -n "${runs}")
+  echo -e "  ${INFO} Comparing the last ${#runIds[@]} gravity runs:"
+  for run in "${runIds[@]}"; do
+    i=$((i + 1))
+    echo "      #${i}  $(date -d "@${run%???}" "+%Y-%m-%d %H:%M:%S")"
+  done
+  echo ""
+
+  awk -F '\t' -v first="${runIds[0]}" -v tick="${TICK}" -v cross="${CROSS}" '
+    function median(values, n,   i, j, v, sorted) {
+      for(i = 1; i <= n; i++) { sorted[i] = values[i] }
+      for(i = 2; i <= n; i++) {
+        v = sorted[i]
+        for(j = i - 1; j > 0 && sorted[j] > v; j--) { sorted[j + 1] = sorted[j] }
+        sorted[j + 1] = v
+      }
+      return (n % 2) ? sorted[(n + 1) / 2] : (sorted[n / 2] + sorted[n / 2 + 1]) / 2
+    }
+    function check(stage, kind, minimum, unit, scale,   r, n, last, base, values) {
+      n = 0
+      for(r = 1; r < runs; r++) {
+        if(!((r, stage) in time)) { continue }
+        if(kind == "time") { values[++n] = time[r, stage] }
+        else if(memory[r, stage] != "") { values[++n] = memory[r, stage] }
+      }
+      last = (kind == "time") ? time[runs, stage] : memory[runs, stage]
+      if(n == 0 || last == "-" || last == "") { return }
+      base = median(values, n)
+      if(last > base * 1.5 && last - base >= minimum) {
+        printf "  %s %s %s regressed: %.1f%s, compared to %.1f%s\n", cross, stage, kind, last / scale, unit, base / scale, unit
+        regressions++
+      }
+    }
+    $1 < first { next }
+    $1 != run { run = $1; runs++; id[runs] = $1 }
+    {
+      time[runs, $2] = $3
+      memory[runs, $2] = ($8 == "-") ? "" : $8
+      if(!(($2) in seen)) { seen[$2]; order[++stages] = $2 }
+    }
+    END {
+      # Stages of each blocklist (e.g. "transfer list.0.example.com") are only shown when they regress
+      printf "  %-14s", "Stage"
+      for(r = 1; r <= runs; r++) { printf "%10s", "#" r }
+      printf "%12s\n", "Peak RSS"
+      for(s = 1; s <= stages; s++) {
+        if(order[s] ~ / /) { continue }
+        printf "  %-14s", order[s]
+        for(r = 1; r <= runs; r++) {
+          if((r, order[s]) in time) { printf "%9.1fs", time[r, order[s]] / 1000 } else { printf "%10s", "-" }
+        }
+        if(memory[runs, order[s]] != "") { printf "%10.1fMB\n", memory[runs, order[s]] / 1024 } else { printf "%12s\n", "-" }
+      }
+      print ""
+      for(s = 1; s <= stages; s++) {
+        if(!((runs, order[s]) in time)) { continue }
+        check(order[s], "time", 1000, "s", 1000)
+        check(order[s], "memory", 10240, "MB", 1024)
+      }
+      if(!regressions) { printf "  %s No regressions found in the last run\n", tick }
+    }' "${gravityHistory}"
+}
+
 # Determine if DNS resolution is available before proceeding
 gravity_CheckDNSResolutionAvailable() {
   local lookupDomain="x.filter"
 
+  # Blocklists which are all local files (file://) do not need DNS resolution
+  if [[ -f "${adListFile}" ]] && ! grep -q -v -E '^[[:space:]]*(#|$|file://)' "${adListFile}"; then
+    return 0
+  fi
+
   # Determine if $localList does not exist
   if [[ ! -e "${localList}" ]]; then
     lookupDomain="raw.githubusercontent.com"
@@ -190,13 +430,111 @@ gravity_GetBlocklistUrls() {
   fi
 }
 
+# Resolve each unique source domain once, in parallel, against the local resolver, and against $XFILTER_DNS_1 if blocked
+# A source domain which is blocked is looked up in the query index of the last run, to name its blocklist
+gravity_ResolveSourceDomains() {
+  local domain resolveBuffer str upstream="" blocked address num list signature header useIndex=false
+  local -A seen
+
+  for domain in "${sourceDomains[@]}"; do
+    # Local files and IP addresses are not resolved
+    if [[ "${domain}" != "local" ]] && [[ ! "${domain}" =~ ^[0-9.]+$ ]]; then
+      seen["${domain}"]=1
+    fi
+  done
+  if [[ "${#seen[@]}" -eq 0 ]]; then
+    return 0
+  fi
+
+  str="Resolving ${#seen[@]} blocklist source domains"
+  echo -ne "  ${INFO} ${str}..."
+
+  if [[ -n "${XFILTER_DNS_1:-}" ]]; then
+    upstream="@${XFILTER_DNS_1%#*}"
+    if [[ "${XFILTER_DNS_1}" == *"#"* ]]; then
+      upstream="${upstream} -p ${XFILTER_DNS_1#*#}"
+    fi
+  fi
+
+  resolveBuffer=$(mktemp -p "/tmp" --suffix=".phgpb")
+  for domain in "${!seen[@]}"; do
+    while [[ "$(jobs -rp | wc -l)" -ge "${GRAVITY_DOWNLOAD_WORKERS}" ]]; do
+      wait -n
+    done
+    gravity_ResolveSourceDomain "${domain}" "${upstream}" >> "${resolveBuffer}" &
+  done
+  wait
+
+  # The query index of the last run is only used if it was built from the cached blocklists
+  if [[ -r "${queryIndex}" ]] && [[ -r "${listManifest}" ]] && command -v look &> /dev/null; then
+    signature=$(sha1sum < "${listManifest}")
+    read -r header < "${queryIndex}"
+    [[ "${header}" == "#${signature%% *}" ]] && useIndex=true
+  fi
+
+  while IFS=$'\t' read -r domain blocked address; do
+    [[ "${blocked}" == true ]] || continue
+    sourceAddress["${domain}"]="${address}"
+    sourceBlockedBy["${domain}"]="a blacklist, wildcard or regex filter"
+    if [[ "${useIndex}" == true ]]; then
+      num=$(look "${domain}"$'\t' "${queryIndex}" | awk -F '\t' '{
+        # The first blocklist within the bitset, where each hexadecimal digit holds four blocklists
+        for(i = 1; i <= length($2); i++) {
+          bits = index("0123456789abcdef", substr($2, i, 1)) - 1
+          for(j = 0; j < 4; j++) { if(int(bits / 2 ^ j) % 2) { print (i - 1) * 4 + j; exit } }
+        }
+      }')
+      for list in "${xfilterDir}"/list."${num:-none}".*."${domainsExtension}"; do
+        [[ -e "${list}" ]] && sourceBlockedBy["${domain}"]="${list##*/}"
+      done
+    fi
+  done < "${resolveBuffer}"
+  rm -f "${resolveBuffer}"
+
+  echo -e "${OVER}  ${TICK} ${str} (${#sourceBlockedBy[@]} blocked)"
+}
+
+# Print whether a source domain is blocked by the local resolver, as determined by $BLOCKINGMODE,
+# and, if it is blocked, its address according to the upstream resolver
+gravity_ResolveSourceDomain() {
+  local domain="${1}" upstream="${2}" status addresses address="" blocked=false
+
+  read -r status addresses <<< "$(dig +noall +comments +answer +time=2 +tries=1 "${domain}" 2> /dev/null | awk '
+    /status:/ { sub(/.*status: /, ""); sub(/,.*/, ""); status = $0 }
+    $4 == "A" { addresses = addresses " " $5 }
+    END { print status addresses }')"
+
+  case "${BLOCKINGMODE}" in
+    "IP-NODATA-AAAA"|"IP") [[ " ${addresses} " == *" ${IPV4_ADDRESS} "* ]] && blocked=true;;
+    "NXDOMAIN") [[ "${status}" == "NXDOMAIN" ]] && blocked=true;;
+    "NULL"|*) [[ " ${addresses} " == *" 0.0.0.0 "* ]] && blocked=true;;
+  esac
+
+  # Only a blocked domain needs its upstream address, which is used to download its blocklist
+  if [[ "${blocked}" == true ]] && [[ -n "${upstream}" ]]; then
+    # shellcheck disable=SC2086
+    address=$(dig ${upstream} +short +time=2 +tries=1 "${domain}" A 2> /dev/null | grep -m 1 -E '^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$')
+  fi
+
+  printf "%s\t%s\t%s\n" "${domain}" "${blocked}" "${address}"
+}
+
 # Define options for when retrieving blocklists
 gravity_SetDownloadOptions() {
   local url domain agent cmd_ext str
 
   echo ""
 
-  # Loop through $sources and download each one
+  # Lists whose content is unchanged are only parsed again when the parser or list compression has changed
+  parserVersion=$({ declare -f gravity_ParseFileIntoDomains gravity_DetectListFormat; echo "${GRAVITY_COMPRESS_LISTS}"; } | sha1sum)
+  parserVersion="${parserVersion%% *}"
+
+  if [[ "${skipDownload}" == false ]]; then
+    str="Downloading ${#sources[@]} blocklists (${GRAVITY_DOWNLOAD_WORKERS} concurrent downloads)"
+    echo -ne "  ${INFO} ${str}..."
+  fi
+
+  # Loop through $sources and schedule each download
   for ((i = 0; i < "${#sources[@]}"; i++)); do
     url="${sources[$i]}"
     domain="${sourceDomains[$i]}"
@@ -215,66 +553,128 @@ gravity_SetDownloadOptions() {
     esac
 
     if [[ "${skipDownload}" == false ]]; then
-      echo -e "  ${INFO} Target: ${domain} (${url##*/})"
-      gravity_DownloadBlocklistFromUrl "${url}" "${cmd_ext}" "${agent}"
-      echo ""
+      gravity_ScheduleDownload "${i}" "${url}" "${cmd_ext}" "${agent}"
     fi
   done
+
+  if [[ "${skipDownload}" == false ]]; then
+    gravity_CollectDownloads
+  fi
   gravity_Blackbody=true
 }
 
+# Run a blocklist download in the background, limited to $GRAVITY_DOWNLOAD_WORKERS concurrent downloads
+# The status output of each download is buffered, so that it can be printed in list order
+gravity_ScheduleDownload() {
+  local index="${1}" url="${2}" cmd_ext="${3}" agent="${4}"
+
+  # Wait for a download to finish if all workers are busy
+  while [[ "$(jobs -rp | wc -l)" -ge "${GRAVITY_DOWNLOAD_WORKERS}" ]]; do
+    wait -n
+  done
+
+  {
+    echo -e "  ${INFO} Target: ${domain} (${url##*/})"
+    gravity_DownloadBlocklistFromUrl "${url}" "${cmd_ext}" "${agent}"
+  } &> "${xfilterDir}/${downloadStatus}.${index}.tmp" &
+}
+
+# Wait for all scheduled downloads and print their status output in list order
+gravity_CollectDownloads() {
+  local i
+
+  wait
+  echo -e "${OVER}  ${TICK} ${str}\\n"
+
+  for ((i = 0; i < "${#sources[@]}"; i++)); do
+    if [[ -f "${xfilterDir}/${downloadStatus}.${i}.tmp" ]]; then
+      cat "${xfilterDir}/${downloadStatus}.${i}.tmp"
+      rm -f "${xfilterDir}/${downloadStatus}.${i}.tmp"
+    fi
+    echo ""
+  done
+}
+
 # Download specified URL and perform checks on HTTP status and file content
 gravity_DownloadBlocklistFromUrl() {
-  local url="${1}" cmd_ext="${2}" agent="${3}" heisenbergCompensator="" patternBuffer str httpCode success=""
+  local url="${1}" cmd_ext="${2}" agent="${3}" heisenbergCompensator=() patternBuffer headerBuffer parseBuffer str httpCode success="" attempt listName stageStart bytesReceived bytesIn port
+  local meta key value metaUrl="" metaEtag="" metaModified="" metaLength="" metaHash="" metaParser="" hash
 
-  # Create temp file to store content on disk instead of RAM
+  # Create temp files to store content and response headers on disk instead of RAM
   patternBuffer=$(mktemp -p "/tmp" --suffix=".phgpb")
+  headerBuffer=$(mktemp -p "/tmp" --suffix=".phgpb")
+
+  # Read the ETag, Last-Modified, length and hash of the previous retrieval of this list
+  meta="${saveLocation%."${domainsExtension}"}.${metaExtension}"
+  if [[ -r "${meta}" ]]; then
+    while IFS='=' read -r key value; do
+      case "${key}" in
+        "url") metaUrl="${value}";;
+        "etag") metaEtag="${value}";;
+        "last_modified") metaModified="${value}";;
+        "length") metaLength="${value}";;
+        "sha1") metaHash="${value}";;
+        "parser") metaParser="${value}";;
+      esac
+    done < "${meta}"
+  fi
 
   # Determine if $saveLocation has read permission
   if [[ -r "${saveLocation}" && $url != "file"* ]]; then
-    # Have curl determine if a remote file has been modified since last retrieval
-    # Uses "Last-Modified" header, which certain web servers do not provide (e.g: raw github urls)
+    # Have the server determine if a remote file has been modified since last retrieval
+    # Its "ETag" is used where known, as certain web servers do not provide "Last-Modified" (e.g: raw github urls)
     # Note: Don't do this for local files, always download them
-    heisenbergCompensator="-z ${saveLocation}"
+    if [[ "${metaUrl}" == "${url}" && -n "${metaEtag}${metaModified}" ]]; then
+      [[ -n "${metaEtag}" ]] && heisenbergCompensator+=(-H "If-None-Match: ${metaEtag}")
+      [[ -n "${metaModified}" ]] && heisenbergCompensator+=(-H "If-Modified-Since: ${metaModified}")
+    else
+      heisenbergCompensator=(-z "${saveLocation}")
+    fi
   fi
 
   str="Status:"
   echo -ne "  ${INFO} ${str} Pending..."
-  blocked=false
-  case $BLOCKINGMODE in
-    "IP-NODATA-AAAA"|"IP")
-        if [[ $(dig "${domain}" +short | grep "${IPV4_ADDRESS}" -c) -ge 1 ]]; then
-          blocked=true
-        fi;;
-    "NXDOMAIN")
-        if [[ $(dig "${domain}" | grep "NXDOMAIN" -c) -ge 1 ]]; then
-          blocked=true
-        fi;;
-    "NULL"|*)
-        if [[ $(dig "${domain}" +short | grep "0.0.0.0" -c) -ge 1 ]]; then
-          blocked=true
-        fi;;
-   esac
+  listName="${saveLocation##*/}"
+  listName="${listName%."${domainsExtension}"}"
 
-  if [[ "${blocked}" == true ]]; then
-    printf -v ip_addr "%s" "${XFILTER_DNS_1%#*}"
-    if [[ ${XFILTER_DNS_1} != *"#"* ]]; then
-        port=53
-    else
-        printf -v port "%s" "${XFILTER_DNS_1#*#}"
-    fi
-    ip=$(dig "@${ip_addr}" -p "${port}" +short "${domain}")
-    if [[ $(echo "${url}" | awk -F '://' '{print $1}') = "https" ]]; then
-      port=443;
-    else port=80
-    fi
-    bad_list=$(xfilter -q -adlist hosts-file.net | head -n1 | awk -F 'Match found in ' '{print $2}')
-    echo -e "${OVER}  ${CROSS} ${str} ${domain} is blocked by ${bad_list%:}. Using DNS on ${XFILTER_DNS_1} to download ${url}";
+  # Download blocklists whose source domain is blocked using the address resolved by $XFILTER_DNS_1
+  if [[ -n "${sourceBlockedBy[${domain}]+blocked}" ]]; then
+    echo -e "${OVER}  ${CROSS} ${str} ${domain} is blocked by ${sourceBlockedBy[${domain}]}. Using DNS on ${XFILTER_DNS_1} to download ${url}"
     echo -ne "  ${INFO} ${str} Pending..."
-    cmd_ext="--resolve $domain:$port:$ip $cmd_ext"
+    if [[ -n "${sourceAddress[${domain}]:-}" ]]; then
+      # Use the port within the URL, if any
+      port="${url#*://}"
+      port="${port%%/*}"
+      port="${port##*@}"
+      if [[ "${port}" == *":"* ]]; then
+        port="${port##*:}"
+      elif [[ "${url}" == "https://"* ]]; then
+        port=443
+      else
+        port=80
+      fi
+      cmd_ext="--resolve ${domain}:${port}:${sourceAddress[${domain}]} ${cmd_ext}"
+    fi
   fi
-  # shellcheck disable=SC2086
-  httpCode=$(curl -s -L ${cmd_ext} ${heisenbergCompensator} -w "%{http_code}" -A "${agent}" "${url}" -o "${patternBuffer}" 2> /dev/null)
+
+  # Retry downloads which failed due to connection errors, time-outs or server errors
+  stageStart=$(gravity_ProfileNow)
+  for ((attempt = 0; attempt <= GRAVITY_DOWNLOAD_RETRIES; attempt++)); do
+    if [[ "${attempt}" -gt 0 ]]; then
+      echo -ne "${OVER}  ${INFO} ${str} Retrying (${attempt}/${GRAVITY_DOWNLOAD_RETRIES})..."
+      sleep "${attempt}"
+    fi
+
+    # shellcheck disable=SC2086
+    read -r httpCode bytesReceived <<< "$(curl -s -L --connect-timeout 10 --max-time "${GRAVITY_DOWNLOAD_TIMEOUT}" --compressed ${cmd_ext} "${heisenbergCompensator[@]}" -D "${headerBuffer}" -w "%{http_code} %{size_download}" -A "${agent}" "${url}" -o "${patternBuffer}" 2> /dev/null)"
+
+    case "${url}:${httpCode}" in
+      "file"*) break;;
+      *":000"|*":408"|*":429"|*":5"??) ;;
+      *) break;;
+    esac
+  done
+  gravity_ProfileRecord "transfer ${listName}" "${stageStart}" "$(gravity_ProfileNow)" "${bytesReceived}" "$(stat -c %s "${patternBuffer}" 2> /dev/null)"
 
   case $url in
     # Did we "download" a local file?
@@ -309,8 +709,34 @@ gravity_DownloadBlocklistFromUrl() {
       : # Do not attempt to re-parse file
     # Check if $patternbuffer is a non-zero length file
     elif [[ -s "${patternBuffer}" ]]; then
-      # Determine if blocklist is non-standard and parse as appropriate
-      gravity_ParseFileIntoDomains "${patternBuffer}" "${saveLocation}"
+      bytesIn=$(stat -c %s "${patternBuffer}")
+      hash=$(sha1sum < "${patternBuffer}")
+      hash="${hash%% *}"
+
+      # Servers which ignore conditional requests may still send the same list again
+      if [[ -r "${saveLocation}" && "${url}" == "${metaUrl}" && "${bytesIn}" == "${metaLength}" \
+            && "${hash}" == "${metaHash}" && "${parserVersion}" == "${metaParser}" ]]; then
+        echo -e "  ${INFO} Content unchanged: ${COL_LIGHT_GREEN}using previously parsed list${COL_NC}"
+      else
+        # Determine if blocklist is non-standard and parse as appropriate
+        stageStart=$(gravity_ProfileNow)
+        if [[ "${GRAVITY_COMPRESS_LISTS}" == "none" ]]; then
+          gravity_ParseFileIntoDomains "${patternBuffer}" "${saveLocation}"
+        else
+          # Parse into a temp file, so that only the compressed list is written to $xfilterDir
+          parseBuffer=$(mktemp -p "/tmp" --suffix=".phgpb")
+          gravity_ParseFileIntoDomains "${patternBuffer}" "${parseBuffer}"
+          case "${GRAVITY_COMPRESS_LISTS}" in
+            "gzip") gzip -c -n < "${parseBuffer}";;
+            "zstd") zstd -c -q < "${parseBuffer}";;
+          esac > "${saveLocation}.tmp"
+          mv "${saveLocation}.tmp" "${saveLocation}"
+          rm -f "${parseBuffer}"
+        fi
+        gravity_ProfileRecord "convert ${listName}" "${stageStart}" "$(gravity_ProfileNow)" \
+          "${bytesIn}" "$(stat -c %s "${saveLocation}")" "${parseLinesIn}" "${parseLinesOut}"
+      fi
+      gravity_WriteListMeta "${meta}" "${url}" "${headerBuffer}" "${bytesIn}" "${hash}"
     else
       # Fall back to previously cached list if $patternBuffer is empty
       echo -e "  ${INFO} Received empty file: ${COL_LIGHT_GREEN}using previously cached list${COL_NC}"
@@ -325,9 +751,41 @@ gravity_DownloadBlocklistFromUrl() {
   fi
 }
 
+# Print a cached blocklist, decompressing it if it was compressed by $GRAVITY_COMPRESS_LISTS
+gravity_ReadList() {
+  local magic
+
+  magic=$(head -c 4 "${1}" | od -An -tx1 | tr -d ' \n')
+  case "${magic}" in
+    "1f8b"*) gzip -dc "${1}";;
+    "28b52ffd") zstd -dcq "${1}";;
+    *) cat "${1}";;
+  esac
+}
+
+# Save the ETag and Last-Modified headers of the final response, and the length and hash of the list
+gravity_WriteListMeta() {
+  local meta="${1}" url="${2}" headers="${3}" length="${4}" hash="${5}"
+
+  {
+    echo "url=${url}"
+    awk '
+      { sub(/\r$/, ""); value = $0; sub(/^[^:]*:[ \t]*/, "", value) }
+      /^HTTP\// { etag = ""; modified = "" }
+      tolower($0) ~ /^etag:/ { etag = value }
+      tolower($0) ~ /^last-modified:/ { modified = value }
+      END { print "etag=" etag; print "last_modified=" modified }
+    ' "${headers}"
+    echo "length=${length}"
+    echo "sha1=${hash}"
+    echo "parser=${parserVersion}"
+  } > "${meta}.tmp"
+  mv "${meta}.tmp" "${meta}"
+}
+
 # Parse source files into domains format
 gravity_ParseFileIntoDomains() {
-  local source="${1}" destination="${2}" firstLine abpFilter
+  local source="${1}" destination="${2}" format accepted rejected exceptions removed
 
   # Determine if we are parsing a consolidated list
   if [[ "${source}" == "${xfilterDir}/${matterAndLight}" ]]; then
@@ -348,83 +806,115 @@ gravity_ParseFileIntoDomains() {
 
   # Individual file parsing: Keep comments, while parsing domains from each line
   # We keep comments to respect the list maintainer's licensing
-  read -r firstLine < "${source}"
-
-  # Determine how to parse individual source file formats
-  if [[ "${firstLine,,}" =~ (adblock|ublock|^!) ]]; then
-    # Compare $firstLine against lower case words found in Adblock lists
-    echo -ne "  ${INFO} Format: Adblock"
-
-    # Define symbols used as comments: [!
-    # "||.*^" includes the "Example 2" domains we can extract
-    # https://adblockplus.org/filter-cheatsheet
-    abpFilter="/^(\\[|!)|^(\\|\\|.*\\^)/"
-
-    # Parse Adblock lists by extracting "Example 2" domains
-    # Logic: Ignore lines which do not include comments or domain name anchor
-    awk ''"${abpFilter}"' {
+  format=$(gravity_DetectListFormat "${source}")
+
+  # Parse the whole list in a single pass, printing the number of lines read and written, and of accepted,
+  # rejected and exception entries. A line is accepted when it yields a domain, and rejected otherwise
+  read -r parseLinesIn parseLinesOut accepted rejected exceptions < <(awk -v format="${format}" \
+    -v destination="${destination}" -v exceptionsFile="${destination}.exceptions.tmp" '
+    function accept(domain, line) {
+      if(domain ~ /\./) { print line > destination; accepted++; written++ } else { rejected++ }
+    }
+    {
+      sub(/\r$/, "")
+    }
+    # Keep comments and blank lines as they are, where "##" begins an element hiding rule in Adblock lists
+    (format == "Adblock" ? /^(\[|!|[ \t]*$)/ : /^[ \t]*(#|$)/) {
+      print > destination; written++
+      next
+    }
+    format == "Adblock" {
+      # Exception rules ("@@||example.com^") are removed from this list once it has been parsed
+      if($0 ~ /^@@\|\|.*\^/) {
+        split($0, field, /[|^]/)
+        domain = field[3]
+        gsub(/\$?~?(third-party)/, "", domain)
+        if(domain !~ /[*\/,=\$]/ && domain != "") { print domain > exceptionsFile; exception++ }
+        next
+      }
+      # Extract "Example 2" domains ("||example.com^"): https://adblockplus.org/filter-cheatsheet
+      if($0 !~ /^\|\|.*\^/) { rejected++; next }
       # Remove valid adblock type options
-      gsub(/\$?~?(important|third-party|popup|subdocument|websocket),?/, "", $0)
+      gsub(/\$?~?(important|third-party|popup|subdocument|websocket),?/, "")
       # Remove starting domain name anchor "||" and ending seperator "^"
-      gsub(/^(\|\|)|(\^)/, "", $0)
-      # Remove invalid characters (*/,=$)
-      if($0 ~ /[*\/,=\$]/) { $0="" }
-      # Remove lines which are only IPv4 addresses
-      if($0 ~ /^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$/) { $0="" }
-      if($0) { print $0 }
-    }' "${source}" > "${destination}"
-
-    # Determine if there are Adblock exception rules
-    # https://adblockplus.org/filters
-    if grep -q "^@@||" "${source}" &> /dev/null; then
-      # Parse Adblock lists by extracting exception rules
-      # Logic: Ignore lines which do not include exception format "@@||example.com^"
-      awk -F "[|^]" '/^@@\|\|.*\^/ {
-        # Remove valid adblock type options
-        gsub(/\$?~?(third-party)/, "", $0)
-        # Remove invalid characters (*/,=$)
-        if($0 ~ /[*\/,=\$]/) { $0="" }
-        if($3) { print $3 }
-      }' "${source}" > "${destination}.exceptionsFile.tmp"
-
-      # Remove exceptions
-      comm -23 "${destination}" <(sort "${destination}.exceptionsFile.tmp") > "${source}"
-      mv "${source}" "${destination}"
-    fi
-
-    echo -e "${OVER}  ${TICK} Format: Adblock"
-  elif grep -q "^address=/" "${source}" &> /dev/null; then
-    # Parse Dnsmasq format lists
-    echo -e "  ${CROSS} Format: Dnsmasq (list type not supported)"
-  elif grep -q -E "^https?://" "${source}" &> /dev/null; then
-    # Parse URL list if source file contains "http://" or "https://"
-    # Scanning for "^IPv4$" is too slow with large (1M) lists on low-end hardware
-    echo -ne "  ${INFO} Format: URL"
-
-    awk '
+      gsub(/^(\|\|)|(\^)/, "")
+      # Reject invalid characters (*/,=$), and lines which are only IPv4 addresses
+      if($0 ~ /[*\/,=\$]/ || $0 ~ /^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$/) { rejected++; next }
+      accept($0, $0)
+      next
+    }
+    format == "Dnsmasq" {
+      # Take each domain from "address=/example.com/example.net/0.0.0.0"
+      if($0 !~ /^address=\/.+\//) { rejected++; next }
+      n = split($0, field, "/")
+      for(i = 2; i < n; i++) {
+        sub(/^\./, "", field[i])
+        if(field[i] != "" && field[i] != "#") { accept(field[i], field[i]) } else { rejected++ }
+      }
+      next
+    }
+    format == "URL" {
       # Remove URL scheme, optional "username:password@", and ":?/;"
       # The scheme must be matched carefully to avoid blocking the wrong URL
       # in cases like:
       #   http://www.evil.com?http://www.good.com
       # See RFC 3986 section 3.1 for details.
-      /[:?\/;]/ { gsub(/(^[a-zA-Z][a-zA-Z0-9+.-]*:\/\/(.*:.*@)?|[:?\/;].*)/, "", $0) }
-      # Skip lines which are only IPv4 addresses
-      /^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$/ { next }
-      # Print if nonempty
-      length { print }
-    ' "${source}" 2> /dev/null > "${destination}"
-
-    echo -e "${OVER}  ${TICK} Format: URL"
-  else
-    # Default: Keep hosts/domains file in same format as it was downloaded
-    output=$( { mv "${source}" "${destination}"; } 2>&1 )
-
-    if [[ ! -e "${destination}" ]]; then
-      echo -e "\\n  ${CROSS} Unable to move tmp file to ${xfilterDir}
-    ${output}"
-      gravity_Cleanup "error"
-    fi
+      if($0 ~ /[:?\/;]/) { gsub(/(^[a-zA-Z][a-zA-Z0-9+.-]*:\/\/(.*:.*@)?|[:?\/;].*)/, "") }
+      # Reject lines which are only IPv4 addresses
+      if($0 ~ /^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$/) { rejected++; next }
+      accept($0, $0)
+      next
+    }
+    {
+      # Hosts and domains lists are kept in the same format as they were downloaded
+      line = $0
+      sub(/#.*/, "")
+      sub(/\/.*/, "")
+      accept((NF > 1) ? $2 : $1, line)
+    }
+    END { printf "%d %d %d %d %d\n", NR, written, accepted, rejected, exception }
+  ' "${source}")
+
+  # Remove the domains of exception rules from the parsed list, without sorting it
+  if [[ "${exceptions}" -gt 0 ]]; then
+    removed=$(awk -v out="${destination}.tmp" '
+      NR == FNR { exception[$0]; next }
+      ($0 in exception) { removed++; next }
+      { print > out }
+      END { print removed + 0 }
+    ' "${destination}.exceptions.tmp" "${destination}")
+    mv "${destination}.tmp" "${destination}"
+    accepted=$((accepted - removed))
+    parseLinesOut=$((parseLinesOut - removed))
   fi
+  rm -f "${destination}.exceptions.tmp"
+
+  echo -e "  ${TICK} Format: ${format} (${accepted} accepted, ${rejected} rejected, ${exceptions} exceptions)"
+}
+
+# Determine the format of a blocklist from its first line and a sample of its first 1000 entries
+# Adblock lists are recognised by their header or "||" rules, which take precedence over
+# dnsmasq "address=/" lists, then URL lists, and then hosts or domains lists
+gravity_DetectListFormat() {
+  awk '
+    NR == 1 && tolower($0) ~ /(adblock|ublock|^!)/ { adblock++ }
+    /^[ \t]*(#|$)/ { next }
+    /^@?@?\|\|/ { adblock++ }
+    /^address=\// { dnsmasq++ }
+    /^https?:\/\// { url++ }
+    ++entries >= 1000 { exit }
+    END {
+      if(adblock) { print "Adblock" }
+      else if(dnsmasq) { print "Dnsmasq" }
+      else if(url) { print "URL" }
+      else { print "Hosts" }
+    }
+  ' "${1}"
+}
+
+# Sort within the memory budget and spill directory given by $sortOptions
+gravity_Sort() {
+  sort "${sortOptions[@]}" "$@"
 }
 
 # Create (unfiltered) "Matter and Light" consolidated list
@@ -444,7 +934,7 @@ gravity_ConsolidateDownloadedBlocklists() {
     # Determine if file has read permissions, as download might have failed
     if [[ -r "${i}" ]]; then
       # Remove windows CRs from file, convert list to lower case, and append into $matterAndLight
-      tr -d '\r' < "${i}" | tr '[:upper:]' '[:lower:]' >> "${xfilterDir}/${matterAndLight}"
+      gravity_ReadList "${i}" | tr -d '\r' | tr '[:upper:]' '[:lower:]' >> "${xfilterDir}/${matterAndLight}"
 
       # Ensure that the first line of a new list is on a new line
       lastLine=$(tail -1 "${xfilterDir}/${matterAndLight}")
@@ -477,12 +967,16 @@ gravity_SortAndFilterConsolidatedList() {
   fi
   echo -e "  ${INFO} Number of domains being pulled in by gravity: ${COL_BLUE}${num}${COL_NC}"
 
+  gravity_ParseBlocklists
+  gravity_BuildQueryIndex
+
   str="Removing duplicate domains"
   if [[ "${haveSourceUrls}" == true ]]; then
     echo -ne "  ${INFO} ${str}..."
   fi
 
-  sort -u "${xfilterDir}/${parsedMatter}" > "${xfilterDir}/${preEventHorizon}"
+  # Merge the sorted blocklists, instead of sorting the consolidated list
+  gravity_Sort -m -u "${parsedLists[@]}" < /dev/null > "${xfilterDir}/${preEventHorizon}"
 
   if [[ "${haveSourceUrls}" == true ]]; then
     echo -e "${OVER}  ${TICK} ${str}"
@@ -506,11 +1000,435 @@ gravity_Whitelist() {
   echo -ne "  ${INFO} ${str}..."
 
   # Print everything from preEventHorizon into whitelistMatter EXCEPT domains in $whitelistFile
-  comm -23 "${xfilterDir}/${preEventHorizon}" <(sort "${whitelistFile}") > "${xfilterDir}/${whitelistMatter}"
+  comm -23 "${xfilterDir}/${preEventHorizon}" <(gravity_Sort "${whitelistFile}") > "${xfilterDir}/${whitelistMatter}"
 
   echo -e "${OVER}  ${INFO} ${str}"
 }
 
+# Find the cached blocklists when gravity is not downloading them
+gravity_GetCachedBlocklists() {
+  mapfile -t activeDomains < <(printf "%s\n" "${xfilterDir}"/list.*."${domainsExtension}" | sort -V)
+  echo -e "  ${INFO} Using ${#activeDomains[@]} cached blocklists..."
+}
+
+# Parse domains from a blocklist on stdin, one domain per line
+gravity_ParseDomainStream() {
+  awk '{
+    # Remove windows CRs and convert to lower case
+    gsub(/\r/, "")
+    $0 = tolower($0)
+    # Remove comments, and anything following a "/"
+    sub(/#.*/, "")
+    sub(/\/.*/, "")
+    # Take the domain from hosts format lines ("ipaddr domain")
+    domain = (NF > 1) ? $2 : $1
+    gsub(/\.\.+/, ".", domain)
+    if(domain ~ /\./) { print domain }
+  }'
+}
+
+# Parse each blocklist into a sorted list of unique domains, skipping blocklists which have not changed
+# $listManifest records the URL, content hash and domain count of each blocklist's parsed output
+gravity_ParseBlocklists() {
+  local i list url hash count parsed str start listName changed=0 unchanged=0
+  local -A manifestUrl manifestHash manifestCount
+
+  str="Parsing blocklists"
+  echo -ne "  ${INFO} ${str}..."
+
+  if [[ -r "${listManifest}" ]]; then
+    while IFS=$'\t' read -r list url hash count; do
+      manifestUrl["${list}"]="${url}"
+      manifestHash["${list}"]="${hash}"
+      manifestCount["${list}"]="${count}"
+    done < "${listManifest}"
+  fi
+
+  parsedLists=()
+  parsedCount=0
+  : > "${listManifest}.tmp"
+
+  for ((i = 0; i < "${#activeDomains[@]}"; i++)); do
+    list="${activeDomains[$i]}"
+
+    # Determine if file has read permissions, as download might have failed
+    if [[ ! -r "${list}" ]]; then
+      continue
+    fi
+
+    # Use the manifest URL when gravity is not downloading blocklists
+    url="${sources[$i]:-${manifestUrl[${list}]}}"
+    parsed="${list%."${domainsExtension}"}.${parsedExtension}"
+    hash=$(sha1sum < "${list}")
+    hash="${hash%% *}"
+
+    if [[ -r "${parsed}" ]] && [[ "${hash}" == "${manifestHash[${list}]:-}" ]] && [[ "${url}" == "${manifestUrl[${list}]:-}" ]]; then
+      count="${manifestCount[${list}]}"
+      : $((unchanged++))
+    else
+      start=$(gravity_ProfileNow)
+      gravity_ReadList "${list}" | gravity_ParseDomainStream | gravity_Sort -u > "${parsed}"
+      count=$(wc -l < "${parsed}")
+      listName="${list##*/}"
+      gravity_ProfileRecord "parse ${listName%."${domainsExtension}"}" "${start}" "$(gravity_ProfileNow)" \
+        "$(stat -c %s "${list}")" "$(stat -c %s "${parsed}")" "" "${count}"
+      : $((changed++))
+    fi
+
+    parsedLists+=("${parsed}")
+    parsedCount=$((parsedCount + count))
+    printf "%s\t%s\t%s\t%s\n" "${list}" "${url}" "${hash}" "${count}" >> "${listManifest}.tmp"
+  done
+
+  mv "${listManifest}.tmp" "${listManifest}"
+  echo -e "${OVER}  ${TICK} ${str} (${changed} changed, ${unchanged} unchanged)"
+}
+
+# Build the index used by "xfilter -q -exact" to find which blocklists contain a domain
+# Each line maps a domain to a hexadecimal bitset of blocklist numbers, where the first digit
+# holds blocklists 0-3, the second holds 4-7, and so on
+gravity_BuildQueryIndex() {
+  local i signature header str merge=""
+
+  # Skip rebuilding the index if it was built from the current blocklists
+  signature=$(sha1sum < "${listManifest}")
+  signature="#${signature%% *}"
+  if [[ -r "${queryIndex}" ]]; then
+    read -r header < "${queryIndex}"
+    if [[ "${header}" == "${signature}" ]]; then
+      return 0
+    fi
+  fi
+
+  str="Building query index"
+  echo -ne "  ${INFO} ${str}..."
+
+  # Logic: Merge the sorted blocklists, tagging each domain with the number of its blocklist
+  for ((i = 0; i < "${#activeDomains[@]}"; i++)); do
+    if [[ -r "${activeDomains[$i]%."${domainsExtension}"}.${parsedExtension}" ]]; then
+      printf -v merge "%s <(sed 's/$/\\t%s/' %q)" "${merge}" "${i}" "${activeDomains[$i]%."${domainsExtension}"}.${parsedExtension}"
+    fi
+  done
+
+  eval "gravity_Sort -m ${merge} < /dev/null" | \
+  awk -F '\t' -v signature="${signature}" '
+    function flush(   k, bits) {
+      bits = ""
+      for(k = 0; k <= top; k++) { bits = bits sprintf("%x", nibble[k]); nibble[k] = 0 }
+      print domain "\t" bits
+    }
+    BEGIN { print signature }
+    $1 != domain { if(NR > 1) { flush() }; domain = $1; top = 0 }
+    {
+      # Each domain is unique within its blocklist, so adding each bit is safe
+      k = int($2 / 4)
+      nibble[k] += 2 ^ ($2 % 4)
+      if(k > top) { top = k }
+    }
+    END { if(NR > 0) { flush() } }' > "${queryIndex}.tmp"
+
+  mv "${queryIndex}.tmp" "${queryIndex}"
+  # Remove the reverse index written by earlier versions, which is no longer used
+  rm -f "${xfilterDir}/list.rindex" 2> /dev/null
+  echo -e "${OVER}  ${TICK} ${str}"
+}
+
+# Merge the parsed blocklists while removing duplicates, then remove whitelisted domains
+# The number of unique domains before whitelisting is written to $1
+gravity_MergeParsedBlocklists() {
+  local counts="${1}"
+  local -a status
+
+  : > "${counts}"
+  gravity_Sort -m -u "${parsedLists[@]}" < /dev/null | \
+  awk -v whitelist="${whitelistFile}" -v counts="${counts}" 'BEGIN {
+    while((getline line < whitelist) > 0) { whitelisted[line] }
+  } {
+    unique++
+    if(!($0 in whitelisted)) { print }
+  } END { print unique+0 > counts }'
+  status=("${PIPESTATUS[@]}")
+
+  [[ ! "${status[*]}" =~ [1-9] ]]
+}
+
+# Record the whitelist which has been applied to gravity.list, along with the blocklists it was applied to
+gravity_SaveAppliedWhitelist() {
+  local signature
+
+  signature=$(sha1sum < "${listManifest}")
+  { echo "#${signature%% *}"; sort -u "${whitelistFile}" 2> /dev/null; } > "${appliedWhitelist}.tmp"
+  mv "${appliedWhitelist}.tmp" "${appliedWhitelist}"
+}
+
+# Compile the parsed blocklists into gravity.list within a single streaming pass
+# The sorted blocklists are merged, and no intermediate files are written to disk
+gravity_CompileGravity() {
+  local str num counts="${xfilterDir}/${basename}.counts.tmp" unique
+
+  str="Compiling blocklists into gravity"
+  echo -ne "  ${INFO} ${str}..."
+
+  if ! gravity_MergeParsedBlocklists "${counts}" > "${adList}.tmp"; then
+    echo -e "${OVER}  ${CROSS} ${str}"
+    echo -e "  ${CROSS} Unable to compile blocklists into ${adList}"
+    gravity_Cleanup "error"
+  fi
+
+  # Atomically replace $adList, so FTL never sees a partially written file
+  if ! output=$( { mv "${adList}.tmp" "${adList}"; } 2>&1 ); then
+    echo -e "${OVER}  ${CROSS} ${str}\\n  ${output}"
+    gravity_Cleanup "error"
+  fi
+
+  # Remove superseded Event Horizon list, which is only generated using --debug-stages
+  rm -f "${xfilterDir}/${preEventHorizon}" 2> /dev/null
+  gravity_SaveAppliedWhitelist
+
+  echo -e "${OVER}  ${TICK} ${str}"
+
+  profileLinesIn="${parsedCount}"
+  profileBytesIn=$(stat -c %s "${parsedLists[@]}" < /dev/null | awk '{ bytes += $1 } END { print bytes + 0 }')
+  num=$(printf "%'.0f" "${parsedCount}")
+  echo -e "  ${INFO} Number of domains being pulled in by gravity: ${COL_BLUE}${num}${COL_NC}"
+  unique=$(printf "%'.0f" "$(< "${counts}")")
+  echo -e "  ${INFO} Number of unique domains trapped in the Event Horizon: ${COL_BLUE}${unique}${COL_NC}"
+  if [[ -f "${whitelistFile}" ]]; then
+    echo -e "  ${INFO} Number of whitelisted domains: $(wc -l < "${whitelistFile}")"
+  fi
+}
+
+# Apply whitelist changes made since gravity.list was compiled, without recompiling the blocklists
+# Newly whitelisted domains are filtered out, and domains removed from the whitelist are merged back in
+# if the query index shows they are within a blocklist. Returns 1 if a recompile is needed
+gravity_ApplyWhitelistDelta() {
+  local signature header str output domain maxChanges=1000
+  local -a whitelisted unwhitelisted
+
+  if [[ "${debugStages}" == true ]] || ! command -v look &> /dev/null; then
+    return 1
+  fi
+  if [[ ! -f "${adList}" ]] || [[ ! -r "${appliedWhitelist}" ]] || [[ ! -r "${queryIndex}" ]] || [[ ! -r "${listManifest}" ]]; then
+    return 1
+  fi
+
+  # The applied whitelist and query index must both belong to the blocklists gravity.list was compiled from
+  signature=$(sha1sum < "${listManifest}")
+  signature="#${signature%% *}"
+  read -r header < "${appliedWhitelist}"
+  [[ "${header}" == "${signature}" ]] || return 1
+  read -r header < "${queryIndex}"
+  [[ "${header}" == "${signature}" ]] || return 1
+
+  mapfile -t whitelisted < <(sort -u "${whitelistFile}" 2> /dev/null | comm -13 <(tail -n +2 "${appliedWhitelist}") -)
+  mapfile -t unwhitelisted < <(sort -u "${whitelistFile}" 2> /dev/null | comm -23 <(tail -n +2 "${appliedWhitelist}") -)
+
+  # Looking up each change in the query index is only cheaper than a recompile for small changes
+  if [[ $(( ${#whitelisted[@]} + ${#unwhitelisted[@]} )) -gt "${maxChanges}" ]]; then
+    return 1
+  fi
+
+  str="Applying whitelist changes to gravity"
+  echo -ne "  ${INFO} ${str}..."
+
+  # Write the patched list beside gravity.list, so FTL never sees a partially patched file
+  grep -v -x -F -f <(printf "%s\n" "${whitelisted[@]}") "${adList}" > "${adList}.whitelisted.tmp"
+  if [[ "$?" -gt 1 ]]; then
+    echo -e "${OVER}  ${CROSS} ${str}"
+    rm -f "${adList}.whitelisted.tmp"
+    return 1
+  fi
+  for domain in "${unwhitelisted[@]}"; do
+    if [[ -n "${domain}" ]] && look "${domain}"$'\t' "${queryIndex}" &> /dev/null; then
+      echo "${domain}"
+    fi
+  done | gravity_Sort -u | gravity_Sort -m -u "${adList}.whitelisted.tmp" - > "${adList}.tmp"
+  rm -f "${adList}.whitelisted.tmp"
+
+  if ! output=$( { mv "${adList}.tmp" "${adList}"; } 2>&1 ); then
+    echo -e "${OVER}  ${CROSS} ${str}\n  ${output}"
+    rm -f "${adList}.tmp"
+    return 1
+  fi
+
+  gravity_SaveAppliedWhitelist
+
+  echo -e "${OVER}  ${TICK} ${str} (${#whitelisted[@]} added, ${#unwhitelisted[@]} removed)"
+  if [[ -f "${whitelistFile}" ]]; then
+    echo -e "  ${INFO} Number of whitelisted domains: $(wc -l < "${whitelistFile}")"
+  fi
+}
+
+# Check that gravity.list blocks the same domains as a full recompile of the cached blocklists
+gravity_VerifyGravity() {
+  local list str missing unexpected counts="${xfilterDir}/${basename}.counts.tmp"
+
+  str="Verifying ${adList##*/} against a full recompile"
+  echo -ne "  ${INFO} ${str}..."
+
+  parsedLists=()
+  if [[ -r "${listManifest}" ]]; then
+    while IFS=$'\t' read -r list _; do
+      parsedLists+=("${list%."${domainsExtension}"}.${parsedExtension}")
+    done < "${listManifest}"
+  fi
+
+  if [[ ! -f "${adList}" ]] || ! gravity_MergeParsedBlocklists "${counts}" > "${adList}.verify.tmp"; then
+    echo -e "${OVER}  ${CROSS} ${str}"
+    echo -e "  ${CROSS} Unable to compile the cached blocklists"
+    rm -f "${counts}" "${adList}.verify.tmp" 2> /dev/null
+    return 1
+  fi
+
+  gravity_Sort -u "${adList}" > "${adList}.effective.tmp"
+  missing=$(comm -13 "${adList}.effective.tmp" "${adList}.verify.tmp" | wc -l)
+  unexpected=$(comm -23 "${adList}.effective.tmp" "${adList}.verify.tmp" | wc -l)
+  rm -f "${counts}" "${adList}.verify.tmp" "${adList}.effective.tmp" 2> /dev/null
+
+  if [[ "${missing}" -ne 0 ]] || [[ "${unexpected}" -ne 0 ]]; then
+    echo -e "${OVER}  ${CROSS} ${str}"
+    echo -e "  ${CROSS} ${missing} domains are missing from ${adList##*/}, and ${unexpected} domains should not be blocked"
+    echo -e "  ${INFO} Run 'xfilter -g --skip-download --whitelist-only' to recompile"
+    return 1
+  fi
+
+  echo -e "${OVER}  ${TICK} ${str}"
+}
+
+# Compile regex filters for "xfilter -q" and "xfilter --regex-bench"
+# Suffix filters, such as converted wildcards, are indexed by their reversed labels, so they can be matched using
+# binary searches. Every other filter is validated, and the longest literal which each of its matches must contain
+# is taken from it, so most domains are rejected by a string comparison rather than by evaluating the filter.
+# Filters without such a literal are merged into alternations, so one evaluation rejects a domain for all of them
+gravity_CompileRegexFilters() {
+  local pattern
+
+  if [[ ! -f "${regexFile}" ]]; then
+    rm -f "${regexSuffixFile}" "${regexCompiledFile}" 2> /dev/null
+    return 0
+  fi
+
+  # Logic: Match "(^|\.)example\.com$" filters, and print their reversed domain ("com.example") with the filter
+  awk -v suffixes="sort -u > ${regexSuffixFile}.tmp" -v patterns="${regexFile}.patterns.tmp" '
+    BEGIN { printf "" > patterns }
+    /^#/ || !NF { next }
+    substr($0, 1, 6) == "(^|\\.)" && substr($0, length($0)) == "$" {
+      domain = substr($0, 7, length($0) - 7)
+      if(domain ~ /^[a-z0-9_-]+(\\\.[a-z0-9_-]+)*$/) {
+        gsub(/\\\./, ".", domain)
+        n = split(domain, labels, ".")
+        reversed = labels[n]
+        for(k = n - 1; k > 0; k--) { reversed = reversed "." labels[k] }
+        print reversed "\t" $0 | suffixes
+        next
+      }
+    }
+    { print > patterns }
+    END { printf "" | suffixes; close(suffixes) }' "${regexFile}"
+
+  # Filters which are not valid extended regular expressions are left out, as they can never match
+  # They are only checked one by one if checking them all at once has failed
+  : > "${regexFile}.invalid.tmp"
+  grep -E -q -f "${regexFile}.patterns.tmp" /dev/null 2> /dev/null
+  if [[ "$?" -eq 2 ]]; then
+    while IFS= read -r pattern; do
+      grep -E -q -e "${pattern}" /dev/null 2> /dev/null
+      if [[ "$?" -eq 2 ]]; then
+        echo -e "  ${CROSS} Invalid regex filter: ${pattern}"
+        echo "${pattern}" >> "${regexFile}.invalid.tmp"
+      fi
+    done < "${regexFile}.patterns.tmp"
+  fi
+
+  # Each line is "kind literal filter", where a domain can only match the filter if it
+  # starts with the literal (prefix), ends with it (suffix) or contains it (contains)
+  # A "group" line is the alternation of the "member" filters following it, which are only evaluated if it matches
+  awk -v groupSize=32 -v invalidFile="${regexFile}.invalid.tmp" '
+    function flush(anchor) {
+      if(runPrefix) { anchor = "prefix" }
+      if(length(run) > length(best) || (run != "" && length(run) == length(best) && bestAnchor == "contains")) {
+        best = run
+        bestAnchor = anchor
+      }
+      run = ""
+      runPrefix = 0
+      literal = 0
+    }
+    function append(c) {
+      if(run == "") { runPrefix = leading }
+      run = run c
+      literal = 1
+    }
+    # Find the longest literal outside of groups and bracket expressions, which is not made optional by a quantifier
+    # A filter with alternatives at its top level has no such literal
+    function required(p,   n, i, j, k, c, depth) {
+      best = ""; bestAnchor = "contains"; run = ""; runPrefix = 0; literal = 0; depth = 0
+      n = length(p)
+      for(i = 1; i <= n; i++) {
+        c = substr(p, i, 1)
+        leading = (i == 2 && substr(p, 1, 1) == "^")
+        if(c == "\\") {
+          c = substr(p, ++i, 1)
+          if(depth || c == "" || c ~ /[0-9A-Za-z<>`'"'"']/) { flush("contains") } else { append(c) }
+        } else if(c == "[") {
+          j = i + 1
+          if(substr(p, j, 1) == "^") { j++ }
+          if(substr(p, j, 1) == "]") { j++ }
+          while(j <= n && substr(p, j, 1) != "]") {
+            if(substr(p, j, 2) ~ /^\[[:.=]/ && (k = index(substr(p, j + 2), substr(p, j + 1, 1) "]"))) { j += k + 3 } else { j++ }
+          }
+          i = j
+          flush("contains")
+        } else if(c == "*" || c == "?" || (c == "{" && match(substr(p, i), /^\{[0-9]*(,[0-9]*)?\}/))) {
+          if(literal) { run = substr(run, 1, length(run) - 1) }
+          if(c == "{") { i += RLENGTH - 1 }
+          flush("contains")
+        } else if(c == "|" && !depth) {
+          return ""
+        } else if(c == "(") {
+          flush("contains")
+          depth++
+        } else if(c == ")") {
+          flush("contains")
+          depth--
+        } else if(c == "$" && i == n && !depth) {
+          flush("suffix")
+        } else if(depth || c == "." || c == "^" || c == "$" || c == "+" || c == "{") {
+          flush("contains")
+        } else {
+          append(c)
+        }
+      }
+      flush("contains")
+      return best
+    }
+    function group(   i, alternation) {
+      if(!members) { return }
+      alternation = "(" member[1] ")"
+      for(i = 2; i <= members; i++) { alternation = alternation "|(" member[i] ")" }
+      print "group\t-\t" alternation
+      for(i = 1; i <= members; i++) { print "member\t-\t" member[i] }
+      members = 0
+    }
+    BEGIN { while((getline line < invalidFile) > 0) { invalid[line] } }
+    $0 in invalid || seen[$0]++ { next }
+    {
+      # Filters with back-references cannot be merged, as the groups they refer to would be renumbered
+      if($0 ~ /\\[1-9]/) { print "always\t-\t" $0; next }
+      if((lit = required($0)) != "" && (length(lit) >= 3 || (length(lit) == 2 && bestAnchor != "contains"))) {
+        print bestAnchor "\t" lit "\t" $0
+        next
+      }
+      member[++members] = $0
+      if(members == groupSize) { group() }
+    }
+    END { group() }' "${regexFile}.patterns.tmp" > "${regexCompiledFile}.tmp"
+
+  rm -f "${regexFile}.patterns.tmp" "${regexFile}.invalid.tmp"
+  mv "${regexSuffixFile}.tmp" "${regexSuffixFile}"
+  mv "${regexCompiledFile}.tmp" "${regexCompiledFile}"
+}
+
 # Output count of blacklisted domains and regex filters
 gravity_ShowBlockCount() {
   local num
@@ -583,6 +1501,8 @@ gravity_ParseBlacklistDomains() {
   fi
 
   # Move the file over as /etc/xfilter/gravity.list so dnsmasq can use it
+  # Whitelist changes can not be applied to it incrementally, as the applied whitelist is not recorded
+  rm -f "${appliedWhitelist}" 2> /dev/null
   output=$( { mv "${xfilterDir}/${accretionDisc}" "${adList}"; } 2>&1 )
   status="$?"
 
@@ -602,9 +1522,42 @@ gravity_ParseUserDomains() {
     echo -e "\\n  ${CROSS} Unable to move ${blacklistFile##*/} to ${xfilterDir}"
 }
 
+# Write gravity.bin, the domains of gravity.list and black.list in a form which can be memory-mapped rather than parsed
+gravity_BuildBinaryList() {
+  local python str="Building binary blocklist"
+
+  python="$(command -v python3 || command -v python)"
+  if [[ -z "${python}" ]]; then
+    # A gravity.bin which no longer matches the lists must not be loaded
+    rm -f "${binaryList}"
+    echo -e "  ${INFO} Python is not installed, so no binary blocklist was built"
+    return 0
+  fi
+
+  echo -ne "  ${INFO} ${str}..."
+  # Each domain is flagged 1 if in gravity.list, 2 if in black.list, or 3 if in both
+  { awk '!/^#/ && NF { print $NF "\t1" }' "${adList}" 2> /dev/null
+    awk '!/^#/ && NF { print $NF "\t2" }' "${blackList}" 2> /dev/null
+  } | gravity_Sort -t $'\t' -k1,1 | awk -F '\t' '
+    $1 != last { if(NR > 1) print last "\t" flags; last = $1; flags = 0 }
+    flags != 3 && flags != $2 { flags += $2 }
+    END { if(NR) print last "\t" flags }' > "${binaryList}.domains.tmp"
+
+  if ! "${python}" "${XFILTER_ROOT}/opt/xfilter/xfilterBlocklist.py" build --gravity "${adList}" --blacklist "${blackList}" \
+      "${binaryList}.domains.tmp" "${binaryList}" > /dev/null; then
+    rm -f "${binaryList}"
+    echo -e "${OVER}  ${CROSS} ${str}"
+  else
+    echo -e "${OVER}  ${TICK} ${str}"
+  fi
+  rm -f "${binaryList}.domains.tmp" "${binaryList}.tmp"
+}
+
 # Trap Ctrl-C
 gravity_Trap() {
   trap '{ echo -e "\\n\\n  ${INFO} ${COL_LIGHT_RED}User-abort detected${COL_NC}"; gravity_Cleanup "error"; }' INT
+  # However gravity exits, its memory sampler is stopped
+  trap 'gravity_ProfileStop' EXIT
 }
 
 # Clean up after Gravity upon exit or cancellation
@@ -614,17 +1567,19 @@ gravity_Cleanup() {
   str="Cleaning up stray matter"
   echo -ne "  ${INFO} ${str}..."
 
-  # Delete tmp content generated by Gravity
-  rm ${xfilterDir}/xfilter.*.txt 2> /dev/null
-  rm ${xfilterDir}/*.tmp 2> /dev/null
+  # Delete tmp content generated by Gravity, unless each stage was requested to be kept
+  if [[ "${debugStages}" == false ]]; then
+    rm "${xfilterDir}"/xfilter.*.txt 2> /dev/null
+  fi
+  rm "${xfilterDir}"/*.tmp 2> /dev/null
   rm /tmp/*.phgpb 2> /dev/null
 
   # Ensure this function only runs when gravity_SetDownloadOptions() has completed
   if [[ "${gravity_Blackbody:-}" == true ]]; then
-    # Remove any unused .domains files
-    for file in ${xfilterDir}/*.${domainsExtension}; do
+    # Remove any unused .domains, .parsed and .meta files
+    for file in "${xfilterDir}"/*."${domainsExtension}" "${xfilterDir}"/*."${parsedExtension}" "${xfilterDir}"/*."${metaExtension}"; do
       # If list is not in active array, then remove it
-      if [[ ! "${activeDomains[*]}" == *"${file}"* ]]; then
+      if [[ ! "${activeDomains[*]}" == *"${file%.*}.${domainsExtension}"* ]]; then
         rm -f "${file}" 2> /dev/null || \
           echo -e "  ${CROSS} Failed to remove ${file##*/}"
       fi
@@ -641,6 +1596,7 @@ gravity_Cleanup() {
 
   # Print X-filter status if an error occured
   if [[ -n "${error}" ]]; then
+    gravity_ProfileStop
     "${XFILTER_COMMAND}" status
     exit 1
   fi
@@ -652,7 +1608,19 @@ Update domains from blocklists specified in adlists.list
 
 Options:
   -f, --force          Force the download of all specified blocklists
-  -h, --help           Show this help dialog"
+  --debug-stages       Compile gravity in stages, keeping each intermediate file
+  --verify             Check that gravity.list matches a full recompile of the cached blocklists
+  --report [runs]      Compare the timings of the last runs (default: 5), flagging regressions
+  -h, --help           Show this help dialog
+
+Blocklists are downloaded concurrently. The following setupVars.conf settings apply:
+  GRAVITY_DOWNLOAD_WORKERS   Number of concurrent downloads (default: 4)
+  GRAVITY_DOWNLOAD_TIMEOUT   Maximum time in seconds per download attempt (default: 60)
+  GRAVITY_DOWNLOAD_RETRIES   Number of retries after transient failures (default: 2)
+  GRAVITY_COMPRESS_LISTS     Keep cached blocklists compressed with gzip or zstd (default: none)
+  GRAVITY_SORT_MEMORY        Memory budget of each sort, e.g. 64M or 10% (default: chosen by sort)
+  GRAVITY_SORT_TMPDIR        Directory which sort spills its sorted runs to (default: \$TMPDIR or /tmp)
+  GRAVITY_SORT_PARALLEL      Number of sort threads on multi-core hosts (default: chosen by sort)"
   exit 0
 }
 
@@ -664,9 +1632,25 @@ for var in "$@"; do
     "-b" | "--blacklist-only" ) listType="blacklist";;
     "-w" | "--whitelist-only" ) listType="whitelist";;
     "-wild" | "--wildcard-only" ) listType="wildcard"; dnsRestartType="restart";;
+    "--debug-stages" ) debugStages=true;;
+    "--verify" ) verifyGravity=true;;
+    "--report" ) reportRuns=5;;
+    [0-9]* ) [[ -n "${reportRuns}" ]] && [[ "${var}" =~ ^[1-9][0-9]*$ ]] && reportRuns="${var}";;
   esac
 done
 
+if [[ "${verifyGravity}" == true ]]; then
+  gravity_VerifyGravity
+  exit
+fi
+
+if [[ -n "${reportRuns}" ]]; then
+  gravity_Report "${reportRuns}"
+  exit
+fi
+
+gravity_ProfileStart
+
 # Trap Ctrl-C
 gravity_Trap
 
@@ -674,7 +1658,7 @@ if [[ "${forceDelete:-}" == true ]]; then
   str="Deleting existing list cache"
   echo -ne "${INFO} ${str}..."
 
-  rm /etc/xfilter/list.* 2> /dev/null || true
+  rm "${xfilterDir}"/list.* 2> /dev/null || true
   echo -e "${OVER}  ${TICK} ${str}"
 fi
 
@@ -683,51 +1667,80 @@ detect_xfilter_blocking_status
 # Determine which functions to run
 if [[ "${skipDownload}" == false ]]; then
   # Gravity needs to download blocklists
-  gravity_CheckDNSResolutionAvailable
-  gravity_GetBlocklistUrls
+  gravity_ProfileStage "dns" "" gravity_CheckDNSResolutionAvailable
+  gravity_ProfileStage "urls" "" gravity_GetBlocklistUrls
   if [[ "${haveSourceUrls}" == true ]]; then
-    gravity_SetDownloadOptions
+    gravity_ProfileStage "resolve" "" gravity_ResolveSourceDomains
+    gravity_ProfileStage "download" "" gravity_SetDownloadOptions
   fi
-  gravity_ConsolidateDownloadedBlocklists
-  gravity_SortAndFilterConsolidatedList
-else
+  if [[ "${debugStages}" == true ]]; then
+    gravity_ProfileStage "consolidate" "${xfilterDir}/${matterAndLight}" gravity_ConsolidateDownloadedBlocklists
+    gravity_ProfileStage "sort" "${xfilterDir}/${preEventHorizon}" gravity_SortAndFilterConsolidatedList
+  fi
+elif [[ "${debugStages}" == true ]] && [[ -f "${xfilterDir}/${preEventHorizon}" ]]; then
   # Gravity needs to modify Blacklist/Whitelist/Wildcards
   echo -e "  ${INFO} Using cached Event Horizon list..."
   numberOf=$(printf "%'.0f" "$(wc -l < "${xfilterDir}/${preEventHorizon}")")
   echo -e "  ${INFO} ${COL_BLUE}${numberOf}${COL_NC} unique domains trapped in the Event Horizon"
+elif [[ "${listType}" == "whitelist" ]] && [[ "${debugStages}" == true ]]; then
+  # Gravity needs to recompile the cached blocklists against the modified Whitelist
+  gravity_GetCachedBlocklists
+  gravity_ProfileStage "consolidate" "${xfilterDir}/${matterAndLight}" gravity_ConsolidateDownloadedBlocklists
+  gravity_ProfileStage "sort" "${xfilterDir}/${preEventHorizon}" gravity_SortAndFilterConsolidatedList
 fi
 
 # Perform when downloading blocklists, or modifying the whitelist
 if [[ "${skipDownload}" == false ]] || [[ "${listType}" == "whitelist" ]]; then
-  gravity_Whitelist
+  if [[ "${debugStages}" == true ]]; then
+    gravity_ProfileStage "whitelist" "${xfilterDir}/${whitelistMatter}" gravity_Whitelist
+  elif [[ "${skipDownload}" == false ]] || ! gravity_ProfileStage "whitelist" "" gravity_ApplyWhitelistDelta; then
+    # Gravity needs to recompile the cached blocklists against the modified Whitelist
+    if [[ "${skipDownload}" == true ]]; then
+      gravity_GetCachedBlocklists
+    fi
+    gravity_ProfileStage "parse" "" gravity_ParseBlocklists
+    gravity_ProfileStage "index" "${queryIndex}" gravity_BuildQueryIndex
+    gravity_ProfileStage "compile" "${adList}" gravity_CompileGravity
+  fi
 fi
 
-convert_wildcard_to_regex
+gravity_ProfileStage "wildcards" "${regexFile}" convert_wildcard_to_regex
+gravity_ProfileStage "regex" "${regexCompiledFile}" gravity_CompileRegexFilters
 gravity_ShowBlockCount
 
 # Perform when downloading blocklists, or modifying the white/blacklist (not wildcards)
 if [[ "${skipDownload}" == false ]] || [[ "${listType}" == *"list" ]]; then
   str="Parsing domains into hosts format"
   echo -ne "  ${INFO} ${str}..."
+  stageStart=$(gravity_ProfileNow)
 
   gravity_ParseUserDomains
 
   # Perform when downloading blocklists
   if [[ ! "${listType:-}" == "blacklist" ]]; then
     gravity_ParseLocalDomains
-    gravity_ParseBlacklistDomains
+    # gravity_CompileGravity has already created $adList, unless compiling in stages
+    if [[ "${debugStages}" == true ]]; then
+      gravity_ParseBlacklistDomains
+    fi
   fi
 
   echo -e "${OVER}  ${TICK} ${str}"
+  gravity_ProfileRecord "hosts" "${stageStart}" "$(gravity_ProfileNow)"
 
-  gravity_Cleanup
+  gravity_ProfileStage "binary" "${binaryList}" gravity_BuildBinaryList
+  gravity_ProfileStage "cleanup" "" gravity_Cleanup
 fi
 
 echo ""
 
+# Precompute the metadata shown by the Block Page, such as the adlist URLs and X-filter version
+gravity_ProfileStage "blockpage" "" "${XFILTER_ROOT}/opt/xfilter/blockpage.sh"
+
 # Determine if DNS has been restarted by this instance of gravity
 if [[ -z "${dnsWasOffline:-}" ]]; then
   # Use "force-reload" when restarting dnsmasq for everything but Wildcards
-  "${XFILTER_COMMAND}" restartdns "${dnsRestartType:-force-reload}"
+  gravity_ProfileStage "reload" "" "${XFILTER_COMMAND}" restartdns "${dnsRestartType:-force-reload}"
 fi
+gravity_ProfileFinish
 "${XFILTER_COMMAND}" status
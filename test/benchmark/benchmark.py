@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+'''
+Benchmark gravity, query.sh and list.sh against a synthetic corpus.
+
+The scripts in this checkout are installed within a scratch XFILTER_ROOT, in
+which xfilter does not restart DNS, so an installed X-filter is left untouched.
+Adlists are served from file:// URLs, so neither Docker, root nor a network
+connection is needed.
+
+    benchmark.py [--size 100k] [--repeat 3] [--output results.json]
+                 [--baseline baseline.json]
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCHMARK_DIR))
+
+SETUPVARS = '''\
+XFILTER_INTERFACE=lo
+IPV4_ADDRESS=127.0.0.1/8
+IPV6_ADDRESS=
+BLOCKING_ENABLED=true
+'''
+
+STUB = '''\
+#!/bin/bash
+# DNS is not restarted within the benchmark
+case "${{1}}" in
+  restartdns|status|enable|disable) exit 0;;
+esac
+exec bash "{repo}/xfilter" "$@"
+'''
+
+REGEX = ['(^|\\.)wild-bench\\.com$', '^ad[0-9]+\\.', 'tracker']
+
+QUERY_SAMPLES = 20
+
+
+def default_sigpipe():
+    # Python 2 ignores SIGPIPE, which its children would otherwise inherit,
+    # e.g. making "grep | head" slow
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def run(command, root):
+    env = dict(os.environ, XFILTER_ROOT=root)
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(['bash', root + command[0]] + command[1:],
+                               env=env, stdout=devnull, stderr=devnull,
+                               preexec_fn=default_sigpipe)
+
+
+def timed(command, root):
+    start = time.time()
+    status = run(command, root)
+    elapsed = (time.time() - start) * 1000
+    if status != 0:
+        raise RuntimeError('{} exited with {}'.format(' '.join(command),
+                                                      status))
+    return elapsed
+
+
+def summarise(samples, **extra):
+    ordered = sorted(samples)
+    p95 = min(int(len(ordered) * 0.95), len(ordered) - 1)
+    result = {
+        'runs': [int(round(s)) for s in samples],
+        'median_ms': int(round(ordered[len(ordered) // 2])),
+        'p95_ms': int(round(ordered[p95])),
+    }
+    result.update(extra)
+    return result
+
+
+def write(path, content, mode=0o644):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, mode)
+
+
+def setup_root(root, lists):
+    '''
+    Install the scripts of this checkout within root, as installScripts would
+    '''
+    for directory in ('etc/xfilter', 'etc/dnsmasq.d', 'opt/xfilter',
+                      'usr/local/bin', 'var/run', 'var/log'):
+        os.makedirs(os.path.join(root, directory))
+    etc = os.path.join(root, 'etc', 'xfilter')
+    opt = os.path.join(root, 'opt', 'xfilter')
+
+    os.symlink(os.path.join(REPO_DIR, 'gravity.sh'),
+               os.path.join(opt, 'gravity.sh'))
+    scripts = os.path.join(REPO_DIR, 'advanced', 'Scripts')
+    for script in os.listdir(scripts):
+        os.symlink(os.path.join(scripts, script), os.path.join(opt, script))
+    write(os.path.join(root, 'usr', 'local', 'bin', 'xfilter'),
+          STUB.format(repo=REPO_DIR), 0o755)
+
+    write(os.path.join(etc, 'setupVars.conf'), SETUPVARS)
+    write(os.path.join(etc, 'adlists.list'),
+          ''.join('file://{}\n'.format(lists[name]) for name in sorted(lists)))
+    shutil.copy(os.path.join(os.path.dirname(lists['hosts']), 'whitelist.txt'),
+                os.path.join(etc, 'whitelist.txt'))
+    write(os.path.join(etc, 'blacklist.txt'), 'black-bench.com\n')
+    write(os.path.join(etc, 'regex.list'), '\n'.join(REGEX) + '\n')
+
+
+def gravity_stages(root):
+    '''
+    The stages of the last gravity run, from the run history kept by
+    gravity.sh
+    '''
+    stages = {}
+    with open(os.path.join(root, 'etc', 'xfilter', 'gravity.history')) as f:
+        lines = [line.rstrip('\n').split('\t') for line in f]
+    last = lines[-1][0]
+    for fields in lines:
+        if fields[0] != last or ' ' in fields[1]:
+            continue
+        peak = None if fields[7] == '-' else int(fields[7])
+        stages[fields[1]] = (int(fields[2]), peak)
+    return stages
+
+
+def bench_gravity(root, repeat, results):
+    samples = {}
+    for _ in range(repeat):
+        timed(['/opt/xfilter/gravity.sh'], root)
+        for stage, (ms, peak) in gravity_stages(root).items():
+            samples.setdefault(stage, []).append((ms, peak))
+    for stage, runs in samples.items():
+        peaks = [peak for _, peak in runs if peak is not None]
+        results['gravity.' + stage] = summarise(
+            [ms for ms, _ in runs], peak_rss_kb=max(peaks) if peaks else None)
+
+
+def bench_query(root, domains, results):
+    kinds = {
+        'query.exact': lambda d: [d, '-exact'],
+        'query.scan': lambda d: [d.split('.', 1)[-1]],
+        'query.wildcard': lambda d: ['sub{}.wild-bench.com'.format(len(d))],
+        'query.blockpage': lambda d: [d, '-bp'],
+    }
+    for kind, arguments in sorted(kinds.items()):
+        results[kind] = summarise(
+            [timed(['/opt/xfilter/query.sh'] + arguments(d), root)
+             for d in domains])
+
+
+def bench_list(root, domains, repeat, results):
+    path = os.path.join(root, 'bulk.txt')
+    with open(path, 'w') as f:
+        f.write('\n'.join(domains) + '\n')
+    add, remove = [], []
+    for _ in range(repeat):
+        add.append(timed(['/opt/xfilter/list.sh', '-w', '--from-file', path,
+                          '-nr', '-q'], root))
+        remove.append(timed(['/opt/xfilter/list.sh', '-w', '-d',
+                             '--from-file', path, '-nr', '-q'], root))
+    results['list.bulk_add'] = summarise(add, domains=len(domains))
+    results['list.bulk_delete'] = summarise(remove, domains=len(domains))
+
+    # Whitelisting the domains, then applying them to gravity.list
+    run(['/opt/xfilter/list.sh', '-w', '--from-file', path, '-nr', '-q'], root)
+    results['gravity.whitelist_only'] = summarise(
+        [timed(['/opt/xfilter/gravity.sh', '-w'], root)])
+
+
+def benchmark(args):
+    size = corpus.parse_size(args.size)
+    directory = os.path.join(args.corpus, args.size)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    if not os.path.exists(manifest_path) or manifest['seed'] != args.seed:
+        print('Generating a corpus of {} entries in {}'.format(
+            size, directory))
+        manifest = corpus.generate(size, directory, args.seed)
+    lists = dict((name, os.path.join(directory, name + '.txt'))
+                 for name in dict(corpus.LISTS))
+
+    rng = random.Random(args.seed)
+    sample = [corpus.domain(corpus.randindex(rng, manifest['pool']))
+              for _ in range(QUERY_SAMPLES)]
+    bulk = [corpus.domain(corpus.randindex(rng, manifest['pool']))
+            for _ in range(args.bulk)]
+
+    results = {}
+    root = tempfile.mkdtemp(prefix='xfilter-benchmark.')
+    try:
+        setup_root(root, lists)
+        print('Benchmarking gravity ({} runs)'.format(args.repeat))
+        bench_gravity(root, args.repeat, results)
+        print('Benchmarking query.sh ({} domains per query type)'.format(
+            len(sample)))
+        bench_query(root, sample, results)
+        print('Benchmarking list.sh ({} domains)'.format(len(bulk)))
+        bench_list(root, bulk, args.repeat, results)
+    finally:
+        shutil.rmtree(root)
+
+    return {
+        'size': args.size,
+        'corpus': manifest,
+        'started': int(time.time()),
+        'system': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    '''
+    Print each benchmark against the baseline, returning the names of those
+    which have regressed
+    '''
+    regressed = []
+    print('{:<28} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline ms',
+                                              'current ms', 'ratio'))
+    for name in sorted(current['results']):
+        now = current['results'][name]['median_ms']
+        before = baseline['results'].get(name, {}).get('median_ms')
+        if before is None:
+            print('{:<28} {:>12} {:>12} {:>8}'.format(name, '-', now, '-'))
+            continue
+        ratio = float(now) / before if before else 1.0
+        # Differences of a few milliseconds are noise, however large the ratio
+        flag = ''
+        if ratio > threshold and now - before > 50:
+            flag = '  REGRESSED'
+            regressed.append(name)
+        print('{:<28} {:>12} {:>12} {:>8.2f}{}'.format(name, before, now,
+                                                       ratio, flag))
+    return regressed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark gravity, query.sh and list.sh')
+    parser.add_argument('--size', default='100k',
+                        help='corpus size, e.g. 100k, 1M or 10M '
+                             '(default: 100k)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='corpus random seed (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each gravity and list.sh benchmark '
+                             '(default: 3)')
+    parser.add_argument('--bulk', type=int, default=1000,
+                        help='domains per list.sh bulk edit (default: 1000)')
+    parser.add_argument('--corpus',
+                        default=os.path.join(BENCHMARK_DIR, 'corpus'),
+                        help='corpus directory')
+    parser.add_argument('--output',
+                        help='file to write the results to '
+                             '(default: results/<size>-<time>.json)')
+    parser.add_argument('--baseline',
+                        help='results to compare against, failing if any '
+                             'benchmark has regressed')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='ratio to the baseline median at which a '
+                             'benchmark has regressed (default: 1.25)')
+    args = parser.parse_args(argv[1:])
+
+    current = benchmark(args)
+    name = '{}-{}.json'.format(args.size, current['started'])
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results', name)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as f:
+        json.dump(current, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+    print('Results written to {}'.format(output))
+
+    baseline = {'results': {}}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressed = compare(current, baseline, args.threshold)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+'''
+Generate a synthetic, reproducible blocklist corpus for the benchmarks.
+
+A corpus of N entries is split across a hosts list, a plain domain list, an
+Adblock list and a URL list. Domains are drawn from a shared pool with a
+popular head, so lists overlap and contain duplicates much as real ones do,
+and the whitelist mostly holds domains which are present in the lists.
+
+    corpus.py [--seed 1] 100k /path/to/corpus
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import sys
+
+SYLLABLES = ['ad', 'be', 'co', 'da', 'ex', 'fi', 'go', 'hu', 'in', 'jo',
+             'ka', 'lu', 'me', 'no', 'ox', 'pi', 'qu', 'ra', 'si', 'tu',
+             'ul', 'vi', 'wo', 'xe', 'yo', 'za']
+SUBDOMAINS = ['', '', '', 'www.', 'ads.', 'cdn.', 'track.', 'stats.',
+              'pixel.', 'metrics.', 'a1.', 'static.', 'img.']
+TLDS = ['com', 'net', 'org', 'io', 'info', 'biz', 'co.uk', 'de', 'ru', 'xyz']
+
+# Share of the entries in each list, and of the pool which is popular
+LISTS = [('hosts', 0.35), ('domains', 0.30), ('adblock', 0.20), ('urls', 0.15)]
+UNIQUE_RATIO = 0.7
+POPULAR_RATIO = 0.1
+POPULAR_CHANCE = 0.3
+NOISE_CHANCE = 0.01
+
+
+def parse_size(size):
+    '''
+    "100k", "1M" and "10M" are accepted, as well as plain numbers
+    '''
+    multipliers = {'k': 1000, 'm': 1000000}
+    suffix = size[-1:].lower()
+    if suffix in multipliers:
+        return int(float(size[:-1]) * multipliers[suffix])
+    return int(size)
+
+
+def base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    out = ''
+    while True:
+        number, digit = divmod(number, 36)
+        out = digits[digit] + out
+        if not number:
+            return out
+
+
+def domain(index):
+    '''
+    The domain for each index of the pool, which is unique as the word
+    before the index is always four letters long
+    '''
+    word = SYLLABLES[(index // 7) % 26] + SYLLABLES[(index // 53) % 26]
+    return '{}{}{}.{}'.format(SUBDOMAINS[index % 13], word, base36(index),
+                              TLDS[(index // 3) % 10])
+
+
+def randindex(rng, length):
+    '''
+    As random.randrange, but the same for Python 2 and 3, whose randrange
+    and choice differ
+    '''
+    return int(rng.random() * length)
+
+
+def pick(rng, choices):
+    return choices[randindex(rng, len(choices))]
+
+
+def noise(rng):
+    return pick(rng, ['localhost', '127.0.0.1', 'local', '_invalid_.com',
+                      'broadcasthost', '0.0.0.0', 'ip6-localhost'])
+
+
+def format_entry(kind, name, rng):
+    if kind == 'hosts':
+        return '{} {}'.format(pick(rng, ['0.0.0.0', '127.0.0.1']), name)
+    if kind == 'adblock':
+        return '||{}^{}'.format(name, pick(rng, ['', '', '', '$third-party']))
+    if kind == 'urls':
+        path = pick(rng, ['', 'ad.js', 'p?x=1', 'track/1'])
+        return 'https://{}/{}'.format(name, path)
+    return name
+
+
+def headers(kind):
+    if kind == 'adblock':
+        return ['[Adblock Plus 2.0]', '! Title: Benchmark corpus']
+    if kind == 'urls':
+        return []
+    return ['# Benchmark corpus ({})'.format(kind), '']
+
+
+def generate(entries, directory, seed=1):
+    rng = random.Random(seed)
+    pool = max(int(entries * UNIQUE_RATIO), 1)
+    popular = max(int(pool * POPULAR_RATIO), 1)
+    counts = {}
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for kind, share in LISTS:
+        path = os.path.join(directory, kind + '.txt')
+        count = int(entries * share)
+        with open(path, 'w') as f:
+            for line in headers(kind):
+                f.write(line + '\n')
+            for _ in range(count):
+                if rng.random() < NOISE_CHANCE:
+                    f.write(format_entry(kind, noise(rng), rng) + '\n')
+                    continue
+                if rng.random() < POPULAR_CHANCE:
+                    index = randindex(rng, popular)
+                else:
+                    index = randindex(rng, pool)
+                f.write(format_entry(kind, domain(index), rng) + '\n')
+            if kind == 'adblock':
+                # Exception rules, which remove domains from this list
+                for _ in range(max(count // 1000, 1)):
+                    f.write('@@||{}^\n'.format(domain(randindex(rng, pool))))
+        counts[kind] = count
+
+    # Most of the whitelist overlaps with the popular domains, the rest is not
+    # blocked at all
+    whitelist = min(max(pool // 1000, 100), 5000)
+    with open(os.path.join(directory, 'whitelist.txt'), 'w') as f:
+        for _ in range(int(whitelist * 0.9)):
+            f.write(domain(randindex(rng, popular)) + '\n')
+        for index in range(int(whitelist * 0.1)):
+            f.write(domain(pool + index) + '\n')
+    counts['whitelist'] = whitelist
+
+    manifest = {'entries': entries, 'pool': pool, 'seed': seed,
+                'lists': counts}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+    return manifest
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic blocklist corpus')
+    parser.add_argument('size', help='number of entries, e.g. 100k, 1M or 10M')
+    parser.add_argument('directory', help='directory to write the lists to')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed (default: 1)')
+    args = parser.parse_args(argv[1:])
+
+    manifest = generate(parse_size(args.size), args.directory, args.seed)
+    print(json.dumps(manifest, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
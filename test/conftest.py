@@ -1,10 +1,31 @@
+import gzip
+import hashlib
+import io
+import os
 import pytest
+import subprocess
 import testinfra
+import threading
+import time
 from textwrap import dedent
 
-check_output = testinfra.get_backend(
-    "local://"
-).get_module("Command").check_output
+try:
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+def check_output(command, *args):
+    '''
+    runs a command on the local host, looked up when first needed so that
+    the Docker-free fixtures do not require a testinfra backend
+    '''
+    return testinfra.get_backend(
+        "local://"
+    ).get_module("Command").check_output(command, *args)
+
 
 SETUPVARS = {
     'XFILTER_INTERFACE': 'eth99',
@@ -17,9 +38,9 @@ SETUPVARS = {
 4.2.2.1, and 4.2.2.2 are Century Link DNS servers
 '''
 
-tick_box = "[\x1b[1;32m\xe2\x9c\x93\x1b[0m]".decode("utf-8")
-cross_box = "[\x1b[1;31m\xe2\x9c\x97\x1b[0m]".decode("utf-8")
-info_box = "[i]".decode("utf-8")
+tick_box = u"[\x1b[1;32m\u2713\x1b[0m]"
+cross_box = u"[\x1b[1;31m\u2717\x1b[0m]"
+info_box = u"[i]"
 
 
 @pytest.fixture
@@ -47,6 +68,35 @@ def Xfilter(Docker):
     return Docker
 
 
+@pytest.fixture
+def xfilter_root(request, tmpdir):
+    '''
+    a throwaway install of this checkout within tmpdir, which the scripts use
+    through XFILTER_ROOT, so that they can be run without Docker
+    '''
+    root = XfilterRoot(str(tmpdir))
+    request.addfinalizer(root.stop)
+    return root
+
+
+@pytest.fixture
+def list_server(request):
+    '''
+    an HTTP server on 127.0.0.1, serving blocklists to gravity and recording
+    the requests made for them
+    '''
+    server = ListServer(('127.0.0.1', 0), ListHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def teardown():
+        server.shutdown()
+        server.server_close()
+    request.addfinalizer(teardown)
+    return server
+
+
 @pytest.fixture
 def Docker(request, args, image, cmd):
     '''
@@ -157,3 +207,208 @@ def run_script(Xfilter, script):
     result = Xfilter.run(script)
     assert result.rc == 0
     return result
+
+
+# A stubbed xfilter-FTL, which logs how it was called instead of managing DNS
+FTL_STUB = '''\
+#!/bin/bash
+echo "$(basename "$0") $@" >> "${XFILTER_ROOT}/var/log/xfilter-FTL.stub"
+'''
+
+
+class FTLHandler(socketserver.StreamRequestHandler):
+    '''
+    answers FTL API requests from XfilterRoot.ftl_replies
+    '''
+    def handle(self):
+        for line in iter(self.rfile.readline, b''):
+            command = line.decode('utf-8').strip().lstrip('>')
+            if command == 'quit':
+                break
+            reply = self.server.replies.get(command, '')
+            self.wfile.write((reply + '---EOM---\n\n').encode('utf-8'))
+
+
+class FTLServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ListHandler(BaseHTTPRequestHandler):
+    '''
+    serves ListServer.lists with an ETag, answering 304 when it is sent back,
+    and gzip encoded when the client accepts it
+    '''
+    def do_GET(self):
+        headers = dict((k.lower(), v) for k, v in self.headers.items())
+        with self.server.lock:
+            self.server.requests.append((self.path, headers))
+            self.server.active += 1
+            self.server.most_active = max(self.server.most_active,
+                                          self.server.active)
+        try:
+            time.sleep(self.server.delay)
+            self.respond(headers)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def respond(self, headers):
+        failures = self.server.failures.get(self.path)
+        if failures:
+            self.send_error(failures.pop(0))
+            return
+        if self.path not in self.server.lists:
+            self.send_error(404)
+            return
+
+        content = self.server.lists[self.path].encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+        if headers.get('if-none-match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        if 'gzip' in headers.get('accept-encoding', ''):
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(content)
+            content = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ListServer(socketserver.ThreadingMixIn, HTTPServer):
+    '''
+    lists maps a path to the blocklist served there, and failures a path to
+    the HTTP error codes returned for it before it is served
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args):
+        HTTPServer.__init__(self, *args)
+        self.lists = {}
+        self.failures = {}
+        self.delay = 0
+        self.requests = []
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1], path)
+
+
+class RunResult(object):
+    def __init__(self, rc, stdout, stderr):
+        self.rc = rc
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class XfilterRoot(object):
+    '''
+    The scripts of this checkout installed within a directory, with an FTL
+    API served from ftl_replies, and xfilter-FTL, service and killall stubbed
+    '''
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def __init__(self, path):
+        self.path = path
+        for directory in ['etc/xfilter', 'etc/dnsmasq.d', 'opt/xfilter',
+                          'usr/local/bin', 'usr/bin', 'var/run', 'var/log']:
+            os.makedirs(self.file(directory))
+
+        scripts = os.path.join(self.repo, 'advanced', 'Scripts')
+        for script in os.listdir(scripts):
+            os.symlink(os.path.join(scripts, script),
+                       self.file('opt/xfilter', script))
+        os.symlink(os.path.join(self.repo, 'gravity.sh'),
+                   self.file('opt/xfilter/gravity.sh'))
+        self.write('usr/local/bin/xfilter', 'exec bash {} "$@"\n'.format(
+            os.path.join(self.repo, 'xfilter')))
+        os.chmod(self.file('usr/local/bin/xfilter'), 0o755)
+        for stub in ['xfilter-FTL', 'service', 'killall', 'sudo']:
+            self.stub(stub, FTL_STUB)
+
+        self.write('etc/xfilter/setupVars.conf', dedent('''\
+            XFILTER_INTERFACE=lo
+            IPV4_ADDRESS=127.0.0.1/8
+            IPV6_ADDRESS=
+            BLOCKING_ENABLED=true
+            QUERY_LOGGING=true
+            '''))
+        self.write('etc/dnsmasq.d/01-xfilter.conf', 'log-queries\n')
+        for name in ['adlists.list', 'whitelist.txt', 'blacklist.txt',
+                     'regex.list']:
+            self.write(os.path.join('etc/xfilter', name), '')
+
+        self.ftl_replies = {}
+        self.ftl = FTLServer(('127.0.0.1', 0), FTLHandler)
+        self.ftl.replies = self.ftl_replies
+        self.write('var/run/xfilter-FTL.port',
+                   '{}\n'.format(self.ftl.server_address[1]))
+        thread = threading.Thread(target=self.ftl.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def file(self, *path):
+        return os.path.join(self.path, *path)
+
+    def read(self, path):
+        with open(self.file(path)) as f:
+            return f.read()
+
+    def write(self, path, content):
+        with open(self.file(path), 'w') as f:
+            f.write(content)
+
+    def append(self, path, content):
+        with open(self.file(path), 'a') as f:
+            f.write(content)
+
+    def stub(self, command, content):
+        '''
+        writes an executable which is found on PATH before command
+        '''
+        self.write(os.path.join('usr/bin', command), content)
+        os.chmod(self.file('usr/bin', command), 0o755)
+
+    def add_adlist(self, name, content):
+        '''
+        writes a blocklist within the root, served to gravity by a file:// URL
+        '''
+        self.write(name, content)
+        self.append('etc/xfilter/adlists.list',
+                    'file://{}\n'.format(self.file(name)))
+
+    def gravity(self, options=''):
+        return self.run('bash "${XFILTER_ROOT}"/opt/xfilter/gravity.sh ' +
+                        options)
+
+    def xfilter(self, arguments):
+        return self.run('bash "${XFILTER_ROOT}"/usr/local/bin/xfilter ' +
+                        arguments)
+
+    def run(self, command):
+        env = dict(os.environ, XFILTER_ROOT=self.path,
+                   PATH=self.file('usr/bin') + os.pathsep + os.environ['PATH'])
+        process = subprocess.Popen(['bash', '-c', command], env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        return RunResult(process.returncode, stdout.decode('utf-8'),
+                         stderr.decode('utf-8'))
+
+    def stop(self):
+        self.ftl.shutdown()
+        self.ftl.server_close()
@@ -0,0 +1,796 @@
+import json
+import os
+import pytest
+import sqlite3
+import time
+from textwrap import dedent
+
+HOSTS_LIST = dedent('''\
+    # Hosts list
+    0.0.0.0 ads.example.com
+    0.0.0.0 tracker.example.net
+    127.0.0.1 localhost
+    ''')
+
+ADBLOCK_LIST = dedent('''\
+    [Adblock Plus 2.0]
+    ! Adblock list
+    ||ads.example.com^
+    ||pixel.example.org^$third-party
+    ''')
+
+DNSMASQ_LIST = dedent('''\
+    # dnsmasq list
+    address=/dnsmasq.example.com/0.0.0.0
+    address=/.first.example.net/second.example.net/
+    server=/example.org/127.0.0.1
+    ''')
+
+DIG_STUB = '''\
+#!/bin/bash
+echo "dig $*" >> "${XFILTER_ROOT}/var/log/dig.stub"
+if [[ "$*" == *"@"* ]]; then
+  echo 127.0.0.1
+elif [[ "$*" == *"blocked.example"* ]]; then
+  echo ";; ->>HEADER<<- opcode: QUERY, status: NOERROR, id: 1"
+  echo "blocked.example. 2 IN A 0.0.0.0"
+fi
+'''
+
+
+@pytest.fixture
+def gravity_root(xfilter_root):
+    '''
+    an xfilter_root whose gravity.list has been compiled from HOSTS_LIST
+    '''
+    xfilter_root.add_adlist('hosts.txt', HOSTS_LIST)
+    assert xfilter_root.gravity().rc == 0
+    return xfilter_root
+
+
+def gravity_domains(xfilter_root):
+    return set(line.split()[-1] for line in
+               xfilter_root.read('etc/xfilter/gravity.list').splitlines()
+               if line and not line.startswith('#'))
+
+
+def test_gravity_compiles_local_adlists(xfilter_root):
+    '''
+    confirm gravity runs within XFILTER_ROOT, without DNS or the network
+    '''
+    xfilter_root.add_adlist('hosts.txt', HOSTS_LIST)
+    xfilter_root.add_adlist('adblock.txt', ADBLOCK_LIST)
+    xfilter_root.write('etc/xfilter/whitelist.txt', 'tracker.example.net\n')
+
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert gravity_domains(xfilter_root) == set(['ads.example.com',
+                                                 'pixel.example.org'])
+    # DNS is started through the stubbed service, as xfilter-FTL is not running
+    assert 'service xfilter-FTL start' in xfilter_root.read(
+        'var/log/xfilter-FTL.stub')
+
+
+def test_gravity_parses_dnsmasq_and_adblock_exceptions(xfilter_root):
+    '''
+    confirm dnsmasq lists are parsed, and Adblock exception rules are applied
+    '''
+    xfilter_root.add_adlist('dnsmasq.txt', DNSMASQ_LIST)
+    xfilter_root.add_adlist('adblock.txt',
+                            ADBLOCK_LIST + '@@||pixel.example.org^\n')
+
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert 'Format: Dnsmasq (3 accepted, 1 rejected, 0 exceptions)' in \
+        gravity.stdout
+    assert 'Format: Adblock (1 accepted, 0 rejected, 1 exceptions)' in \
+        gravity.stdout
+    assert gravity_domains(xfilter_root) == set(['dnsmasq.example.com',
+                                                 'first.example.net',
+                                                 'second.example.net',
+                                                 'ads.example.com'])
+
+
+def test_gravity_skips_parsing_unchanged_lists(gravity_root):
+    '''
+    confirm a list whose content is unchanged is not parsed again
+    '''
+    meta = gravity_root.read('etc/xfilter/list.0.local.meta')
+    assert 'length={}\n'.format(len(HOSTS_LIST)) in meta
+
+    gravity = gravity_root.gravity()
+    assert gravity.rc == 0
+    assert 'Content unchanged' in gravity.stdout
+    assert 'Format: Hosts' not in gravity.stdout
+
+    gravity_root.write('hosts.txt', HOSTS_LIST + '0.0.0.0 new.example.com\n')
+    gravity = gravity_root.gravity()
+    assert 'Content unchanged' not in gravity.stdout
+    assert 'new.example.com' in gravity_domains(gravity_root)
+
+
+def test_downloads_are_concurrent_compressed_and_conditional(
+        xfilter_root, list_server):
+    '''
+    confirm lists are downloaded GRAVITY_DOWNLOAD_WORKERS at a time and gzip
+    encoded, retried after server errors, and only downloaded again once they
+    have changed
+    '''
+    xfilter_root.stub('dig', DIG_STUB)
+    xfilter_root.append('etc/xfilter/setupVars.conf',
+                        'GRAVITY_DOWNLOAD_WORKERS=2\n'
+                        'GRAVITY_DOWNLOAD_RETRIES=1\n')
+    paths = ['/hosts0', '/hosts1', '/hosts2']
+    for i, path in enumerate(paths):
+        list_server.lists[path] = '0.0.0.0 ads{}.example.com\n'.format(i)
+        xfilter_root.append('etc/xfilter/adlists.list',
+                            list_server.url(path) + '\n')
+    list_server.failures['/hosts2'] = [503]
+    list_server.delay = 0.5
+
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert 'Downloading 3 blocklists (2 concurrent downloads)' in \
+        gravity.stdout
+    assert 'Retrying (1/1)' in gravity.stdout
+    assert list_server.most_active == 2
+    assert all('gzip' in headers.get('accept-encoding', '')
+               for _, headers in list_server.requests)
+    assert gravity_domains(xfilter_root) == set(['ads0.example.com',
+                                                 'ads1.example.com',
+                                                 'ads2.example.com'])
+
+    # Lists are requested with the ETag they were last served with, and only
+    # the changed list is sent again
+    list_server.requests[:] = []
+    list_server.delay = 0
+    list_server.lists['/hosts1'] = '0.0.0.0 ads3.example.com\n'
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert gravity.stdout.count('No changes detected') == 2
+    assert all('if-none-match' in headers
+               for _, headers in list_server.requests)
+    assert gravity_domains(xfilter_root) == set(['ads0.example.com',
+                                                 'ads2.example.com',
+                                                 'ads3.example.com'])
+
+
+def test_compressed_lists_are_queried(xfilter_root):
+    '''
+    confirm lists kept compressed are parsed and queried transparently
+    '''
+    xfilter_root.append('etc/xfilter/setupVars.conf',
+                        'GRAVITY_COMPRESS_LISTS=gzip\n')
+    xfilter_root.add_adlist('hosts.txt', HOSTS_LIST)
+    assert xfilter_root.gravity().rc == 0
+    domains = xfilter_root.file('etc/xfilter/list.0.local.domains')
+    with open(domains, 'rb') as f:
+        assert f.read(2) == b'\x1f\x8b'
+    assert gravity_domains(xfilter_root) == set(['ads.example.com',
+                                                 'tracker.example.net'])
+
+    query = xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/query.sh tracker')
+    assert 'Match found in list.0.local.domains' in query.stdout
+    assert 'tracker.example.net' in query.stdout
+
+
+def test_query_and_list_within_root(gravity_root):
+    '''
+    confirm query.sh and list.sh use the lists within XFILTER_ROOT
+    '''
+    query = gravity_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/query.sh ads.example.com -exact')
+    assert 'Exact match for ads.example.com found in' in query.stdout
+    assert 'list.0.local.domains' in query.stdout
+    # Queries which are not exact match the domain as a substring, whether or
+    # not the index exists
+    query = gravity_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/query.sh xample.com')
+    assert 'ads.example.com' in query.stdout
+
+    gravity_root.write('domains.txt', 'ads.example.com\n')
+    whitelist = gravity_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/list.sh -w --from-file '
+        '"${XFILTER_ROOT}"/domains.txt')
+    assert whitelist.rc == 0
+    assert 'ads.example.com' in gravity_root.read('etc/xfilter/whitelist.txt')
+    assert 'ads.example.com' not in gravity_domains(gravity_root)
+
+
+def test_list_changes_are_applied_in_one_batch(gravity_root):
+    '''
+    confirm domains read from stdin are validated and applied in one batch, and
+    that removal only matches whole entries
+    '''
+    gravity_root.write('etc/xfilter/blacklist.txt',
+                       'ads.example.com\nsub.ads.example.com\nevil.example\n')
+    gravity_list = gravity_root.file('etc/xfilter/gravity.list')
+    modified = os.stat(gravity_list).st_mtime
+    whitelist = gravity_root.run(
+        'printf "# comment\\nEvil.Example\\n  new.example\\n\\nnot valid!\\n'
+        'new.example\\n" | bash "${XFILTER_ROOT}"/opt/xfilter/list.sh -w '
+        '--noreload --from-file -')
+    assert whitelist.rc == 0
+    assert 'not valid! is not a valid argument or domain name!' in \
+        whitelist.stdout
+    assert 'Added 2 of 3 domains to whitelist' in whitelist.stdout
+    assert 'Removed 1 domains from blacklist' in whitelist.stdout
+    assert gravity_root.read('etc/xfilter/whitelist.txt') == \
+        'evil.example\nnew.example\n'
+    assert gravity_root.read('etc/xfilter/blacklist.txt') == \
+        'ads.example.com\nsub.ads.example.com\n'
+    assert os.stat(gravity_list).st_mtime == modified
+
+    remove = gravity_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/list.sh -b -d ads.example.com')
+    assert remove.rc == 0
+    assert gravity_root.read('etc/xfilter/blacklist.txt') == \
+        'sub.ads.example.com\n'
+    assert gravity_root.read('etc/xfilter/black.list') == \
+        'sub.ads.example.com\n'
+
+
+def test_regex_filters_are_compiled(xfilter_root):
+    '''
+    confirm regex filters are validated and prefiltered by gravity, and timed
+    by --regex-bench
+    '''
+    xfilter_root.add_adlist('hosts.txt', HOSTS_LIST)
+    xfilter_root.write('etc/xfilter/regex.list', dedent('''\
+        (^|\\.)wild\\.example$
+        ^ad[0-9]+\\.
+        [a-z]+[0-9]{2,}\\.net$
+        (broken
+        a|q
+        '''))
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert 'Invalid regex filter: (broken' in gravity.stdout
+    compiled = xfilter_root.read(
+        'etc/xfilter/regex.list.compiled').splitlines()
+    assert compiled == ['prefix\tad\t^ad[0-9]+\\.',
+                        'suffix\t.net\t[a-z]+[0-9]{2,}\\.net$',
+                        'group\t-\t(a|q)',
+                        'member\t-\ta|q']
+
+    query = xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/query.sh ad12.example.net')
+    assert '^ad[0-9]+\\.' in query.stdout
+    assert '[a-z]+[0-9]{2,}\\.net$' not in query.stdout
+    assert 'a|q' in query.stdout
+
+    xfilter_root.write('domains.txt', 'ad1.example.com\nwww99.net\nzz.xyz\n')
+    bench = xfilter_root.xfilter(
+        '--regex-bench "${XFILTER_ROOT}"/domains.txt')
+    assert bench.rc == 0
+    assert 'Timing 4 regex filters against 3 domains' in bench.stdout
+    assert '(alternation of 1 filters)' in bench.stdout
+
+
+def test_wildcards_are_queried_through_suffix_index(xfilter_root):
+    '''
+    confirm wildcard filters are indexed by their reversed labels, and still
+    matched once regex.list is newer
+    '''
+    xfilter_root.write('etc/xfilter/regex.list',
+                       '(^|\\.)wild\\.example$\n^ad[0-9]+\\.\n')
+    assert xfilter_root.gravity().rc == 0
+    assert xfilter_root.read('etc/xfilter/regex.list.suffixes') == \
+        'example.wild\t(^|\\.)wild\\.example$\n'
+    assert xfilter_root.read('etc/xfilter/regex.list.compiled') == \
+        'prefix\tad\t^ad[0-9]+\\.\n'
+
+    query = xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/query.sh sub.wild.example')
+    assert '*.wild.example' in query.stdout
+    assert 'Regex filters' not in query.stdout
+    assert 'No results found for notwild.example' in xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/query.sh notwild.example').stdout
+
+    # A stale index is not used, so the filter is matched as a pattern
+    regex_list = xfilter_root.file('etc/xfilter/regex.list')
+    os.utime(regex_list, (time.time() + 60, time.time() + 60))
+    query = xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/query.sh sub.wild.example')
+    assert '(^|\\.)wild\\.example$' in query.stdout
+
+
+def test_log_stats_resumes_from_checkpoint(xfilter_root):
+    '''
+    confirm log-stats summarises the query log, and only parses new lines once
+    the log is rotated
+    '''
+    xfilter_root.write('var/log/xfilter.log', dedent('''\
+        Oct 18 10:00:01 dnsmasq[1]: query[A] ads.example.com from 10.0.0.2
+        Oct 18 10:00:01 dnsmasq[1]: /etc/xfilter/gravity.list ads.example.com \
+is 0.0.0.0
+        Oct 18 10:00:02 dnsmasq[1]: query[AAAA] www.example.org from 10.0.0.3
+        Oct 18 10:00:02 dnsmasq[1]: forwarded www.example.org to 9.9.9.9
+        Oct 18 10:00:02 dnsmasq[1]: reply www.example.org is ::1
+        '''))
+    stats = xfilter_root.xfilter('log-stats --json')
+    assert stats.rc == 0
+    summary = json.loads(stats.stdout)
+    assert summary['types'] == {'A': 1, 'AAAA': 1}
+    assert summary['status'] == {'blocked': 1, 'forwarded': 1}
+    assert summary['top_blocked'] == [['ads.example.com', 1]]
+
+    # The log is rotated as by "xfilter flush once", then a query is added to
+    # each log
+    log = xfilter_root.read('var/log/xfilter.log')
+    query = ('Oct 18 10:00:03 dnsmasq[1]: query[A] ads.example.com '
+             'from 10.0.0.2\n')
+    xfilter_root.write('var/log/xfilter.log.1', log + query)
+    xfilter_root.write('var/log/xfilter.log', ' \n' + query)
+    summary = json.loads(xfilter_root.xfilter('log-stats --json').stdout)
+    assert summary['lines'] == 8
+    assert summary['top_domains'][0] == ['ads.example.com', 3]
+
+    client = json.loads(
+        xfilter_root.xfilter('log-stats --client 10.0.0.3 --json').stdout)
+    assert client['queries'] == 1
+
+
+def test_blockpage_manifest(xfilter_root):
+    '''
+    confirm the Block Page metadata is written by gravity, and when the admin
+    contact or the adlists change
+    '''
+    xfilter_root.add_adlist('hosts.txt', HOSTS_LIST)
+    xfilter_root.append('etc/xfilter/adlists.list',
+                        'https://example.com/hosts?a="b"\n')
+    assert xfilter_root.gravity().rc == 0
+    manifest = json.loads(xfilter_root.read('etc/xfilter/blockpage.json'))
+    assert manifest['lists_generated'] is True
+    assert manifest['adlists'] == ['https://example.com/hosts?a="b"']
+    assert manifest['list_count'] == 4
+    assert manifest['admin_email'] == ''
+
+    assert xfilter_root.xfilter('-a -e admin@example.com').rc == 0
+    manifest = json.loads(xfilter_root.read('etc/xfilter/blockpage.json'))
+    assert manifest['admin_email'] == 'admin@example.com'
+
+    assert xfilter_root.xfilter(
+        '-a adlist add https://example.net/hosts').rc == 0
+    manifest = json.loads(xfilter_root.read('etc/xfilter/blockpage.json'))
+    assert manifest['adlists'] == ['https://example.com/hosts?a="b"',
+                                   'https://example.net/hosts']
+
+
+def test_chronometer_queries_stubbed_ftl(xfilter_root):
+    '''
+    confirm the chronometer reads FTL's port from within XFILTER_ROOT
+    '''
+    xfilter_root.ftl_replies['stats'] = dedent('''\
+        domains_being_blocked 2
+        dns_queries_today 10
+        ads_blocked_today 4
+        ads_percentage_today 40.000000
+        ''')
+    chronometer = xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/chronometer.sh -j')
+    assert json.loads(chronometer.stdout) == {
+        'domains_being_blocked': 2,
+        'dns_queries_today': 10,
+        'ads_blocked_today': 4,
+        'ads_percentage_today': 40.0
+    }
+
+
+def test_chronometer_streams_json_fields(xfilter_root):
+    '''
+    confirm --interval streams one timestamped JSON object per line, with only
+    the requested fields
+    '''
+    xfilter_root.ftl_replies.update({'stats': 'dns_queries_today 10\n',
+                                     'top-ads (1)': '0 8 ads.example.com\n'})
+    stream = xfilter_root.run(
+        'timeout 1 bash "${XFILTER_ROOT}"/opt/xfilter/chronometer.sh -j '
+        '-i 0.2 -f dns_queries_today,top_ad,top_client,status')
+    samples = [json.loads(line) for line in stream.stdout.splitlines()]
+    assert len(samples) >= 2
+    assert samples[1]['timestamp'] >= samples[0]['timestamp']
+    for sample in samples:
+        del sample['timestamp']
+        assert sample == {'dns_queries_today': 10,
+                          'top_ad': 'ads.example.com',
+                          'top_client': None, 'status': 'enabled'}
+
+    fields = xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/chronometer.sh -j '
+        '-f dns_queries_today,bogus')
+    assert fields.rc == 1
+    assert 'Unknown field: bogus' in fields.stderr
+
+
+def test_gravity_builds_binary_list(xfilter_root):
+    '''
+    confirm gravity.bin holds the domains of gravity.list and black.list, and
+    is rejected once corrupted
+    '''
+    xfilter_root.add_adlist('hosts.txt', HOSTS_LIST)
+    xfilter_root.write('etc/xfilter/blacklist.txt',
+                       'evil.example\nads.example.com\n')
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert 'Building binary blocklist' in gravity.stdout
+
+    blocklist = 'python3 "${XFILTER_ROOT}"/opt/xfilter/xfilterBlocklist.py '
+    verify = xfilter_root.run(blocklist + 'verify')
+    assert verify.rc == 0
+    assert 'Generation 1: 3 domains' in verify.stdout
+    lookup = xfilter_root.run(
+        blocklist + 'lookup ads.example.com evil.example localhost')
+    assert 'ads.example.com: gravity.list, black.list' in lookup.stdout
+    assert 'evil.example: black.list' in lookup.stdout
+    assert 'localhost: not blocked' in lookup.stdout
+
+    assert xfilter_root.gravity().rc == 0
+    assert 'Generation 2: 3 domains' in \
+        xfilter_root.run(blocklist + 'verify').stdout
+
+    # While blocking is disabled, gravity.bin is built from the backups of the
+    # lists, which are moved back once it is enabled
+    xfilter_root.ftl_replies.update({'disable': 'disabled\n',
+                                     'enable': 'enabled\n'})
+    stub_ftl_process(xfilter_root, os.getpid())
+    assert xfilter_root.xfilter('disable').rc == 0
+    assert xfilter_root.run(blocklist + 'verify').rc == 0
+    assert xfilter_root.gravity().rc == 0
+    verify = xfilter_root.run(blocklist + 'verify')
+    assert verify.rc == 0
+    assert 'Generation 3: 3 domains' in verify.stdout
+    assert xfilter_root.xfilter('enable').rc == 0
+    assert xfilter_root.run(blocklist + 'verify').rc == 0
+
+    # gravity.list being rewritten at the same size, and within the same
+    # second, is detected. Python 2 cannot set modification times to the
+    # nanosecond, so this is done by Python 3
+    assert xfilter_root.run(
+        'python3 -c "import os, sys; s = os.stat(sys.argv[1]); '
+        'os.utime(sys.argv[1], ns=(s.st_atime_ns, s.st_mtime_ns + 1000))" '
+        '"${XFILTER_ROOT}"/etc/xfilter/gravity.list').rc == 0
+    verify = xfilter_root.run(blocklist + 'verify')
+    assert verify.rc == 1
+    assert 'out of date' in verify.stdout
+
+    # A build which fails leaves neither gravity.bin nor its temporary file
+    # behind
+    xfilter_root.write('domains.txt', 'ads.example.com\tnot-a-flag\n')
+    assert xfilter_root.run(
+        blocklist + 'build "${XFILTER_ROOT}"/domains.txt '
+        '"${XFILTER_ROOT}"/new.bin').rc != 0
+    assert not os.path.exists(xfilter_root.file('new.bin'))
+    assert not os.path.exists(xfilter_root.file('new.bin.tmp'))
+
+    with open(xfilter_root.file('etc/xfilter/gravity.bin'), 'r+b') as f:
+        f.seek(-1, 2)
+        f.write(b'\x01')
+    verify = xfilter_root.run(blocklist + 'verify')
+    assert verify.rc == 1
+    assert 'does not match its checksum' in verify.stdout
+
+
+def test_gravity_sort_options(xfilter_root):
+    '''
+    confirm the bounds set on gravity's sorts are reported with the peak
+    memory use, and that an unusable spill directory falls back to the default
+    '''
+    xfilter_root.add_adlist('hosts.txt', HOSTS_LIST)
+    os.makedirs(xfilter_root.file('spill'))
+    xfilter_root.append('etc/xfilter/setupVars.conf', dedent('''\
+        GRAVITY_SORT_MEMORY=1M
+        GRAVITY_SORT_TMPDIR={}
+        GRAVITY_SORT_PARALLEL=1
+        '''.format(xfilter_root.file('spill'))))
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert '(sort -S 1M -T {} --parallel=1)'.format(
+        xfilter_root.file('spill')) in gravity.stdout
+    assert gravity_domains(xfilter_root) == set(['ads.example.com',
+                                                 'tracker.example.net'])
+
+    xfilter_root.append('etc/xfilter/setupVars.conf',
+                        'GRAVITY_SORT_TMPDIR=/nonexistent\n')
+    gravity = xfilter_root.gravity()
+    assert 'GRAVITY_SORT_TMPDIR /nonexistent is not a writable directory' in \
+        gravity.stdout
+    assert '(sort -S 1M --parallel=1)' in gravity.stdout
+
+
+def test_gravity_profile_history_and_report(gravity_root):
+    '''
+    confirm each gravity run is recorded in gravity.history, and that --report
+    flags a stage which regressed
+    '''
+    history = [line.split('\t') for line in
+               gravity_root.read('etc/xfilter/gravity.history').splitlines()]
+    stages = [entry[1] for entry in history]
+    assert 'transfer list.0.local' in stages
+    assert stages[-1] == 'total'
+    assert not os.path.exists(gravity_root.file('etc/xfilter/gravity.profile'))
+    assert not os.path.exists(
+        gravity_root.file('etc/xfilter/gravity.profile.rss'))
+
+    # A later run whose parse took a minute longer
+    run = str(int(history[0][0]) + 1000)
+    slower = []
+    for row in history:
+        took = str(int(row[2]) + 60000) if row[1] == 'parse' else row[2]
+        slower.append([run, row[1], took] + row[3:])
+    gravity_root.append('etc/xfilter/gravity.history',
+                        ''.join('\t'.join(entry) + '\n' for entry in slower))
+    report = gravity_root.gravity('--report')
+    assert report.rc == 0
+    assert 'Comparing the last 2 gravity runs' in report.stdout
+    assert 'parse time regressed' in report.stdout
+    assert 'total time regressed' not in report.stdout
+
+
+def test_benchmark_corpus_is_reproducible_and_compiles(xfilter_root):
+    '''
+    confirm the benchmark corpus is the same for a seed, is compiled by
+    gravity, and that regressions are flagged
+    '''
+    benchmark = os.path.join(xfilter_root.repo, 'test', 'benchmark')
+    for directory in ['corpus', 'again']:
+        assert xfilter_root.run(
+            'python3 "{}"/corpus.py 2k "${{XFILTER_ROOT}}"/{}'.format(
+                benchmark, directory)).rc == 0
+    manifest = json.loads(xfilter_root.read('corpus/manifest.json'))
+    names = [kind + '.txt' for kind in manifest['lists']] + ['manifest.json']
+    for name in names:
+        assert xfilter_root.read(os.path.join('corpus', name)) == \
+            xfilter_root.read(os.path.join('again', name))
+
+    for name in ['hosts', 'domains', 'adblock', 'urls']:
+        xfilter_root.add_adlist(
+            name + '.txt',
+            xfilter_root.read(os.path.join('corpus', name + '.txt')))
+    gravity = xfilter_root.gravity()
+    assert gravity.rc == 0
+    assert 'Format: Adblock' in gravity.stdout
+    assert 100 < len(gravity_domains(xfilter_root)) <= manifest['pool']
+
+    compare = xfilter_root.run(dedent('''\
+        cd "{}" && python3 -c '
+        import benchmark
+        def result(**medians):
+            return {{"results": dict((k, {{"median_ms": v}})
+                                     for k, v in medians.items())}}
+        print(benchmark.compare(result(gravity=900, query=30, new=5),
+                                result(gravity=600, query=10), 1.25))'
+        '''.format(benchmark)))
+    # The query took three times as long, but only by 20ms
+    assert compare.stdout.splitlines()[-1] == "['gravity']"
+
+
+def test_whitelist_delta_replaces_gravity_list(gravity_root):
+    '''
+    confirm whitelist changes are applied by replacing gravity.list with a
+    sorted copy, which verifies
+    '''
+    gravity_root.write('etc/xfilter/whitelist.txt', 'tracker.example.net\n')
+    gravity = gravity_root.gravity('--skip-download --whitelist-only')
+    assert '(1 added, 0 removed)' in gravity.stdout
+    assert gravity_root.read('etc/xfilter/gravity.list') == 'ads.example.com\n'
+
+    gravity_root.write('etc/xfilter/whitelist.txt', '')
+    gravity = gravity_root.gravity('--skip-download --whitelist-only')
+    assert '(0 added, 1 removed)' in gravity.stdout
+    assert gravity_root.read('etc/xfilter/gravity.list') == \
+        'ads.example.com\ntracker.example.net\n'
+    verify = gravity_root.gravity('--verify')
+    assert 'Verifying gravity.list against a full recompile' in verify.stdout
+    assert verify.rc == 0
+
+
+def test_log_flush_prunes_database_in_batches(xfilter_root):
+    '''
+    confirm flushing prunes queries in batches, and only converts the database
+    to incremental vacuuming on request
+    '''
+    xfilter_root.write('etc/xfilter/xfilter-FTL.conf', 'MAXDBDAYS=1\n')
+    xfilter_root.append('etc/xfilter/setupVars.conf',
+                        'DATABASE_PRUNE_BATCH=2\n')
+    database = xfilter_root.file('etc/xfilter/xfilter-FTL.db')
+    now = int(time.time())
+    db = sqlite3.connect(database)
+    db.execute('CREATE TABLE queries (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+               'timestamp INTEGER NOT NULL, domain TEXT)')
+    db.executemany('INSERT INTO queries (timestamp, domain) VALUES (?, ?)',
+                   [(now - 3 * 86400, 'old.example')] * 5 +
+                   [(now - 60, 'new.example')] * 3)
+    db.commit()
+    db.close()
+
+    def query(sql):
+        db = sqlite3.connect(database)
+        try:
+            return db.execute(sql).fetchone()[0]
+        finally:
+            db.close()
+
+    flush = xfilter_root.run(
+        'bash "${XFILTER_ROOT}"/opt/xfilter/xfilterLogFlush.sh once')
+    assert flush.rc == 0
+    assert 'Deleted 5 queries from database' in flush.stdout
+    assert 'Reclaimed -' not in flush.stdout
+    assert query('SELECT COUNT(*) FROM queries '
+                 'WHERE domain = "new.example"') == 3
+
+    flush = xfilter_root.xfilter('flush')
+    assert 'Deleted 3 queries from database' in flush.stdout
+    assert query('PRAGMA auto_vacuum') == 0
+
+    assert xfilter_root.xfilter('flush vacuum').rc == 0
+    assert query('PRAGMA auto_vacuum') == 2
+
+
+def stub_ftl_process(xfilter_root, pid):
+    '''
+    makes pidof report a running xfilter-FTL, whose /proc entry is that of pid
+    '''
+    xfilter_root.stub('pidof', 'echo {}\n'.format(pid))
+
+
+def test_blocking_switched_by_ftl_persists(xfilter_root):
+    '''
+    confirm FTL switches blocking without re-reading the lists, while the
+    swapped lists keep it off after a restart
+    '''
+    xfilter_root.write('etc/xfilter/gravity.list', 'ads.example.com\n')
+    xfilter_root.ftl_replies.update({'disable': 'disabled\n',
+                                     'enable': 'enabled\n'})
+    stub_ftl_process(xfilter_root, os.getpid())
+
+    assert xfilter_root.xfilter('disable').rc == 0
+    assert 'BLOCKING_ENABLED=false' in \
+        xfilter_root.read('etc/xfilter/setupVars.conf')
+    assert xfilter_root.read('etc/xfilter/gravity.list.bck') == \
+        'ads.example.com\n'
+    assert xfilter_root.read('etc/xfilter/gravity.list').strip() == ''
+    assert xfilter_root.xfilter('enable').rc == 0
+    assert xfilter_root.read('etc/xfilter/gravity.list') == \
+        'ads.example.com\n'
+    assert not os.path.exists(xfilter_root.file('var/log/xfilter-FTL.stub'))
+
+    # Once FTL has been restarted, it only holds the empty lists, so enabling
+    # blocking re-reads them
+    assert xfilter_root.xfilter('disable').rc == 0
+    stub_ftl_process(xfilter_root, os.getppid())
+    assert xfilter_root.xfilter('enable').rc == 0
+    assert 'killall -s SIGHUP' in \
+        xfilter_root.read('var/log/xfilter-FTL.stub')
+
+
+def test_blocking_switched_by_swapping_lists(xfilter_root):
+    '''
+    confirm blocking is switched by swapping the lists when FTL does not
+    acknowledge the command
+    '''
+    xfilter_root.write('etc/xfilter/gravity.list', 'ads.example.com\n')
+    xfilter_root.ftl_replies['disable'] = 'unknown command\n'
+    stub_ftl_process(xfilter_root, os.getpid())
+
+    assert xfilter_root.xfilter('disable').rc == 0
+    assert xfilter_root.read('etc/xfilter/gravity.list.bck') == \
+        'ads.example.com\n'
+    assert 'killall -s SIGHUP' in \
+        xfilter_root.read('var/log/xfilter-FTL.stub')
+    assert not os.path.exists(
+        xfilter_root.file('var/run/xfilter-FTL.disabled'))
+
+    assert xfilter_root.xfilter('enable').rc == 0
+    assert xfilter_root.read('etc/xfilter/gravity.list') == \
+        'ads.example.com\n'
+    assert xfilter_root.read('var/log/xfilter-FTL.stub').count(
+        'killall -s SIGHUP') == 2
+
+
+def test_source_domains_resolved_upstream_only_when_blocked(xfilter_root):
+    '''
+    confirm a blocklist source domain is only looked up upstream when the
+    local resolver blocks it
+    '''
+    xfilter_root.stub('dig', DIG_STUB)
+    xfilter_root.append('etc/xfilter/setupVars.conf',
+                        'XFILTER_DNS_1=9.9.9.9\n')
+    xfilter_root.append('etc/xfilter/adlists.list',
+                        'https://blocked.example/hosts\n'
+                        'https://allowed.example/hosts\n')
+
+    gravity = xfilter_root.gravity()
+    assert 'Resolving 2 blocklist source domains' in gravity.stdout
+    lookups = xfilter_root.read('var/log/dig.stub').splitlines()
+    assert [lookup for lookup in lookups
+            if 'allowed.example' in lookup and '@' in lookup] == []
+    assert [lookup for lookup in lookups
+            if 'blocked.example' in lookup and '@9.9.9.9' in lookup] != []
+
+
+def test_exporter_caches_metrics(gravity_root):
+    '''
+    confirm the Prometheus exporter renders FTL and gravity metrics, and
+    queries FTL at most once per interval
+    '''
+    gravity_root.ftl_replies.update({
+        'stats': 'dns_queries_today 10\nads_blocked_today 4\nstatus enabled\n',
+        'top-ads (2)': '0 8 ads.example.com\n1 2 "quoted".example\n'})
+    exporter = gravity_root.run(dedent('''\
+        cd "${XFILTER_ROOT}"/opt/xfilter && python3 -c '
+        import xfilterExporter
+        metrics = xfilterExporter.Metrics(interval=60, top=2)
+        text = metrics.text()
+        print(text)
+        # FTL is not queried again within the interval
+        metrics.ftl.query = None
+        print(metrics.text() == text)'
+        '''))
+    text, cached = exporter.stdout.rsplit('\n', 2)[:2]
+    metrics = [line for line in text.splitlines()
+               if line and not line.startswith('#')]
+    assert 'xfilter_up 1' in metrics
+    assert 'xfilter_dns_queries_total 10' in metrics
+    assert 'xfilter_blocking_enabled 1' in metrics
+    assert 'xfilter_top_ads{domain="ads.example.com"} 8' in metrics
+    assert 'xfilter_top_ads{domain="\\"quoted\\".example"} 2' in metrics
+    assert 'xfilter_gravity_domains 2' in metrics
+    assert '# TYPE xfilter_dns_queries_total counter' in text
+    assert cached == 'True'
+
+
+def test_python_scripts_read_root_from_setup_vars(xfilter_root):
+    '''
+    confirm the Python scripts find XFILTER_ROOT in setupVars.conf when it is
+    not in the environment
+    '''
+    setup_vars = xfilter_root.file('etc/xfilter/setupVars.conf')
+    with open(setup_vars, 'a') as f:
+        f.write('XFILTER_ROOT={}\n'.format(xfilter_root.path))
+    command = ('python3 -c "import sys; sys.path.insert(0, sys.argv[1]); '
+               'import xfilterRoot; print(repr(xfilterRoot.xfilter_root('
+               'setup_vars=sys.argv[2])))" "{}" "{}"'.format(
+                   xfilter_root.file('opt/xfilter'), setup_vars))
+    found = xfilter_root.run('env -u XFILTER_ROOT ' + command)
+    assert found.stdout.strip() == repr(xfilter_root.path)
+    # As for the shell scripts, an empty XFILTER_ROOT in the environment is an
+    # install in "/"
+    found = xfilter_root.run('XFILTER_ROOT= ' + command)
+    assert found.stdout.strip() == repr('')
+
+
+def test_debug_diagnostics_time_out_in_order(xfilter_root):
+    '''
+    confirm xfilter debug stops diagnostics exceeding DIAGNOSTIC_TIMEOUT with
+    the processes they started, while the others carry on, and logs each in
+    the order given, marking where a timed out diagnostic was cut off
+    '''
+    debug = xfilter_root.run(dedent('''\
+        PH_TEST=true source "${XFILTER_ROOT}"/opt/xfilter/xfilterDebug.sh
+        DIAGNOSTIC_WORKERS=2
+        DIAGNOSTIC_TIMEOUT=1
+        hung() {
+          echo_current_diagnostic "Hung"; log_write "hung started"
+          printf "hung partial" | tee -a /proc/${BASHPID}/fd/3
+          sleep 29.5; log_write "hung finished"
+        }
+        quick() { log_write "quick finished"; }
+        slow() { sleep 0.5; log_write "slow finished"; }
+        make_temporary_log
+        SECONDS=0
+        run_diagnostics hung quick slow > /dev/null
+        echo "${SECONDS} seconds"
+        cat /proc/$$/fd/3
+        pgrep -x -f "sleep 29.5" || echo "hung stopped"
+        '''))
+    assert int(debug.stdout.split()[0]) < 5
+    log = debug.stdout.split('\n', 1)[1]
+    positions = [log.index(line) for line in [
+        'Hung (timed out after 1s)\n', 'hung started', 'hung partial\n',
+        'hung did not finish within 1 seconds', 'quick finished',
+        'slow finished']]
+    assert positions == sorted(positions)
+    assert 'hung finished' not in log
+    assert 'hung stopped' in log